@@ -10,90 +10,355 @@
 # MEMORY vs. HISTORY (Key Design Difference)
 # -------------------------------------------
 # `memory` is used to construct prompts for LLMs (OpenAI, Gemini, Claude).
-# It contains only recent, relevant messages in a format expected by LangChain or OpenAI APIs.
-# Stored as `BaseMessage` objects, often trimmed to stay within token limits.
+# It contains only recent, relevant messages, as `Message` objects (see chat_message.py) that
+# convert to LangChain/provider formats on demand. Trimmed to stay within token limits.
 #
 # `history` stores the full transcript of the conversation — every message, from both user and assistant.
 # It includes timestamps, message roles, sources (text/voice), and mode context.
 # Useful for logging, replaying, and analyzing conversations.
 #
-# This class ensures both are written to disk under a per-user JSON file inside `user_data/`.
+# Both are persisted through the configured storage backend (Firestore or SQLite, see storage.py).
 
 import os
 # import json
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
-from langchain.schema import BaseMessage
-from firebase_db import db # This import is for Firebase Firestore database connection 
+from chat_message import Message
+from storage import get_storage
+from write_behind import write_behind
+from usage_rollups import rollups
+from instrumentation import span
+from memory_manager import MemoryManager
+from prompts import MODE_PROMPTS
+from config import PROFILE_CACHE_TTL_SECONDS, PROFILE_CACHE_MAX_USERS
+from config import FREE_TIER_REPLY_LIMIT, QUOTA_REVALIDATE_MARGIN, QUOTA_CACHE_TTL_SECONDS
+from config import WRITE_BEHIND, RAW_METRIC_EVENTS
 
 USER_DATA_DIR = "user_data"
 os.makedirs(USER_DATA_DIR, exist_ok=True)
 
+# ======================== #
+#  Profile Cache           #
+# ======================== #
+# A single text message reads `BotUser.mode` several times (mode check in the handler,
+# ConversationManager, history and metric logging). Without a cache, each access is a
+# storage round-trip. This per-process cache keeps the profile dict of recently active
+# users in memory, keyed by chat id, with TTL expiry and LRU eviction.
+# The cache is write-through: the `mode` setter updates storage and then the cached entry.
+
+class ProfileCache:
+    def __init__(self, ttl_seconds=PROFILE_CACHE_TTL_SECONDS, max_entries=PROFILE_CACHE_MAX_USERS):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # user_id -> (expires_at, profile dict)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        """Return a copy of the cached profile, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, user_id, profile):
+        """Store a profile, evicting the least recently used entries beyond capacity."""
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl_seconds, dict(profile))
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def update(self, user_id, fields):
+        """Merge fields into a cached profile (write-through); drop the entry if it is not cached."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            profile = dict(entry[1])
+            profile.update(fields)
+            self._entries[user_id] = (time.monotonic() + self.ttl_seconds, profile)
+            self._entries.move_to_end(user_id)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters for monitoring."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+            }
+
+
+profile_cache = ProfileCache()  # Shared by every BotUser in this process
+
+# ======================== #
+#  Usage Quota Cache       #
+# ======================== #
+# The free-tier gate runs before every turn. The LLM usage counter only ever grows, so once
+# we have read it we can keep counting locally and skip the read while the user is far from
+# the limit. Storage stays the source of truth: the counter is incremented by the backend
+# (atomic, no lost updates when two messages race), and the cached value is re-validated
+# when it gets close to the limit or too old.
+
+class UsageQuotaCache:
+    def __init__(self, ttl_seconds=QUOTA_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._counts = {}  # user_id -> (fetched_at, count)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, below=None):
+        """
+        Return the locally known usage count, or None if unknown or stale (a miss). With `below`,
+        a count that isn't below it is a miss too: close to the limit, storage must be re-read.
+        """
+        with self._lock:
+            entry = self._counts.get(user_id)
+            if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+                self._counts.pop(user_id, None)
+                self.misses += 1
+                return None
+            if below is not None and entry[1] >= below:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id, count):
+        with self._lock:
+            self._counts[user_id] = (time.monotonic(), count)
+
+    def increment(self, user_id, amount=1):
+        """Mirror a server-side increment locally (no-op if the count is not cached)."""
+        with self._lock:
+            entry = self._counts.get(user_id)
+            if entry is not None:
+                self._counts[user_id] = (entry[0], entry[1] + amount)
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._counts),
+            }
+
+
+usage_cache = UsageQuotaCache()
+
 class BotUser:
     def __init__(self, user_id):
         # """Initialize the BotUser with a user ID and load user data from disk."""
-        """Initialize the BotUser with a user ID and Firebase Firestore document reference."""
+        """Initialize the BotUser with a user ID and the process-wide storage backend."""
         self.user_id = str(user_id)
-        self.doc_ref = db.collection("users").document(self.user_id)
+        self.storage = get_storage()
+        self._memory_state = {}  # mode -> what is stored for it (turn counters, base), see `_read_mode_memory`
 
     def _load_or_init_profile(self):
-        """Load or initialize the user profile in Firestore."""
-        doc = self.doc_ref.get()
-        if not doc.exists:
-            self.doc_ref.set({
+        """
+        Load or initialize the user profile in storage.
+        Served from the process-wide profile cache when possible, so a turn costs at most one read.
+        """
+        profile = profile_cache.get(self.user_id)
+        if profile is not None:
+            return profile
+
+        with span("profile_read"):
+            profile = self.storage.load_profile(self.user_id)
+        if profile is None:
+            profile = {
                 "mode": None,
                 "created_at": datetime.utcnow().isoformat()
-            })
-        return self.doc_ref.get().to_dict()
+            }
+            self.storage.create_profile(self.user_id, profile)
+
+        profile_cache.put(self.user_id, profile)
+        return profile
     
     @property
     def mode(self):
-        """Get the current mode of the user from the loaded profile in Firestore."""
+        """Get the current mode of the user from the loaded profile."""
         profile = self._load_or_init_profile()
         return profile.get("mode")
 
     @mode.setter
     def mode(self, value):
-        """Set the current mode of the user and update it in Firestore."""
-        self.doc_ref.update({
+        """Set the current mode of the user and update it in storage (and the profile cache)."""
+        fields = {
             "mode": value,
             "last_active": datetime.utcnow().isoformat()
-        })
+        }
+        self._load_or_init_profile()  # A first-time user's /start must not update a missing profile
+        try:
+            self.storage.update_profile(self.user_id, fields)
+        except Exception:
+            profile_cache.invalidate(self.user_id)  # Don't keep serving a mode storage may not have
+            raise
+        profile_cache.update(self.user_id, fields)
+
+    # ------------------------------------------------------------------ #
+    # Memory storage (append-only), shown with its Firestore paths
+    # memory_snapshots/{mode}               head document:
+    #     base          leading system messages (mode prompt + running summary)
+    #     turn_count    number of turns ever appended
+    #     window_start  seq of the oldest turn still in the memory window
+    # memory_snapshots/{mode}/turns/{seq}   one document per turn (user message + AI reply)
+    # A normal turn writes one small turn document and a few head fields, so the write volume
+    # per turn is constant instead of growing with the conversation. `base` is only rewritten
+    # when it changes (e.g. the summary absorbs evicted turns). Heads that still hold the old
+    # full `messages` snapshot are read as-is and migrated on their next write.
+    # SQLite keeps the same head and turn records in tables (see sqlite_storage.py).
+    # ------------------------------------------------------------------ #
 
-    def get_memory(self):
-        """Retrieve the user's conversational memory from Firestore."""
-        mem_docs = self.doc_ref.collection("memory_snapshots").stream()
+    def get_memory(self, mode=None):
+        """
+        Retrieve the user's conversational memory from storage, as {mode: messages}.
+        With `mode`, only that mode's memory is read (one head document plus its window of
+        turns) and the other modes are left untouched; without it, every mode is loaded.
+        """
+        if mode is not None:
+            with span("memory_load", mode=mode):
+                head = self.storage.load_memory_head(self.user_id, mode)
+                return {mode: self._read_mode_memory(mode, head)} if head is not None else {}
+
+        heads = self.storage.load_memory_heads(self.user_id)
         return {
-            doc.id: doc.to_dict().get("messages", [])
-            for doc in mem_docs
+            mode: self._read_mode_memory(mode, head)
+            for mode, head in heads.items()
+        }
+
+    def reset_memory(self, mode):
+        """Clear one mode's memory back to its system prompt, without reading or touching other modes."""
+        self._load_memory_state(mode)
+        self.update_memory(mode, {mode: [Message("system", MODE_PROMPTS[mode])]})
+
+    def _read_mode_memory(self, mode, head):
+        """Rebuild one mode's memory window from its head and turn records."""
+
+        if "turn_count" not in head:  # Legacy full snapshot
+            self._memory_state[mode] = {"turn_count": 0, "window_start": 0, "window_turns": 0, "base": None, "legacy": True}
+            return [Message.coerce(msg) for msg in head.get("messages", [])]
+
+        turn_count, window_start = head["turn_count"], head["window_start"]
+        messages = [Message.from_record(record) for record in head.get("base", [])]
+        window_turns = 0
+        for turn in self.storage.load_memory_turns(self.user_id, mode, window_start):
+            if turn.get("seq", turn_count) >= turn_count:
+                break  # Not committed by the head (should not happen with batched writes)
+            messages.extend(Message.from_record(record) for record in turn.get("messages", []))
+            window_turns += 1
+
+        self._memory_state[mode] = {
+            "turn_count": turn_count,
+            "window_start": window_start,
+            "window_turns": window_turns,
+            "base": head.get("base", []),
+            "legacy": False,
+        }
+        return messages
+
+    def _load_memory_state(self, mode):
+        """Read a mode's head document when memory is written without having been read first."""
+        stored = self.storage.load_memory_head(self.user_id, mode)
+        head = stored or {}
+        self._memory_state[mode] = {
+            "turn_count": head.get("turn_count", 0),
+            "window_start": head.get("window_start", 0),
+            "window_turns": None,  # Unknown: forces a rebase
+            "base": head.get("base"),
+            "legacy": stored is not None and "turn_count" not in head,
+        }
+        return self._memory_state[mode]
+
+    def _write_memory(self, batch, mode, memory, evicted_turns=0, rebase=False):
+        """
+        Add the writes persisting `memory[mode]` to `batch` (a StorageBatch).
+        Normally only the newest turn is appended. If the in-memory window doesn't line up with
+        what was loaded (or `rebase` is set), the whole window is re-appended as new turns and
+        the window moved to start at them, so the stored memory always matches `memory[mode]`.
+        """
+        messages = memory.get(mode, [])
+        split = 0
+        while split < len(messages) and messages[split].role == "system":
+            split += 1
+        base = [msg.to_record() for msg in messages[:split]]  # Records are memoised per message
+        turns = MemoryManager.group_turns(messages[split:])
+
+        state = self._memory_state.get(mode) or self._load_memory_state(mode)
+        seq = state["turn_count"]
+        window_start = state["window_start"] + evicted_turns
+
+        expected = None if state["window_turns"] is None else state["window_turns"] - evicted_turns
+        if rebase or state["legacy"] or expected is None or len(turns) not in (expected, expected + 1):
+            new_turns, window_start = turns, seq
+        else:
+            new_turns = turns[expected:]  # The turn added since the memory was read (if any)
+
+        now = datetime.utcnow().isoformat()
+        for turn in new_turns:
+            batch.append_turn(self.user_id, mode, seq, {
+                "messages": [msg.to_record() for msg in turn],
+                "created_at": now
+            })
+            seq += 1
+
+        head = {
+            "turn_count": seq,
+            "window_start": window_start,
+            "updated_at": now
+        }
+        if base != state["base"]:
+            head["base"] = base
+        batch.set_memory_head(self.user_id, mode, head, drop_legacy=state["legacy"])
+
+        self._memory_state[mode] = {
+            "turn_count": seq,
+            "window_start": window_start,
+            "window_turns": len(turns),
+            "base": base,
+            "legacy": False,
         }
 
     def update_memory(self, mode, memory):
         """
         Update and persist the memory used to construct prompts for the LLM.
-        Each message must be serialized so it's JSON-safe.
-        """
-        messages = []
-        for msg in memory.get(mode, []):
-            if isinstance(msg, BaseMessage):
-                role = "user" if msg.type == "human" else msg.type  # Normalize 'human' → 'user'
-                messages.append({
-                    "role": role,  # ← explicitly renaming `type` → `role` as category
-                    "content": msg.content
-                })
-            elif isinstance(msg, dict) and "role" in msg:
-                messages.append(msg)
-
-        self.doc_ref.collection("memory_snapshots").document(mode).set({
-            "messages": messages,
-            "updated_at": datetime.utcnow().isoformat()
-        })
+        Replaces the stored window of `mode` with `memory[mode]` (e.g. after a reset).
+        """
+        batch = self.storage.batch()
+        self._write_memory(batch, mode, memory, rebase=True)
+        batch.commit()
 
-    def log_interaction(self, user_input, ai_reply, source="text", system_message=None):
+    def _build_history_entry(self, user_input, ai_reply, source="text", system_message=None, mode=None):
         """
-        Log a user interaction into the persistent history log in Firestore.
-        Includes user and AI messages, timestamp, and source (text/voice).
-        - Optionally includes a system message
-        - Each message includes a role: 'system', 'user', or 'ai'
+        Build a history_logs entry: the user and AI messages (each with its role, after an optional
+        system message), with the timestamp, mode and source ('text' or 'voice').
         """
         entries = []
 
@@ -113,43 +378,89 @@ class BotUser:
             "content": ai_reply
         })
 
-        entry = {
+        return {
             "timestamp": datetime.utcnow().isoformat(),
-            "mode": self.mode,
+            "mode": mode if mode is not None else self.mode,
             "source": source,  # 'text' or 'voice'
             "entries": entries
         }
 
-        self.doc_ref.collection("history_logs").add(entry)
+    def _build_metric_event(self, event_name="session_interaction", mode=None, usage=None):
+        """Build a minimal metric entry (event, mode and timestamp), with the turn's token usage if known."""
+        event = {
+            "event": event_name,
+            "mode": mode if mode is not None else self.mode,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        if usage:
+            event["usage"] = usage  # input / cached / uncached / cache_write / output token counts
+        return event
 
+    def commit_turn(self, mode, memory, user_input, ai_reply, source="text", event_name="session_interaction", evicted_turns=0, usage=None):
+        """
+        Persist everything a conversation turn produces in a single storage batch:
+        - the new memory turn of `mode` (`evicted_turns` older turns leave the window)
+        - the LLM usage counter increment (server-side, no read needed)
+        - the history_logs entry
+        - the daily usage rollup increments (see usage_rollups.py), including the LLM token `usage`
+        - only with RAW_METRIC_EVENTS: the metric event
+        One round-trip (a Firestore WriteBatch, or one SQLite transaction) instead of four-plus,
+        and either all writes land or none do. With WRITE_BEHIND, the history entry goes to the
+        write-behind buffer and the turn to the rollup aggregator instead, so only the writes
+        the next turn depends on happen before the reply.
+        """
+        batch = self.storage.batch()
+
+        self._write_memory(batch, mode, memory, evicted_turns=evicted_turns)
+        batch.increment_usage(self.user_id)
+        entry = self._build_history_entry(user_input, ai_reply, source=source, mode=mode)
+        if WRITE_BEHIND:
+            write_behind.add_history(self.user_id, entry)
+            rollups.record_turn(self.user_id, mode, source, usage)
+        else:
+            batch.add_history(self.user_id, entry)
+            rollup_day = rollups.apply_turn(batch, self.user_id, mode, source, usage)
+        if RAW_METRIC_EVENTS:
+            event = self._build_metric_event(event_name, mode=mode, usage=usage)
+            if WRITE_BEHIND:
+                write_behind.add_metric(self.user_id, event)
+            else:
+                batch.add_metric(self.user_id, event)
+
+        with span("persistence", mode=mode, provider=(usage or {}).get("provider")):
+            batch.commit()
+            if not WRITE_BEHIND:
+                rollups.record_active(self.storage, self.user_id, mode, rollup_day)
+        usage_cache.increment(self.user_id)
 
-    def log_metric_event(self, event_name="session_interaction"):
+
+    def commit_compaction(self, mode, memory, evicted_turns):
         """
-        Save a minimal metric entry to Firestore.
-        Logs the user's current mode and timestamp.
+        Persist a compaction of `mode`'s memory (see ConversationManager.compact_memory): the
+        window moves past the `evicted_turns` oldest turns and the new summary is stored in the
+        head. No turn is added.
         """
-        print("📊 Logging minimal metric event to Firestore...")
-        self.doc_ref.collection("metrics").add({
-            "event": event_name,
-            "mode": self.mode,
-            "timestamp": datetime.utcnow().isoformat()
-        })
+        batch = self.storage.batch()
+        self._write_memory(batch, mode, memory, evicted_turns=evicted_turns)
+        with span("persistence", mode=mode):
+            batch.commit()
 
 
     def get_llm_usage_count(self):
         """
-        Retrieve the LLM usage count from Firestore.
+        Retrieve the LLM usage count from storage.
         Returns the count of LLM interactions for this user.
         """
-        doc = self.doc_ref.collection("metrics").document("llm_usage").get()
-        return doc.to_dict().get("count", 0) if doc.exists else 0
+        count = self.storage.get_usage_count(self.user_id)
+        usage_cache.put(self.user_id, count)
+        return count
 
-    def increment_llm_usage_count(self):
+    def has_reached_free_limit(self, limit=FREE_TIER_REPLY_LIMIT):
         """
-        Increment the LLM usage count in Firestore.
-        This is used to track how many times the LLM has been used by this user.
+        Check the free-tier quota, usually without touching storage.
+        The cached count is trusted while it is more than QUOTA_REVALIDATE_MARGIN replies
+        below the limit; near the limit (or when unknown/stale) the counter is re-read.
         """
-        usage_ref = self.doc_ref.collection("metrics").document("llm_usage")
-        doc = usage_ref.get()
-        current = doc.to_dict().get("count", 0) if doc.exists else 0
-        usage_ref.set({"count": current + 1})
+        if usage_cache.get(self.user_id, below=limit - QUOTA_REVALIDATE_MARGIN) is not None:
+            return False
+        return self.get_llm_usage_count() >= limit
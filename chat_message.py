@@ -0,0 +1,63 @@
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+# ======================== #
+#  Chat Message            #
+# ======================== #
+# The one message type used for memory by BotUser, ConversationManager, MemoryManager and
+# LLMRouter. A mode's memory is a list of `Message`s:
+#   [system prompt, (running summary), user, ai, user, ai, ...]
+# Messages are created once (when memory is loaded from storage, or when a turn adds one)
+# and never modified, so their conversions are computed once and kept on the message:
+#   - `to_record()`     the stored form, {"role", "content"} (Firestore, SQLite, JSON)
+#   - `to_langchain()`  the LangChain message sent to OpenAI/Claude
+# Memory stays in memory across a turn, so the prompt, the cache key, the token budget and
+# the write of the new turn all reuse the same objects instead of converting the whole list.
+
+LANGCHAIN_TYPES = {"system": SystemMessage, "user": HumanMessage, "ai": AIMessage}
+
+
+class Message:
+    __slots__ = ("role", "content", "_record", "_langchain")
+
+    def __init__(self, role, content):
+        self.role = role  # 'system', 'user' or 'ai'
+        self.content = content if isinstance(content, str) else str(content)
+        self._record = None
+        self._langchain = None
+
+    @classmethod
+    def from_record(cls, record):
+        """From a stored {"role", "content"} dict (which is kept as its `to_record()`)."""
+        msg = cls(record.get("role", ""), record.get("content", ""))
+        if isinstance(record.get("content"), str):
+            msg._record = record
+        return msg
+
+    @classmethod
+    def coerce(cls, msg):
+        """Accept a Message, a stored dict or a LangChain message (e.g. from older code paths)."""
+        if isinstance(msg, Message):
+            return msg
+        if isinstance(msg, BaseMessage):
+            return cls("user" if msg.type == "human" else msg.type, msg.content)
+        return cls.from_record(msg)
+
+    def to_record(self):
+        if self._record is None:
+            self._record = {"role": self.role, "content": self.content}
+        return self._record
+
+    def to_langchain(self):
+        if self._langchain is None:
+            # Unknown roles (e.g. replies stored as "assistant" by hand) are sent as AI messages
+            self._langchain = LANGCHAIN_TYPES.get(self.role, AIMessage)(content=self.content)
+        return self._langchain
+
+    def __eq__(self, other):
+        return isinstance(other, Message) and self.role == other.role and self.content == other.content
+
+    def __hash__(self):
+        return hash((self.role, self.content))
+
+    def __repr__(self):
+        return f"Message({self.role!r}, {self.content!r})"
@@ -0,0 +1,133 @@
+import time
+import asyncio
+import functools
+from contextlib import asynccontextmanager
+from config import CHAT_MAX_PENDING, SCHEDULER_MAX_PENDING, LLM_MAX_CONCURRENCY, WHISPER_MAX_CONCURRENCY
+
+# ======================== #
+#  Chat Scheduler          #
+# ======================== #
+# Updates are handled concurrently (see TELEGRAM_CONCURRENT_UPDATES), which is what we want
+# across users, but two quick messages from the same chat must not run at the same time:
+# both would read the same memory, and one turn would be lost when they write it back.
+# The scheduler:
+#   - runs work for one chat strictly in arrival order (a FIFO lock per chat id), while
+#     different chats run in parallel
+#   - caps in-flight LLM calls and Whisper jobs process-wide (semaphores)
+#   - applies backpressure: when a chat (or the whole process) has too many updates waiting,
+#     new ones are rejected right away with a "busy" reply instead of piling up
+#   - keeps queue-depth and wait-time counters (`stats()`)
+
+BUSY_MESSAGE = "⏳ I'm still working on your previous messages. Please wait a moment and try again."
+
+
+class SchedulerBusy(Exception):
+    """Raised when a chat's queue (or the global queue) is full."""
+
+
+class _ChatQueue:
+    __slots__ = ("lock", "pending")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()  # asyncio.Lock wakes waiters in FIFO order
+        self.pending = 0  # Updates of this chat running or waiting
+
+
+class ChatScheduler:
+    def __init__(self, max_pending_per_chat=CHAT_MAX_PENDING, max_pending_total=SCHEDULER_MAX_PENDING,
+                 llm_concurrency=LLM_MAX_CONCURRENCY, whisper_concurrency=WHISPER_MAX_CONCURRENCY):
+        self.max_pending_per_chat = max_pending_per_chat
+        self.max_pending_total = max_pending_total
+        self.llm_concurrency = llm_concurrency
+        self.whisper_concurrency = whisper_concurrency
+        self._chats = {}  # chat_id -> _ChatQueue, removed when the chat has nothing pending
+        self._llm_slots = asyncio.Semaphore(llm_concurrency)
+        self._whisper_slots = asyncio.Semaphore(whisper_concurrency)
+        self.pending_total = 0
+        self.llm_in_flight = 0
+        self.whisper_in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0  # Time spent waiting for the chat's earlier updates
+        self.max_chat_depth_seen = 0
+
+    @asynccontextmanager
+    async def chat_turn(self, chat_id):
+        """Run the body after every earlier update of `chat_id` has finished. Raises SchedulerBusy when full."""
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            queue = self._chats[chat_id] = _ChatQueue()
+        if queue.pending >= self.max_pending_per_chat or self.pending_total >= self.max_pending_total:
+            self.rejected += 1
+            if queue.pending == 0:
+                del self._chats[chat_id]
+            raise SchedulerBusy(chat_id)
+
+        queue.pending += 1
+        self.pending_total += 1
+        self.max_chat_depth_seen = max(self.max_chat_depth_seen, queue.pending)
+        queued_at = time.monotonic()
+        try:
+            async with queue.lock:
+                self.wait_seconds_total += time.monotonic() - queued_at
+                yield
+                self.completed += 1
+        finally:
+            queue.pending -= 1
+            self.pending_total -= 1
+            if queue.pending == 0 and self._chats.get(chat_id) is queue:
+                del self._chats[chat_id]
+
+    @asynccontextmanager
+    async def llm_slot(self):
+        """Hold one of the process-wide LLM call slots."""
+        async with self._llm_slots:
+            self.llm_in_flight += 1
+            try:
+                yield
+            finally:
+                self.llm_in_flight -= 1
+
+    @asynccontextmanager
+    async def whisper_slot(self):
+        """Hold one of the process-wide Whisper transcription slots."""
+        async with self._whisper_slots:
+            self.whisper_in_flight += 1
+            try:
+                yield
+            finally:
+                self.whisper_in_flight -= 1
+
+    def stats(self):
+        """Queue depth and concurrency counters for monitoring."""
+        depths = [queue.pending for queue in self._chats.values()]
+        return {
+            "active_chats": len(depths),
+            "pending_total": self.pending_total,
+            "max_chat_depth": max(depths, default=0),
+            "max_chat_depth_seen": self.max_chat_depth_seen,
+            "llm_in_flight": self.llm_in_flight,
+            "whisper_in_flight": self.whisper_in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_seconds": self.wait_seconds_total / self.completed if self.completed else 0.0,
+        }
+
+
+scheduler = ChatScheduler()  # Shared by all handlers in this process
+
+
+def serialized_per_chat(handler):
+    """
+    Decorator for Telegram handlers: run the handler in its chat's queue, or reply with
+    BUSY_MESSAGE if the queue is full. Don't nest decorated handlers (the per-chat lock is
+    not re-entrant).
+    """
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        try:
+            async with scheduler.chat_turn(update.message.chat_id):
+                return await handler(update, context)
+        except SchedulerBusy:
+            await update.message.reply_text(BUSY_MESSAGE)
+    return wrapper
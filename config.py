@@ -14,6 +14,7 @@ AI_PROVIDER = os.getenv("AI_PROVIDER", "openai")  # AI provider (default: OpenAI
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")  # OpenAI API key
 CLAUDE_API_KEY = os.getenv("CLAUDE_API_KEY")  # Claude API key
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")  # Load Gemini API key
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "models/gemini-1.5-pro-latest")  # Gemini model used when AI_PROVIDER=gemini
 
 TELEGRAM_API_TOKEN = os.getenv("TELEGRAM_API_TOKEN")  # Telegram bot API token
 
@@ -40,4 +41,123 @@ WHITELISTED_USER_IDS = os.getenv("WHITELISTED_USER_IDS", "").split(",")
 # Webhook is more efficient, but requires a public URL; Polling is easier to set up, but less efficient
 USE_WEBHOOK = os.getenv("USE_WEBHOOK", "false").lower() == "true"
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
-PORT = int(os.getenv("PORT", 8080))  # Default to 8080 (used by Cloud Run)
\ No newline at end of file
+PORT = int(os.getenv("PORT", 8080))  # Default to 8080 (used by Cloud Run)
+
+# Per-process cache of user profiles (mode, created_at, ...) to avoid a Firestore read on every `BotUser.mode` access
+PROFILE_CACHE_TTL_SECONDS = float(os.getenv("PROFILE_CACHE_TTL_SECONDS", 300))  # How long a cached profile stays fresh
+PROFILE_CACHE_MAX_USERS = int(os.getenv("PROFILE_CACHE_MAX_USERS", 10000))  # LRU capacity (number of chat ids)
+
+# Free-tier quota: number of AI replies a non-whitelisted user gets
+FREE_TIER_REPLY_LIMIT = int(os.getenv("FREE_TIER_REPLY_LIMIT", 8))
+# The quota check is served from an in-process cache and only re-reads Firestore when the cached count
+# is within this many replies of the limit, or older than QUOTA_CACHE_TTL_SECONDS (other instances may have counted too)
+QUOTA_REVALIDATE_MARGIN = int(os.getenv("QUOTA_REVALIDATE_MARGIN", 2))
+QUOTA_CACHE_TTL_SECONDS = float(os.getenv("QUOTA_CACHE_TTL_SECONDS", 600))
+
+# HTTP connection pool for LLM clients (shared, keep-alive). Size it for the number of concurrent chats you expect.
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 100))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", 20))
+
+# Number of Telegram updates processed concurrently (python-telegram-bot processes them one by one by default)
+TELEGRAM_CONCURRENT_UPDATES = int(os.getenv("TELEGRAM_CONCURRENT_UPDATES", 64))
+
+# Stream AI replies into Telegram by progressively editing a placeholder message
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "true").lower() == "true"
+STREAM_EDIT_INTERVAL_SECONDS = float(os.getenv("STREAM_EDIT_INTERVAL_SECONDS", 1.0))  # Min delay between edits of one message
+
+# Conversation memory sent to the LLM: system prompt + running summary + most recent turns, kept under this many tokens
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", 8000))
+MEMORY_SUMMARY_MAX_TOKENS = int(os.getenv("MEMORY_SUMMARY_MAX_TOKENS", 600))  # Cap on the running summary
+MEMORY_COMPACT_TARGET_RATIO = float(os.getenv("MEMORY_COMPACT_TARGET_RATIO", 0.7))  # Compact down to this share of the budget
+
+# Worker threads for transcoding voice notes when Whisper rejects the original OGG/Opus audio
+VOICE_TRANSCODE_WORKERS = int(os.getenv("VOICE_TRANSCODE_WORKERS", 4))
+
+# Per-chat ordering and global concurrency limits (see chat_scheduler.py)
+CHAT_MAX_PENDING = int(os.getenv("CHAT_MAX_PENDING", 3))  # Updates one chat may have running or queued before we reply "busy"
+SCHEDULER_MAX_PENDING = int(os.getenv("SCHEDULER_MAX_PENDING", 500))  # Same, across all chats
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 32))  # In-flight LLM calls per process
+WHISPER_MAX_CONCURRENCY = int(os.getenv("WHISPER_MAX_CONCURRENCY", 8))  # In-flight Whisper transcriptions per process
+
+# LLM failover, retries and hedging (see routing_policy.py)
+# Providers to fall back to, in order, when AI_PROVIDER is failing or slow (only those with an API key are used)
+LLM_FALLBACK_PROVIDERS = [p.strip().lower() for p in os.getenv("LLM_FALLBACK_PROVIDERS", "").split(",") if p.strip()]
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", 30))  # Max wait for a provider's first token
+# Per-provider overrides, e.g. "openai=20,claude=40"
+LLM_PROVIDER_TIMEOUTS = {
+    name.strip().lower(): float(seconds)
+    for name, seconds in (item.split("=") for item in os.getenv("LLM_PROVIDER_TIMEOUTS", "").split(",") if "=" in item)
+}
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))  # Retries per provider on 429/5xx/timeouts
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", 0.5))  # Backoff: random(0, min(max, base * 2^n))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", 8))
+CIRCUIT_BREAKER_FAILURES = int(os.getenv("CIRCUIT_BREAKER_FAILURES", 5))  # Consecutive failures before a provider is skipped
+CIRCUIT_BREAKER_COOLDOWN_SECONDS = float(os.getenv("CIRCUIT_BREAKER_COOLDOWN_SECONDS", 30))
+# Hedged requests: if the primary has no first token by its p95 time-to-first-token, also ask the next provider
+LLM_HEDGE = os.getenv("LLM_HEDGE", "false").lower() == "true"
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", 4.0))  # Used until enough latency samples exist
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", 1.0))
+
+# Model tiers (see model_tiers.py): a fast, cheap model for short turns, the heavy model for in-depth work
+MODEL_TIERING = os.getenv("MODEL_TIERING", "true").lower() == "true"  # False: every turn uses the heavy tier
+MODEL_TIERS = {
+    "fast": {
+        "openai": os.getenv("OPENAI_FAST_MODEL", "gpt-4o-mini"),
+        "claude": os.getenv("CLAUDE_FAST_MODEL", "claude-3-5-haiku-20241022"),
+        "gemini": os.getenv("GEMINI_FAST_MODEL", "models/gemini-1.5-flash-latest"),
+    },
+    "heavy": {
+        "openai": os.getenv("OPENAI_MODEL", "gpt-4o"),  # Must be stronger than the fast tier's gpt-4o-mini
+        "claude": os.getenv("CLAUDE_MODEL", "claude-3-7-sonnet-20250219"),
+        "gemini": GEMINI_MODEL,
+    },
+}
+FAST_TIER_MAX_INPUT_CHARS = int(os.getenv("FAST_TIER_MAX_INPUT_CHARS", 80))  # Greetings, menu picks, short clarifications
+HEAVY_TIER_MODES = [m.strip() for m in os.getenv("HEAVY_TIER_MODES", "mentor,interviewer").split(",") if m.strip()]
+HEAVY_TIER_MIN_TURN = int(os.getenv("HEAVY_TIER_MIN_TURN", 2))  # From this turn on, heavy-tier modes always use the heavy model
+
+# Response cache for early turns, whose context is the same for every user (see response_cache.py)
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "true").lower() == "true"
+RESPONSE_CACHE_MODES = [m.strip() for m in os.getenv("RESPONSE_CACHE_MODES", "coach,interviewer").split(",") if m.strip()]
+RESPONSE_CACHE_MAX_TURN = int(os.getenv("RESPONSE_CACHE_MAX_TURN", 1))  # Cache turns with at most this many earlier user turns
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 24 * 3600))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 2000))
+RESPONSE_CACHE_SEMANTIC = os.getenv("RESPONSE_CACHE_SEMANTIC", "true").lower() == "true"  # Also match near-identical messages
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", 0.9))  # Min cosine similarity of character trigrams
+
+# Storage backend for profiles, memory, history and metrics (see storage.py)
+# "auto": Firestore when Firebase credentials are provided (failing if they don't work); without
+# any, a local SQLite file for development. Webhook/worker deployments must opt in to "sqlite".
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "auto").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", os.path.join("user_data", "pm_pal.sqlite3"))
+
+# Write-behind buffer for history_logs and metric events (see write_behind.py)
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "true").lower() == "true"  # False: write them inline with the turn
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", 200))  # Records per batch (Firestore allows 500 writes)
+WRITE_BEHIND_FLUSH_SECONDS = float(os.getenv("WRITE_BEHIND_FLUSH_SECONDS", 2.0))  # Max delay before a partial batch is written
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", 3))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", 10000))  # Beyond this, records go straight to the spill file
+WRITE_BEHIND_SPILL_PATH = os.getenv("WRITE_BEHIND_SPILL_PATH", os.path.join("user_data", "write_behind_spill.jsonl"))
+
+# Usage rollups: daily counters per user and globally, by mode and source (see usage_rollups.py)
+RAW_METRIC_EVENTS = os.getenv("RAW_METRIC_EVENTS", "false").lower() == "true"  # Also keep one metrics document per reply
+
+# Observability (see instrumentation.py)
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9090))  # Prometheus /metrics endpoint; 0 disables it
+DEBUG_LOG_SAMPLE_RATE = float(os.getenv("DEBUG_LOG_SAMPLE_RATE", 0.0))  # Fraction of turns whose debug details are logged
+DEBUG_LOG_MAX_CHARS = int(os.getenv("DEBUG_LOG_MAX_CHARS", 500))  # Max length of each logged debug field
+
+# Multi-worker webhook deployment (see ingress.py and sharding.py)
+# BOT_ROLE: "single" (one process, polling or webhook), "worker" (serves updates forwarded by the ingress)
+BOT_ROLE = os.getenv("BOT_ROLE", "single").lower()
+if BOT_ROLE not in ["single", "worker"]:
+    raise ValueError("⚠️ Invalid BOT_ROLE. Must be 'single' or 'worker' (the ingress runs as `python ingress.py`).")
+SHARD_SECRET = os.getenv("SHARD_SECRET")  # Shared by the ingress and its workers; required outside localhost
+SHARD_WORKERS = [w.strip().rstrip("/") for w in os.getenv("SHARD_WORKERS", "").split(",") if w.strip()]  # Worker base URLs
+SHARD_LOCAL_WORKERS = int(os.getenv("SHARD_LOCAL_WORKERS", 0))  # Worker processes the ingress starts on this machine
+SHARD_WORKER_BASE_PORT = int(os.getenv("SHARD_WORKER_BASE_PORT", 8100))  # Local worker i listens on base + i
+SHARD_INGRESS_URL = os.getenv("SHARD_INGRESS_URL", "").rstrip("/")  # Workers join/leave the ring through it
+SHARD_WORKER_URL = os.getenv("SHARD_WORKER_URL", "").rstrip("/")  # This worker's base URL, as the ingress reaches it
+SHARD_VIRTUAL_NODES = int(os.getenv("SHARD_VIRTUAL_NODES", 100))  # Points per worker on the hash ring
+SHARD_HEALTH_INTERVAL_SECONDS = float(os.getenv("SHARD_HEALTH_INTERVAL_SECONDS", 5.0))
+SHARD_FORWARD_TIMEOUT_SECONDS = float(os.getenv("SHARD_FORWARD_TIMEOUT_SECONDS", 180.0))  # A whole turn, incl. LLM failover
@@ -1,6 +1,8 @@
-from langchain.schema import SystemMessage
 from prompts import MODE_PROMPTS
-from config import WHITELISTED_USER_IDS
+from config import WHITELISTED_USER_IDS, FREE_TIER_REPLY_LIMIT
+from firebase_db import run_io
+from memory_manager import MemoryManager
+from chat_scheduler import scheduler
 # ======================== #
 #  Conversation Manager    #
 # ======================== #
@@ -15,41 +17,119 @@ from config import WHITELISTED_USER_IDS
 # It handles the conversation flow and manages the user's memory.
 # It raises errors if the user ID is invalid or if there are issues with file operations.
 # It provides methods for getting and updating memory, logging interactions, and managing the user's mode.  
+# Its public methods are async: Firestore calls run on the I/O thread pool (`run_io`) and the
+# LLM call is awaited, so the Telegram event loop is never blocked by a single user's turn.
+# Memory compaction (a summarisation LLM call) is not part of the turn: call `compact_memory`
+# once the reply has been delivered.
 
 class ConversationManager:
-    def __init__(self, bot_user, llm_router):
+    def __init__(self, bot_user, llm_router=None):
+        # `llm_router` may be omitted for operations that never call an LLM (e.g. switching modes)
         self.user = bot_user
         self.router = llm_router
+        # Keeps each mode's memory under the token budget, summarising older turns with the LLM
+        self.memory_manager = MemoryManager(summarizer=llm_router.asummarize if llm_router else None)
+        self.mode = None  # Mode of the current turn, once loaded (for metrics labels)
+        self._compaction = None  # (mode, memory) persisted by the last turn, for `compact_memory`
 
-    def switch_mode(self, new_mode):
+    async def switch_mode(self, new_mode):
         if new_mode in MODE_PROMPTS:
-            self.user.mode = new_mode
-            memory = self.user.get_memory()
-            memory[new_mode] = [SystemMessage(content=MODE_PROMPTS[new_mode])]
-            self.user.update_memory(new_mode, memory)
+            await run_io(self._reset_mode, new_mode)
             return f"🔄 Mode switched to *{new_mode.capitalize()}*. Previous conversation cleared."
         else:
             return "⚠️ Invalid mode. Choose `/mode mentor`, `/mode coach`, or `/mode interviewer`."
 
-    def process_input(self, user_input, source="text"):
+    def _reset_mode(self, new_mode):
+        """Blocking part of `switch_mode`: set the mode and clear that mode's memory."""
+        self.user.mode = new_mode
+        self.user.reset_memory(new_mode)
+
+    async def _quota_message(self):
+        """Return the free-tier limit message if this user has no AI replies left, else None."""
         if str(self.user.user_id) not in WHITELISTED_USER_IDS:
-            if self.user.get_llm_usage_count() >= 8:
+            if await run_io(self.user.has_reached_free_limit, FREE_TIER_REPLY_LIMIT):
                 return (
-                    "🧪 You’ve used your 8 free AI responses.\n\n"
+                    f"🧪 You’ve used your {FREE_TIER_REPLY_LIMIT} free AI responses.\n\n"
                     "Want more access or to help shape PM Pal? "
                     "Contact us at huang.yva@gmail.com or DM @yvayvaine on Telegram.\n\n"
                     "Thanks for trying the beta! 🚀"
                 )
-            
+        return None
+
+    def _load_turn_state_sync(self):
         mode = self.user.mode
-        memory = self.user.get_memory()
-        ai_reply, updated_memory = self.router.get_response(self.user.user_id, user_input, mode, memory)
-        self.user.update_memory(mode, updated_memory)
-        self.user.log_interaction(user_input, ai_reply, source=source)
+        self.mode = mode
+        return mode, self.user.get_memory(mode) if mode else {}
+
+    async def _load_turn_state(self):
+        """Fetch the user's mode, then only that mode's memory (one thread-pool hop for both)."""
+        return await run_io(self._load_turn_state_sync)
 
-        # ✅ Add this line to log a metric event
-        self.user.log_metric_event()      
-        
-        self.user.increment_llm_usage_count() # Increment usage count for LLM - ai response
+    async def process_input(self, user_input, source="text"):
+        quota_message = await self._quota_message()
+        if quota_message:
+            return quota_message
+
+        mode, memory = await self._load_turn_state()
+        usage = {}
+        async with scheduler.llm_slot():  # Global cap on in-flight LLM calls
+            ai_reply, updated_memory = await self.router.aget_response(self.user.user_id, user_input, mode, memory, usage)
+        await self._finish_turn(mode, updated_memory, user_input, ai_reply, source, usage)
 
         return ai_reply
+
+    async def stream_input(self, user_input, source="text"):
+        """
+        Streaming variant of `process_input`: yields the AI reply in chunks as they arrive.
+        The turn is persisted after the last chunk, so consume the generator to the end.
+        """
+        quota_message = await self._quota_message()
+        if quota_message:
+            yield quota_message
+            return
+
+        mode, memory = await self._load_turn_state()
+        parts = []
+        usage = {}
+        async with scheduler.llm_slot():  # Global cap on in-flight LLM calls
+            async for chunk in self.router.astream_response(self.user.user_id, user_input, mode, memory, usage):
+                parts.append(chunk)
+                yield chunk
+
+        await self._finish_turn(mode, memory, user_input, "".join(parts), source, usage)
+
+    async def _finish_turn(self, mode, memory, user_input, ai_reply, source, usage=None):
+        """Persist the turn (compaction, if needed, is left to `compact_memory`)."""
+        if usage and "input_tokens" in usage:
+            print(
+                f"💾 {mode} turn tokens ({usage.get('tier', 'heavy')} tier, {usage.get('model', self.router.provider)}): "
+                f"input {usage['input_tokens']} "
+                f"(cached {usage['cached_input_tokens']}, uncached {usage['uncached_input_tokens']}), "
+                f"output {usage['output_tokens']}, ~${usage.get('cost_usd', 0):.5f}",
+                flush=True
+            )
+
+        # Persist the new memory turn, history log, usage rollups and LLM usage count in one batched commit
+        await run_io(self.user.commit_turn, mode, memory, user_input, ai_reply, source=source, usage=usage)
+        if mode in memory:
+            self._compaction = (mode, memory)
+
+    async def compact_memory(self):
+        """
+        If the last turn took its mode's memory over the token budget, fold the oldest turns
+        into the running summary and persist that. Call it after the reply has been delivered:
+        the summarisation LLM call then never delays a reply. Returns the number of turns folded.
+        """
+        if self._compaction is None:
+            return 0
+        mode, memory = self._compaction
+        self._compaction = None
+        if not self.memory_manager.needs_compaction(memory[mode]):
+            return 0
+
+        async with scheduler.llm_slot():  # The summary is an LLM call like any other
+            memory[mode], evicted_turns = await self.memory_manager.acompact(memory[mode])
+        if evicted_turns:
+            print(f"🧠 Folded {evicted_turns} older turn(s) of {mode} memory into the summary", flush=True)
+            await run_io(self.user.commit_compaction, mode, memory, evicted_turns)
+        return evicted_turns
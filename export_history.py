@@ -0,0 +1,242 @@
+import os
+import sys
+import json
+import gzip
+import uuid
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+from storage import get_storage
+
+# ======================== #
+#  History Export          #
+# ======================== #
+# Bulk export of every user's history_logs (the analytics source, see "Memory vs. History")
+# into files partitioned by day and mode:
+#
+#   {out}/date=2025-04-08/mode=coach/part-{run_id}.jsonl.gz      (default)
+#   {out}/date=2025-04-08/mode=coach/part-{run_id}-000.parquet   (--format parquet, needs pyarrow)
+#
+#   - Users are listed page by page, and each user's history is read with cursor-paginated
+#     queries (Storage.iter_user_ids / iter_history) by a pool of --workers reader threads.
+#   - Records are streamed straight into the partition files; memory is bounded by the open
+#     files (--max-open-files, least recently used ones are closed) and, for Parquet, one row
+#     group per open file.
+#   - Incremental: each run exports entries written to storage up to `now - --lag-minutes`
+#     and saves that as the high-water mark in {out}/_export_state.json; the next run starts
+#     after it. The cursor is when an entry reached storage (`written_at`), not its
+#     `timestamp`: entries replayed from the write-behind spill file hours later still have
+#     their original timestamp, and are picked up by the next run after they land. The lag
+#     only has to cover in-flight batches and clock skew between instances.
+#   - Part files are written under a .tmp name and renamed when the run succeeds, and the mark
+#     is only saved then, so a failed run leaves nothing half-written and can simply be rerun.
+#
+#   python export_history.py --out exports/history_logs              # first run: everything
+#   python export_history.py --out exports/history_logs              # later: only what's new
+#   python export_history.py --out exports/history_logs --full --format parquet
+
+STATE_FILE = "_export_state.json"
+PARQUET_COLUMNS = ("user_id", "timestamp", "mode", "source", "entries")  # entries as a JSON string
+
+
+class _JsonlWriter:
+    def __init__(self, path):
+        # Append mode: a file closed to free a handle can be reopened; each reopening adds a
+        # gzip member, and concatenated members are still one valid .gz file
+        self._file = gzip.open(path, "at", encoding="utf-8")
+
+    def write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+class _ParquetWriter:
+    def __init__(self, path, row_group_size):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("⚠️ --format parquet needs pyarrow (pip install pyarrow), or use --format jsonl.")
+        self._pa = pa
+        self._schema = pa.schema([(name, pa.string()) for name in PARQUET_COLUMNS])
+        self._writer = pq.ParquetWriter(path, self._schema, compression="zstd")
+        self._rows = []
+        self.row_group_size = row_group_size
+
+    def write(self, record):
+        self._rows.append({**record, "entries": json.dumps(record.get("entries", []), ensure_ascii=False)})
+        if len(self._rows) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            self._writer.write_table(self._pa.Table.from_pylist(self._rows, schema=self._schema))
+            self._rows = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+class PartitionWriters:
+    """Part files for each (date, mode) partition, at most `max_open` open at a time."""
+
+    def __init__(self, out_dir, fmt, run_id, max_open=64, row_group_size=10000):
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.run_id = run_id
+        self.max_open = max_open
+        self.row_group_size = row_group_size
+        self._open = OrderedDict()  # partition -> writer, least recently used first
+        self._parquet_parts = {}  # partition -> Parquet part files started
+        self._files = {}  # temporary path -> final path
+        self._lock = threading.Lock()
+        self.records = 0
+
+    def write(self, record):
+        partition = (record["timestamp"][:10], record.get("mode") or "unknown")
+        with self._lock:
+            writer = self._open.get(partition)
+            if writer is None:
+                writer = self._open_writer(partition)
+            else:
+                self._open.move_to_end(partition)
+            writer.write(record)
+            self.records += 1
+
+    def _open_writer(self, partition):
+        while len(self._open) >= self.max_open:
+            _, writer = self._open.popitem(last=False)
+            writer.close()
+        date, mode = partition
+        directory = os.path.join(self.out_dir, f"date={date}", f"mode={mode}")
+        os.makedirs(directory, exist_ok=True)
+        if self.fmt == "parquet":
+            part = self._parquet_parts.get(partition, 0)  # Parquet files can't be appended to
+            self._parquet_parts[partition] = part + 1
+            path = os.path.join(directory, f"part-{self.run_id}-{part:03d}.parquet")
+            writer = _ParquetWriter(path + ".tmp", self.row_group_size)
+        else:
+            path = os.path.join(directory, f"part-{self.run_id}.jsonl.gz")
+            writer = _JsonlWriter(path + ".tmp")
+        self._files[path + ".tmp"] = path
+        self._open[partition] = writer
+        return writer
+
+    def _close_all(self):
+        while self._open:
+            _, writer = self._open.popitem(last=False)
+            writer.close()
+
+    def commit(self):
+        """Close every file and give it its final name."""
+        self._close_all()
+        for temp_path, path in self._files.items():
+            os.replace(temp_path, path)
+        return len(self._files)
+
+    def abort(self):
+        """Close and delete this run's files."""
+        self._close_all()
+        for temp_path in self._files:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+def _record(user_id, entry):
+    return {
+        "user_id": user_id,
+        "timestamp": entry.get("timestamp"),
+        "mode": entry.get("mode"),
+        "source": entry.get("source"),
+        "entries": entry.get("entries", []),
+    }
+
+
+def export_history(storage, out_dir, fmt="jsonl", since=None, until=None, workers=8, page_size=500,
+                   max_open=64, row_group_size=10000):
+    """Export history_logs entries with `since` < written_at <= `until`. Returns run statistics."""
+    run_id = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:6]}"  # Part files never overwrite earlier runs
+    writers = PartitionWriters(out_dir, fmt, run_id, max_open=max_open, row_group_size=row_group_size)
+
+    def export_user(user_id):
+        for entry in storage.iter_history(user_id, since=since, until=until, page_size=page_size):
+            if entry.get("timestamp"):
+                writers.write(_record(user_id, entry))
+
+    users = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export") as pool:
+            pending = set()
+            for user_id in storage.iter_user_ids(page_size=page_size):
+                if len(pending) >= 2 * workers:  # Don't queue the whole user list
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()  # Re-raise a reader's error
+                pending.add(pool.submit(export_user, user_id))
+                users += 1
+            for future in pending:
+                future.result()
+    except BaseException:
+        writers.abort()
+        raise
+    files = writers.commit()
+    return {"run_id": run_id, "users": users, "records": writers.records, "files": files}
+
+
+def load_state(out_dir):
+    path = os.path.join(out_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(out_dir, state):
+    path = os.path.join(out_dir, STATE_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export history_logs to date/mode-partitioned JSONL.gz or Parquet files.")
+    parser.add_argument("--out", default=os.path.join("exports", "history_logs"), help="Output directory")
+    parser.add_argument("--format", choices=("jsonl", "parquet"), default="jsonl")
+    parser.add_argument("--full", action="store_true", help="Ignore the saved high-water mark and export everything")
+    parser.add_argument("--since", help="Only entries written after this ISO time (overrides the saved mark)")
+    parser.add_argument("--lag-minutes", type=float, default=15, help="Leave out entries newer than this (default: 15)")
+    parser.add_argument("--workers", type=int, default=8, help="Users read in parallel (default: 8)")
+    parser.add_argument("--page-size", type=int, default=500, help="Documents per query page (default: 500)")
+    parser.add_argument("--max-open-files", type=int, default=64, help="Partition files kept open at once")
+    parser.add_argument("--row-group-size", type=int, default=10000, help="Rows per Parquet row group")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.makedirs(args.out, exist_ok=True)
+    state = {} if args.full else load_state(args.out)
+    since = args.since or state.get("high_water_mark")
+    until = (datetime.utcnow() - timedelta(minutes=args.lag_minutes)).isoformat()
+    if since and since >= until:
+        print(f"✅ Nothing to export: already exported up to {since}", flush=True)
+        return 0
+
+    print(f"📤 Exporting history_logs after {since or 'the beginning'} up to {until} to {args.out} ({args.format})", flush=True)
+    result = export_history(
+        get_storage(), args.out, fmt=args.format, since=since, until=until, workers=args.workers,
+        page_size=args.page_size, max_open=args.max_open_files, row_group_size=args.row_group_size,
+    )
+    save_state(args.out, {"high_water_mark": until, "format": args.format, "last_run": result})
+    print(f"✅ Exported {result['records']} entries of {result['users']} users into {result['files']} files "
+          f"(run {result['run_id']})", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
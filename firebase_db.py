@@ -5,22 +5,61 @@ It requires a service account key in JSON format for authentication.
 The service account key should be stored in a file named 'firebase_creds.json'.
 The database connection is established using the credentials from the service account key.
 The Firestore client is created and can be used to perform database operations.
+
+The connection is opened on first use (`get_db()`), not at import: firebase_admin and the
+Firestore client are heavy to import, and a cold start shouldn't pay for them before the
+first request that actually needs storage.
+
+The Firestore client is synchronous. Async code (the Telegram handlers) must not call it
+directly, or every network round-trip blocks the event loop for all users. Use `run_io()`
+to run Firestore work on a bounded thread pool instead.
 """
 
 import os
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from firebase_admin import credentials, firestore, initialize_app
+from startup_timing import timed
 
 load_dotenv()  # Loads vars from .env
 
-print("📦 Initializing Firebase connection...", flush=True)
+_db = None
+_db_initialized = False
+_db_lock = threading.Lock()
+
+def get_db():
+    """Return the Firestore client, connecting on first call; None if Firebase isn't configured."""
+    global _db, _db_initialized
+    if not _db_initialized:
+        with _db_lock:
+            if not _db_initialized:
+                print("📦 Initializing Firebase connection...", flush=True)
+                try:
+                    with timed("firebase_admin", lazy=True):
+                        from firebase_admin import credentials, firestore, initialize_app
+
+                        cred_path = os.getenv("FIREBASE_CRED_PATH", "firebase_creds.json")
+                        cred = credentials.Certificate(cred_path)
+                        initialize_app(cred)
+
+                        _db = firestore.client()
+                except Exception as e:
+                    print("❌ Firebase init failed:", e, flush=True)
+                    _db = None # storage.py refuses to start rather than silently using local storage
+                _db_initialized = True
+    return _db
+
+def firebase_configured():
+    """Whether Firebase credentials were provided: FIREBASE_CRED_PATH, or the default key file."""
+    return bool(os.getenv("FIREBASE_CRED_PATH")) or os.path.exists("firebase_creds.json")
 
-try:
-    cred_path = os.getenv("FIREBASE_CRED_PATH", "firebase_creds.json")
-    cred = credentials.Certificate(cred_path)
-    initialize_app(cred)
+# Bounded pool for blocking Firestore calls made from async code
+FIRESTORE_MAX_WORKERS = int(os.getenv("FIRESTORE_MAX_WORKERS", 32))
+io_executor = ThreadPoolExecutor(max_workers=FIRESTORE_MAX_WORKERS, thread_name_prefix="firestore-io")
 
-    db = firestore.client()
-except Exception as e:
-    print("❌ Firebase init failed:", e, flush=True)
-    db = None # Still define db as None to avoid import error
\ No newline at end of file
+async def run_io(func, *args, **kwargs):
+    """Run a blocking (Firestore) call on the I/O thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_executor, functools.partial(func, *args, **kwargs))
@@ -2,16 +2,18 @@
 from telegram.constants import ParseMode # Constants for text formatting in Telegram messages
 from telegram import Update # Handles updates (messages, commands) from Telegram users
 from telegram.ext import ContextTypes # Telegram bot framework for handling commands and messages
-from moviepy.editor import AudioFileClip  # Handles audio file processing (converting voice messages)
 from greetings import GREETINGS # Import greeting messages for different modes
-from openai import OpenAI  # For Whisper speech-to-text
-from config import OPENAI_API_KEY # Import OpenAI API key for Whisper
+from voice_pipeline import download_voice, transcribe  # In-memory download + Whisper speech-to-text
+from config import STREAM_REPLIES # Stream replies via progressive message edits
 
-from llm_router import LLMRouter
+from llm_router import get_router
 from conversation_manager import ConversationManager
 from bot_user import BotUser 
-
-client = OpenAI(api_key=OPENAI_API_KEY) # Initialize OpenAI client for Whisper API
+from firebase_db import run_io  # Run blocking Firestore calls off the event loop
+from reply_streamer import StreamingReply
+from chat_scheduler import scheduler, serialized_per_chat  # Per-chat ordering + global concurrency caps
+from instrumentation import span, observe  # Stage timings exported on /metrics
+import time
 
 # ==================== #
 #  Greeting Function   #
@@ -35,7 +37,7 @@ async def ensure_mode_selected(update, user):
     If not, sends a reminder and stops further execution.
     Returns True if mode is missing, otherwise False.
     """
-    if not user.mode:
+    if not await run_io(lambda: user.mode):
         await update.message.reply_text(
             "🎯 **Ready to dive in? Choose a mode to tailor your learning experience today!**\n\n"
             " - 💡 **/mentor** for career advice & learning paths.\n"
@@ -50,13 +52,14 @@ async def ensure_mode_selected(update, user):
 # =============================== #
 #  Command Handling - Start       #
 # =============================== # 
+@serialized_per_chat
 async def start(update, context):
     """
     Handles the /start command: greets the user and resets their mode.
     """
     user_id = update.message.chat_id
     user = BotUser(user_id)
-    user.mode = None
+    await run_io(setattr, user, "mode", None)
     await greet_user(update)
     await ensure_mode_selected(update, user)
 
@@ -84,14 +87,14 @@ async def help_command(update: Update, context):
 #  Command Handling - Mode Switching #
 # ================================== #
 
+@serialized_per_chat
 async def change_mode(update: Update, context):
     """
     Handle /mode command and update mode for the specific user.
     """
     user_id = update.message.chat_id
     user = BotUser(user_id)
-    router = LLMRouter()
-    manager = ConversationManager(user, router)
+    manager = ConversationManager(user)  # Switching modes never calls an LLM
 
     #  validate user input for mode change 
     if not context.args:
@@ -106,7 +109,7 @@ async def change_mode(update: Update, context):
         return
 
     #  Switch mode and update user data
-    result = manager.switch_mode(mode_choice)
+    result = await manager.switch_mode(mode_choice)
     await update.message.reply_text(
         f"💡 *Mode switched to {mode_choice.capitalize()} Mode.*\n\n{GREETINGS[mode_choice]}",
         parse_mode=ParseMode.MARKDOWN
@@ -133,10 +136,39 @@ async def mode_interview(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.args = ["interviewer"]
     await change_mode(update, context)
 
+# ====================================== #
+# Helper Function: Send the AI Response  #
+# ====================================== #
+async def reply_with_ai(update, manager, user_input, source="text"):
+    """
+    Generate the AI response and send it to the user.
+    With STREAM_REPLIES, a placeholder is sent right away and edited as tokens arrive.
+    Once the reply is delivered, the mode's memory is compacted if it went over budget.
+    """
+    started = time.perf_counter()
+    if STREAM_REPLIES:
+        reply = StreamingReply(update.message)
+        await reply.start()
+        async for chunk in manager.stream_input(user_input, source=source):
+            await reply.push(chunk)
+        await reply.finish()
+        if reply.time_to_first_chunk is not None:  # The latency users feel
+            observe("reply_first_text", reply.time_to_first_chunk, mode=manager.mode)
+    else:
+        ai_response = await manager.process_input(user_input, source=source)
+        with span("telegram_send", mode=manager.mode):
+            await update.message.reply_text(
+                f"🤖 *PM Pal:* {ai_response}",
+                parse_mode=ParseMode.MARKDOWN
+            )
+    observe("turn", time.perf_counter() - started, mode=manager.mode)
+    await manager.compact_memory()  # Still inside the chat's serialized handler, so the next turn sees it
+
 # =============================== #
 #  Message Handling - Text Input  #
 # =============================== #
 
+@serialized_per_chat
 async def text_message(update: Update, context):
     """
     Handle incoming text messages and generate AI responses.
@@ -150,19 +182,14 @@ async def text_message(update: Update, context):
     if await ensure_mode_selected(update, user):
         return  # Exit early if mode is missing
 
-    router = LLMRouter()
-    manager = ConversationManager(user, router)
-    ai_response = manager.process_input(user_input)
-
-    await update.message.reply_text(
-        f"🤖 *PM Pal:* {ai_response}",
-        parse_mode=ParseMode.MARKDOWN
-    )
+    manager = ConversationManager(user, get_router())
+    await reply_with_ai(update, manager, user_input)
 
 # =============================== #
 #  Message Handling - Voice Input #
 # =============================== #
 
+@serialized_per_chat
 async def voice_message(update: Update, context):
     """
     Handle voice messages: download, convert, transcribe, and process them with AI.
@@ -177,21 +204,12 @@ async def voice_message(update: Update, context):
     await update.message.reply_text("🎙️ Processing voice message...")
 
     # Process Voice Message
-    # Download the voice message file from Telegram
-    voice_file = await context.bot.get_file(update.message.voice.file_id)
-    await voice_file.download_to_drive("voice_message.ogg")
-
-    # Convert .ogg to .mp3 using MoviePy
-    audio_clip = AudioFileClip("voice_message.ogg")
-    audio_clip.write_audiofile("voice_message.mp3")
-
-    # Transcribe the audio using Whisper
+    # Download the voice note into memory and transcribe it with Whisper (OGG/Opus is sent as-is)
     try:
-        with open("voice_message.mp3", "rb") as audio_file:
-            transcript = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file
-            ).text
+        audio_bytes = await download_voice(context.bot, update.message.voice.file_id)
+        async with scheduler.whisper_slot():
+            with span("whisper"):
+                transcript = await transcribe(audio_bytes)
     except Exception as e:
         await update.message.reply_text(f"❌ Error transcribing audio: {e}")
         return
@@ -203,10 +221,5 @@ async def voice_message(update: Update, context):
         )
 
     # Generate AI response
-    router = LLMRouter()
-    manager = ConversationManager(user, router)
-    ai_response = manager.process_input(transcript, source="voice")
-    await update.message.reply_text(
-        f"🤖 *PM Pal:* {ai_response}",
-        parse_mode=ParseMode.MARKDOWN
-        )
\ No newline at end of file
+    manager = ConversationManager(user, get_router())
+    await reply_with_ai(update, manager, transcript, source="voice")
\ No newline at end of file
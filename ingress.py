@@ -0,0 +1,303 @@
+import os
+import sys
+import uuid
+import signal
+import asyncio
+from config import TELEGRAM_API_TOKEN, WEBHOOK_URL, PORT, METRICS_PORT, CHAT_MAX_PENDING, WRITE_BEHIND_SPILL_PATH
+from config import SHARD_SECRET, SHARD_WORKERS, SHARD_LOCAL_WORKERS, SHARD_WORKER_BASE_PORT
+from config import SHARD_HEALTH_INTERVAL_SECONDS, SHARD_FORWARD_TIMEOUT_SECONDS
+from sharding import HashRing, chat_id_of, SECRET_HEADER, EPOCH_HEADER
+
+# ======================== #
+#  Webhook Ingress         #
+# ======================== #
+# Scale-out mode for webhooks. One ingress receives Telegram's webhook calls and routes each
+# update, by consistent hash of its chat id (sharding.py), to one of several workers:
+# `telegram_bot.py` processes started with BOT_ROLE=worker, each with its own event loop.
+#   - Workers: SHARD_WORKERS (base URLs, e.g. other Cloud Run services), plus
+#     SHARD_LOCAL_WORKERS processes the ingress starts (and restarts) on this machine, to use
+#     all its cores. Remote workers can also join and leave at runtime (POST /workers/join,
+#     /workers/leave, with the X-Shard-Secret header; see `run_worker` in telegram_bot.py).
+#   - Rebalancing: workers are health-checked every SHARD_HEALTH_INTERVAL_SECONDS. A worker
+#     that is down, draining or unreachable leaves the ring, and only its chats move. Each
+#     update carries the ring's epoch, so a worker knows when chats may have moved and drops
+#     its cached profiles and quota counts (they may have changed on another worker).
+#   - Ordering: the ingress answers Telegram right away (like run_webhook does), then forwards
+#     a chat's updates one at a time; the next one is sent only once the worker has finished
+#     the previous one. So a chat never has two updates in flight, even while it moves to
+#     another worker, and two workers never write the same user's memory at once.
+#   - Backpressure: a chat with CHAT_MAX_PENDING updates waiting gets the "busy" reply.
+# Updates without a chat (e.g. inline queries) are spread by update id.
+#
+#   BOT_ROLE=worker PORT=8101 python telegram_bot.py   # on each worker
+#   SHARD_WORKERS=http://10.0.0.2:8101,... python ingress.py
+#   SHARD_LOCAL_WORKERS=4 python ingress.py             # or: one machine, 4 worker processes
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "telegram_bot.py")
+
+
+class Ingress:
+    def __init__(self, workers=SHARD_WORKERS, local_workers=SHARD_LOCAL_WORKERS):
+        self.ring = HashRing()  # Healthy workers only
+        self.workers = set(workers)  # Every known worker, healthy or not
+        self.local_workers = local_workers
+        self._processes = {}  # local worker index -> asyncio subprocess
+        self._lanes = {}  # chat_id -> [updates waiting or in flight, task forwarding the last one]
+        self._loose_tasks = set()  # Forwards of updates without a chat, busy replies
+        self._session = None
+        self._bot = None
+        self._health_task = None
+        self._instance = uuid.uuid4().hex[:8]  # Keeps epochs distinct across ingress restarts
+        self.forwarded = 0
+        self.rerouted = 0
+        self.rejected = 0
+        self.failed = 0
+
+    # ------------------------------------------------------------------ #
+    # Lifecycle
+    # ------------------------------------------------------------------ #
+
+    async def start(self):
+        import aiohttp
+        from telegram import Bot
+
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=SHARD_FORWARD_TIMEOUT_SECONDS))
+        for index in range(self.local_workers):
+            await self._spawn_local_worker(index)
+        await self._check_workers()
+        self._health_task = asyncio.create_task(self._health_loop())
+
+        self._bot = Bot(TELEGRAM_API_TOKEN)
+        await self._bot.initialize()
+        if WEBHOOK_URL:
+            await self._bot.set_webhook(url=WEBHOOK_URL)
+        print(f"🔀 Ingress routing to {len(self.ring.nodes)}/{len(self.workers)} healthy workers", flush=True)
+
+    async def stop(self, timeout=20):
+        """Finish forwarding what Telegram already handed us, then stop local workers."""
+        if self._health_task:
+            self._health_task.cancel()
+        pending = [lane[1] for lane in self._lanes.values()] + list(self._loose_tasks)
+        if pending:
+            print(f"⏳ Waiting for {len(pending)} chats' updates to be forwarded", flush=True)
+            await asyncio.wait(pending, timeout=timeout)
+        for process in self._processes.values():
+            if process.returncode is None:
+                process.terminate()  # Workers drain on SIGTERM (see `run_worker`)
+        await asyncio.gather(*(process.wait() for process in self._processes.values()))
+        await self._session.close()
+        await self._bot.shutdown()
+
+    def web_app(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_post(f"/{TELEGRAM_API_TOKEN}", self.handle_webhook)  # Same path as run_webhook
+        app.router.add_post("/workers/join", self.handle_join)
+        app.router.add_post("/workers/leave", self.handle_leave)
+        app.router.add_get("/workers", self.handle_status)
+        app.router.add_get("/healthz", lambda request: web.Response(text="ok"))
+        return app
+
+    # ------------------------------------------------------------------ #
+    # Routing
+    # ------------------------------------------------------------------ #
+
+    async def handle_webhook(self, request):
+        from aiohttp import web
+
+        update = await request.json()
+        chat_id = chat_id_of(update)
+        if chat_id is None:
+            self._track(self._forward(f"update:{update.get('update_id')}", update))
+            return web.Response()
+
+        waiting, previous = self._lanes.get(chat_id, (0, None))
+        if waiting >= CHAT_MAX_PENDING:
+            self.rejected += 1
+            self._track(self._reply_busy(chat_id))
+            return web.Response()
+        task = asyncio.create_task(self._run_lane(chat_id, previous, update))
+        self._lanes[chat_id] = [waiting + 1, task]
+        return web.Response()
+
+    def _track(self, coroutine):
+        """Run a task outside the chat lanes, keeping a reference until it is done."""
+        task = asyncio.create_task(coroutine)
+        self._loose_tasks.add(task)
+        task.add_done_callback(self._loose_tasks.discard)
+
+    async def _run_lane(self, chat_id, previous, update):
+        """Forward `update` once the chat's previous update has been fully handled."""
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            await self._forward(chat_id, update)
+        finally:
+            lane = self._lanes[chat_id]
+            lane[0] -= 1
+            if lane[0] == 0:
+                del self._lanes[chat_id]
+
+    async def _forward(self, key, update):
+        """POST the update to the worker owning `key`; if it can't take it, to the next owner."""
+        import aiohttp
+
+        tried = set()
+        while True:
+            worker = self.ring.node_for(key)
+            if worker is None or worker in tried:
+                self.failed += 1
+                print(f"❌ No worker could take update {update.get('update_id')} (tried {len(tried)})", flush=True)
+                return
+            tried.add(worker)
+            try:
+                headers = {**self._headers(), EPOCH_HEADER: f"{self._instance}.{self.ring.epoch}"}
+                async with self._session.post(f"{worker}/update", json=update, headers=headers) as response:
+                    if response.status == 200:
+                        self.forwarded += 1
+                        return
+                    if response.status != 503:  # 503: the worker is draining, try the next one
+                        self.failed += 1
+                        print(f"⚠️ Worker {worker} answered {response.status} for update {update.get('update_id')}", flush=True)
+                        return
+            except aiohttp.ClientConnectionError as e:
+                print(f"⚠️ Worker {worker} unreachable: {e!r}", flush=True)
+            except asyncio.TimeoutError:
+                # The worker may still be handling it: sending it elsewhere could answer twice
+                self.failed += 1
+                print(f"⚠️ Worker {worker} timed out on update {update.get('update_id')}", flush=True)
+                return
+            self._mark_down(worker)
+            self.rerouted += 1
+
+    async def _reply_busy(self, chat_id):
+        from chat_scheduler import BUSY_MESSAGE
+        try:
+            await self._bot.send_message(chat_id, BUSY_MESSAGE)
+        except Exception as e:
+            print(f"⚠️ Could not send the busy reply to {chat_id}:", e, flush=True)
+
+    def _headers(self):
+        return {SECRET_HEADER: SHARD_SECRET} if SHARD_SECRET else {}
+
+    # ------------------------------------------------------------------ #
+    # Membership
+    # ------------------------------------------------------------------ #
+
+    def _mark_up(self, worker):
+        if self.ring.add(worker):
+            print(f"🔀 Worker {worker} joined the ring ({len(self.ring.nodes)} healthy)", flush=True)
+
+    def _mark_down(self, worker):
+        if self.ring.remove(worker):
+            print(f"🔀 Worker {worker} left the ring ({len(self.ring.nodes)} healthy); its chats moved", flush=True)
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(SHARD_HEALTH_INTERVAL_SECONDS)
+            await self._restart_exited_workers()
+            await self._check_workers()
+
+    async def _check_workers(self):
+        await asyncio.gather(*(self._check_worker(worker) for worker in list(self.workers)))
+
+    async def _check_worker(self, worker):
+        import aiohttp
+        try:
+            async with self._session.get(f"{worker}/healthz", timeout=aiohttp.ClientTimeout(total=2)) as response:
+                healthy = response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            healthy = False
+        if healthy and worker in self.workers:
+            self._mark_up(worker)
+        else:
+            self._mark_down(worker)
+
+    def _authorized(self, request):
+        return not SHARD_SECRET or request.headers.get(SECRET_HEADER) == SHARD_SECRET
+
+    async def handle_join(self, request):
+        from aiohttp import web
+        if not self._authorized(request):
+            return web.Response(status=403)
+        worker = (await request.json())["url"].rstrip("/")
+        self.workers.add(worker)
+        await self._check_worker(worker)
+        return web.json_response({"healthy": worker in self.ring.nodes})
+
+    async def handle_leave(self, request):
+        from aiohttp import web
+        if not self._authorized(request):
+            return web.Response(status=403)
+        worker = (await request.json())["url"].rstrip("/")
+        self.workers.discard(worker)
+        self._mark_down(worker)
+        return web.json_response({"left": True})
+
+    async def handle_status(self, request):
+        from aiohttp import web
+        if not self._authorized(request):
+            return web.Response(status=403)
+        return web.json_response(self.stats())
+
+    def stats(self):
+        return {
+            "healthy_workers": self.ring.nodes,
+            "known_workers": sorted(self.workers),
+            "chats_in_flight": len(self._lanes),
+            "forwarded": self.forwarded,
+            "rerouted": self.rerouted,
+            "rejected": self.rejected,
+            "failed": self.failed,
+        }
+
+    # ------------------------------------------------------------------ #
+    # Local worker processes
+    # ------------------------------------------------------------------ #
+
+    async def _spawn_local_worker(self, index):
+        port = SHARD_WORKER_BASE_PORT + index
+        env = {
+            **os.environ,
+            "BOT_ROLE": "worker",
+            "PORT": str(port),
+            "SHARD_INGRESS_URL": "",  # The ingress tracks its own workers
+            "METRICS_PORT": str(METRICS_PORT + 1 + index) if METRICS_PORT else "0",
+            "WRITE_BEHIND_SPILL_PATH": f"{WRITE_BEHIND_SPILL_PATH}.worker{index}",  # One spill file per process
+        }
+        self._processes[index] = await asyncio.create_subprocess_exec(sys.executable, "-u", BOT_SCRIPT, env=env)
+        self.workers.add(f"http://127.0.0.1:{port}")
+        print(f"🚀 Started local worker {index} on port {port}", flush=True)
+
+    async def _restart_exited_workers(self):
+        for index, process in list(self._processes.items()):
+            if process.returncode is not None:
+                print(f"⚠️ Local worker {index} exited with code {process.returncode}; restarting", flush=True)
+                self._mark_down(f"http://127.0.0.1:{SHARD_WORKER_BASE_PORT + index}")
+                await self._spawn_local_worker(index)
+
+
+async def main():
+    from aiohttp import web
+
+    ingress = Ingress()
+    await ingress.start()
+    runner = web.AppRunner(ingress.web_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", PORT).start()
+    print(f"🌐 Ingress listening on :{PORT}", flush=True)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    print("🛑 Ingress shutting down", flush=True)
+    await runner.cleanup()  # Stop accepting updates first; Telegram redelivers unanswered ones
+    await ingress.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,159 @@
+import time
+import random
+import bisect
+import threading
+from contextlib import contextmanager
+from config import METRICS_PORT, DEBUG_LOG_SAMPLE_RATE, DEBUG_LOG_MAX_CHARS
+
+# ======================== #
+#  Instrumentation         #
+# ======================== #
+# Timing spans for each stage of a turn, exported in the Prometheus text format:
+#   - `span(stage, mode=..., provider=...)` times a block and records it in the
+#     `pm_pal_stage_seconds` histogram (stages: profile_read, memory_load, llm_call,
+#     llm_ttft, reply_first_text, persistence, telegram_send, whisper, turn)
+#   - `gauge(name, help, fn)` exports a value read at scrape time (queue depths, cache hit rates);
+#     `gauge_family(name, help, fn)` the same for several labelled values (per tier, per provider)
+#   - `start_metrics_server()` serves `/metrics` (and `/healthz`) with aiohttp on METRICS_PORT,
+#     next to the Telegram webhook/polling loop
+#   - `debug_log(label, **fields)` replaces ad-hoc debug prints: sampled (DEBUG_LOG_SAMPLE_RATE)
+#     and with every field cut to DEBUG_LOG_MAX_CHARS, so it never dumps whole conversations
+# No client library needed: the exposition format is plain text.
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60)
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name) or "") for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def totals(self):
+        """{label values: (count, sum)} for every series (used by loadtest.py)."""
+        with self._lock:
+            return {key: (values[-1], values[-2]) for key, values in self._series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {values[-1]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {values[-2]}")
+            lines.append(f"{self.name}_count{{{labels}}} {values[-1]}")
+        return lines
+
+
+stage_seconds = Histogram(
+    "pm_pal_stage_seconds",
+    "Duration of each stage of a conversation turn, in seconds.",
+    ("stage", "mode", "provider"),
+)
+
+_gauges = []  # (name, help, fn)
+_gauge_families = []  # (name, help, fn returning [(labels dict, value), ...])
+
+
+def observe(stage, seconds, mode=None, provider=None):
+    stage_seconds.observe(seconds, stage=stage, mode=mode, provider=provider)
+
+
+@contextmanager
+def span(stage, mode=None, provider=None):
+    """Time the body as one `stage` (also when it raises). Works in sync and async code."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started, mode=mode, provider=provider)
+
+
+def gauge(name, help_text, fn):
+    """Export `fn()` (a number) as a gauge, read at every scrape."""
+    _gauges.append((name, help_text, fn))
+
+
+def gauge_family(name, help_text, fn):
+    """Export `fn()`, a list of `(labels dict, number)`, as one labelled gauge, read at every scrape."""
+    _gauge_families.append((name, help_text, fn))
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format."""
+    lines = stage_seconds.render()
+    for name, help_text, fn in _gauges:
+        try:
+            value = float(fn())
+        except Exception:
+            continue  # A broken collector must not break the whole scrape
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+    for name, help_text, fn in _gauge_families:
+        try:
+            samples = [(labels, float(value)) for labels, value in fn() if value is not None]
+        except Exception:
+            continue
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}")
+    return "\n".join(lines) + "\n"
+
+
+async def start_metrics_server(port=METRICS_PORT):
+    """Serve /metrics and /healthz on `port` (0 disables it). Returns the aiohttp runner, or None."""
+    if not port:
+        return None
+    from aiohttp import web
+
+    async def metrics(request):
+        return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+    async def healthz(request):
+        return web.Response(text="ok")
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    app.router.add_get("/healthz", healthz)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    print(f"📈 Metrics available on :{port}/metrics", flush=True)
+    return runner
+
+
+def debug_log(label, **fields):
+    """Sampled, size-bounded debug line: each field's repr is cut to DEBUG_LOG_MAX_CHARS."""
+    if DEBUG_LOG_SAMPLE_RATE <= 0 or random.random() >= DEBUG_LOG_SAMPLE_RATE:
+        return
+    parts = []
+    for key, value in fields.items():
+        text = repr(value)
+        if len(text) > DEBUG_LOG_MAX_CHARS:
+            text = f"{text[:DEBUG_LOG_MAX_CHARS]}…(+{len(text) - DEBUG_LOG_MAX_CHARS} chars)"
+        parts.append(f"{key}={text}")
+    print(f"🐞 {label}: " + " ".join(parts), flush=True)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
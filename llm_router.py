@@ -1,9 +1,18 @@
+import time
+import asyncio
+import threading
 from config import AI_PROVIDER, OPENAI_API_KEY, CLAUDE_API_KEY, GOOGLE_API_KEY
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
-from langchain.schema import HumanMessage, SystemMessage
-import google.generativeai as genai
-from prompts import MODE_PROMPTS
+from config import LLM_MAX_CONNECTIONS, LLM_MAX_KEEPALIVE_CONNECTIONS
+from config import LLM_FALLBACK_PROVIDERS, LLM_TIMEOUT_SECONDS, LLM_PROVIDER_TIMEOUTS, LLM_MAX_RETRIES, LLM_HEDGE
+from config import RESPONSE_CACHE
+from prompts import MODE_PROMPTS, SUMMARY_PROMPT
+from memory_manager import is_summary
+from chat_message import Message
+from routing_policy import CircuitBreaker, LatencyTracker, StreamPump, backoff_delay, is_retryable
+from model_tiers import TierStats, choose_tier, tier_model
+from response_cache import ResponseCache
+from startup_timing import timed
+from instrumentation import observe, debug_log
 
 # ======================== #
 #  LLM Router Class       #
@@ -17,81 +26,513 @@ from prompts import MODE_PROMPTS
 # The class also includes methods for routing requests to the respective providers and managing memory.
 # It raises errors if required API keys are missing or invalid.
 # The class is designed to be used in a Telegram bot context, where user input is received and responses are sent back.
+#
+# One router is shared by the whole process (see `get_router()`): LLM clients are built once,
+# and only for providers actually used. Every model of a provider (fast and heavy tiers)
+# shares that provider's keep-alive HTTP connection pool.
+# Provider SDKs (langchain_openai, langchain_anthropic, google.generativeai) are imported on
+# first use too, so they don't slow down the container's cold start.
+
+def _connection_limits():
+    """Connection pool limits shared by all LLM HTTP clients."""
+    import httpx
+    return httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS
+    )
+
+_http_client_pairs = {}  # provider -> (httpx.Client, httpx.AsyncClient), shared by all its models
+_http_clients_lock = threading.Lock()
+
+def _http_clients(provider):
+    """The provider's (sync, async) HTTP clients: one connection pool per provider, whatever the model tiers."""
+    with _http_clients_lock:
+        if provider not in _http_client_pairs:
+            import httpx
+            _http_client_pairs[provider] = (
+                httpx.Client(limits=_connection_limits()),
+                httpx.AsyncClient(limits=_connection_limits())
+            )
+        return _http_client_pairs[provider]
+
+def _build_openai(model):
+    http_client, http_async_client = _http_clients("openai")
+    with timed("langchain_openai", lazy=True):
+        from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        openai_api_key=OPENAI_API_KEY,
+        model=model,
+        temperature=0,
+        stream_usage=True,  # Report token usage (incl. cached prompt tokens) when streaming
+        max_retries=0,  # Retries and failover are handled by LLMRouter's routing policy
+        http_client=http_client,
+        http_async_client=http_async_client
+    )
+
+def _build_claude(model):
+    http_client, http_async_client = _http_clients("claude")
+    with timed("langchain_anthropic", lazy=True):
+        import anthropic
+        from langchain_anthropic import ChatAnthropic
+    llm = ChatAnthropic(
+        anthropic_api_key=CLAUDE_API_KEY,
+        model=model,
+        max_retries=0  # Retries and failover are handled by LLMRouter's routing policy
+    )
+    # ChatAnthropic creates its SDK clients lazily (cached properties) with default pool limits;
+    # pre-populate them so they use our (shared) connection pools.
+    llm.__dict__["_client"] = anthropic.Client(**llm._client_params, http_client=http_client)
+    llm.__dict__["_async_client"] = anthropic.AsyncClient(**llm._client_params, http_client=http_async_client)
+    return llm
+
+def _genai():
+    with timed("google.generativeai", lazy=True):
+        import google.generativeai as genai
+    return genai
+
+LLM_BUILDERS = {
+    "openai": _build_openai,
+    "claude": _build_claude,
+}
+
+PROVIDER_API_KEYS = {
+    "openai": OPENAI_API_KEY,
+    "claude": CLAUDE_API_KEY,
+    "gemini": GOOGLE_API_KEY,
+}
+
+SUMMARY_MODE = "summary"  # Pseudo-mode of memory summarisation calls (latency, hedging, Gemini model cache)
 
 class LLMRouter:
-    def __init__(self):
+    def __init__(self, provider=AI_PROVIDER, fallback_providers=LLM_FALLBACK_PROVIDERS):
         """Initialize the LLMRouter with API keys and provider information."""
-        self.provider = AI_PROVIDER.lower()
-        self.llms = {
-            "openai": ChatOpenAI(
-                openai_api_key=OPENAI_API_KEY,
-                model="gpt-3.5-turbo", # 
-                temperature=0
-            ),
-            "claude": ChatAnthropic(
-                anthropic_api_key=CLAUDE_API_KEY,
-                model="claude-3-7-sonnet-20250219"
-            )
-        }
+        self.provider = provider.lower()
+        # Primary provider first, then configured fallbacks that have an API key
+        self.providers = [self.provider] + [
+            p for p in fallback_providers if p != self.provider and PROVIDER_API_KEYS.get(p)
+        ]
+        self.llms = {}  # (provider, model) -> LangChain chat model, built on first use
+        self._llms_lock = threading.Lock()
+        self._gemini_models = {}  # (mode, model) -> GenerativeModel carrying that mode's system instruction
+        self._gemini_configured = False
 
-    def get_response(self, user_id, user_input, mode, memory):
-        """Route the user input to the appropriate LLM provider and return the response."""
-        if not mode or mode not in MODE_PROMPTS:
-            return "⚠️ Invalid or missing mode.", memory
+        # Failover / hedging state (see routing_policy.py)
+        self.breakers = {p: CircuitBreaker() for p in self.providers}
+        self.latency = LatencyTracker()  # (provider, tier) -> time to first token
+        self.tier_stats_tracker = TierStats()  # Per-tier latency and cost (see model_tiers.py)
+        self.response_cache = ResponseCache() if RESPONSE_CACHE else None  # Shared early-turn replies
 
         if self.provider == "gemini":
-            return self._route_to_gemini(user_id, user_input, mode, memory)
+            self._configure_gemini()
         else:
-            return self._route_to_langchain(user_id, user_input, mode, memory)
-
-    def _route_to_langchain(self, user_id, user_input, mode, memory):
-        """Route the user input to OpenAI or Claude using LangChain."""
-        print("DEBUGGING in _route_to_langchain:", 
-              "\nuser_id: ", user_id, "\nuser_input: ", user_input, 
-              "\nmode: ", mode, "\nmemory: ", memory)
-        llm = self.llms.get(self.provider)
-        if not llm:
-            return f"⚠️ Unsupported AI provider: {self.provider}", memory
+            for tier in ("heavy", "fast"):
+                self.get_llm(self.provider, tier)
 
-        if mode not in memory:
-            memory[mode] = [SystemMessage(content=MODE_PROMPTS[mode])]
+    def get_llm(self, provider, tier="heavy"):
+        """Return the (cached) LangChain client for a provider's model tier, or None if unsupported."""
+        if provider not in LLM_BUILDERS:
+            return None
+        model = tier_model(provider, tier)
+        llm = self.llms.get((provider, model))
+        if llm is None:
+            with self._llms_lock:
+                llm = self.llms.get((provider, model))
+                if llm is None:
+                    llm = self.llms[(provider, model)] = LLM_BUILDERS[provider](model)
+        return llm
 
-        memory[mode].append(HumanMessage(content=user_input))
-        try:
-            response = llm(memory[mode])
-            memory[mode].append(response)
-            print("DEBUGGING: 🧠 LLM Response Type:", type(response), "Content:", extract_content(response), "Memory:", len(memory))
-            return extract_content(response), memory
-        except Exception as e:
-            return f"❌ Error generating response: {str(e)}", memory
+    async def aget_response(self, user_id, user_input, mode, memory, usage=None):
+        """
+        Route the user input to the appropriate LLM provider and return the response.
+        Fully async: the event loop keeps serving other users while the completion runs.
+        If a `usage` dict is given, it is filled with the turn's token counts (see `_record_usage`),
+        the provider, model tier and model that answered, and the estimated cost.
+        """
+        if not mode or mode not in MODE_PROMPTS:
+            return "⚠️ Invalid or missing mode.", memory
 
-    def _route_to_gemini(self, user_id, user_input, mode, memory):
-        """Route the user input to Gemini using Google Generative AI."""
-        genai.configure(api_key=GOOGLE_API_KEY)
-        model = genai.GenerativeModel("models/gemini-1.5-pro-latest")
-        system_prompt = MODE_PROMPTS[mode]
+        parts = []
+        async for chunk in self.astream_response(user_id, user_input, mode, memory, usage):
+            parts.append(chunk)
+        return "".join(parts), memory
 
-        conversation_history = ""
-        if mode in memory:
-            for msg in memory[mode]:
-                prefix = msg["role"].capitalize()  # 'System', 'User', 'Ai'
-                conversation_history += f"{prefix}: {msg['content']}\n"
+    async def astream_response(self, user_id, user_input, mode, memory, usage=None):
+        """
+        Streaming variant of `aget_response`: an async generator yielding text chunks as the
+        provider produces them. `memory` (and `usage`) are updated in place once the stream is complete.
+        """
+        if not mode or mode not in MODE_PROMPTS:
+            yield "⚠️ Invalid or missing mode."
+            return
+
+        debug_log(
+            "astream_response", user_id=user_id, user_input=user_input, mode=mode,
+            memory_messages=len(memory.get(mode, ())), last_message=(memory.get(mode) or [None])[-1]
+        )
+        tier = choose_tier(mode, user_input, memory.get(mode, ()))
+        cache_key = self.response_cache.key(mode, memory.get(mode, []), user_input) if self.response_cache else None
+        self._append_user_input(user_input, mode, memory)
+        usage = {} if usage is None else usage
 
-        prompt = f"{system_prompt}\n\n{conversation_history}User: {user_input}"
+        cached_reply = self.response_cache.get(cache_key) if self.response_cache else None
+        if cached_reply is not None:
+            print(f"⚡ Served {mode} reply from the response cache", flush=True)
+            usage.update({"provider": "cache", "tier": "cache", "model": "cache", "cost_usd": 0.0})
+            memory[mode].append(Message("ai", cached_reply))
+            yield cached_reply
+            return
 
+        parts = []
+        started_at = time.monotonic()
+        first_chunk_at = None
+        stream = self._resilient_stream(tier, mode, list(memory[mode]), usage)
         try:
-            response = model.generate_content(prompt)
-            ai_reply = response.text.strip()
+            async for chunk in stream:
+                if first_chunk_at is None:
+                    first_chunk_at = time.monotonic()
+                parts.append(chunk)
+                yield chunk
         except Exception as e:
-            ai_reply = f"❌ Gemini error: {str(e)}"
+            separator = "\n\n" if parts else ""  # Keep any partial answer readable
+            yield f"{separator}❌ Error generating response: {str(e)}"
+            return
+        finally:
+            await stream.aclose()  # If this stream is abandoned, stop the provider's now (not at GC)
+        reply = "".join(parts).strip()
+        memory[mode].append(Message("ai", reply))
+        if cache_key is not None:
+            self.response_cache.put(cache_key, reply)
+
+        model = tier_model(usage["provider"], tier)
+        ttft = first_chunk_at - started_at if first_chunk_at else None
+        observe("llm_call", time.monotonic() - started_at, mode=mode, provider=usage["provider"])
+        if ttft is not None:
+            observe("llm_ttft", ttft, mode=mode, provider=usage["provider"])
+        usage.update({"tier": tier, "model": model})
+        usage["cost_usd"] = self.tier_stats_tracker.record(tier, model, ttft, time.monotonic() - started_at, usage)
+
+    async def asummarize(self, previous_summary, messages, max_words):
+        """Fold conversation turns into the running memory summary (used by MemoryManager)."""
+        transcript = "\n".join(
+            f"{msg.role.capitalize()}: {msg.content}" for msg in messages
+        )
+        instructions = SUMMARY_PROMPT.format(max_words=max_words)
+        request = f"Previous summary:\n{previous_summary or '(none)'}\n\nTurns to fold in:\n{transcript}"
 
+        # Summaries are routine condensation work: always use the fast tier. They go through the
+        # same timeouts, retries, failover and circuit breakers as replies.
+        messages = [Message("system", instructions), Message("user", request)]
+        parts = []
+        async for chunk in self._resilient_stream("fast", SUMMARY_MODE, messages, {}):
+            parts.append(chunk)
+        return "".join(parts)
+
+    def _append_user_input(self, user_input, mode, memory):
+        """Start the mode's memory with its system prompt if needed, then add the user's message."""
         if mode not in memory:
-            memory[mode] = [SystemMessage(content=system_prompt)]
+            memory[mode] = [Message("system", MODE_PROMPTS[mode])]
+
+        memory[mode].append(Message("user", user_input))
+
+    # ------------------------------------------------------------------ #
+    # Failover, retries and hedging
+    # Providers are tried in order (primary, then LLM_FALLBACK_PROVIDERS), skipping those
+    # whose circuit breaker is open. Each gets LLM_MAX_RETRIES retries with jittered backoff
+    # on 429/5xx/timeouts. A provider must produce its first token within its timeout; once
+    # it has, we are committed to it (the user is already seeing its text). With LLM_HEDGE,
+    # if the primary hasn't produced a token by its p95 time-to-first-token, the next
+    # provider is started too and whichever answers first wins; the other is cancelled.
+    # ------------------------------------------------------------------ #
+
+    async def _resilient_stream(self, tier, mode, messages, usage):
+        last_error = None
+        tried = 0
+        for index, provider in enumerate(self.providers):
+            breaker = self.breakers[provider]
+            allowed = breaker.allow()
+            trial = allowed and breaker.state == "half_open"  # This call claimed the single trial request
+            # Skip open circuits, unless every provider is open: then still try the last one
+            if not allowed and (tried or index + 1 < len(self.providers)):
+                continue
+            tried += 1
+            # Only hedge onto a healthy provider (a half-open one gets a single trial request)
+            hedge_provider = next(
+                (p for p in self.providers[index + 1:] if self.breakers[p].state == "closed"), None
+            ) if LLM_HEDGE else None
+            try:
+                for attempt in range(LLM_MAX_RETRIES + 1):
+                    if attempt:
+                        if breaker.state != "closed":
+                            break  # The failures so far opened the circuit: stop hammering the provider
+                        await asyncio.sleep(backoff_delay(attempt))
+                    try:
+                        pump, kind, value = await self._start_stream(
+                            provider, tier, mode, messages, usage, hedge_provider if attempt == 0 else None
+                        )
+                    except Exception as e:
+                        last_error = e
+                        if is_retryable(e):
+                            print(f"⚠️ {provider} attempt {attempt + 1} failed: {e!r}", flush=True)
+                            continue
+                        break  # Not transient: move on to the next provider
 
-        memory[mode].append(HumanMessage(content=user_input))
-        memory[mode].append(SystemMessage(content=ai_reply))
+                    # Committed to `pump.provider`: relay the rest of its stream
+                    try:
+                        while kind == "chunk":
+                            yield value
+                            kind, value = await pump.next()
+                    finally:
+                        pump.cancel()  # No-op once the stream has ended
+                    if kind == "error":
+                        self.breakers[pump.provider].record_failure()
+                        raise value
+                    self.breakers[pump.provider].record_success()
+                    usage["provider"] = pump.provider
+                    return
+            finally:
+                if trial:
+                    # Non-retryable error, cancelled or abandoned turn, or a hedge that won:
+                    # without this the breaker would stay half-open with its trial claimed forever
+                    breaker.release_trial()
+            print(f"↪️ Failing over from {provider}: {last_error!r}", flush=True)
+        raise last_error or RuntimeError("No LLM provider available")
+
+    async def _start_stream(self, provider, tier, mode, messages, usage, hedge_provider=None):
+        """
+        Start streaming from `provider` (racing `hedge_provider` if given) and wait for the
+        first item. Returns `(pump, kind, value)` for the winning stream; raises if none succeeds.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + LLM_PROVIDER_TIMEOUTS.get(provider, LLM_TIMEOUT_SECONDS)
+        racers = {}  # first-item task -> pump
+
+        def launch(name):
+            pump = StreamPump(self._provider_stream(name, tier, mode, messages, usage), name)
+            racers[asyncio.ensure_future(pump.next())] = pump
+
+        launch(provider)
+        hedge_at = loop.time() + self.latency.hedge_delay((provider, tier)) if hedge_provider else None
+        error = None
+        try:
+            while racers:
+                wait_until = min(deadline, hedge_at) if hedge_at else deadline
+                done, _ = await asyncio.wait(
+                    racers, timeout=max(0, wait_until - loop.time()), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    if hedge_at and loop.time() >= hedge_at:
+                        print(f"🏁 Hedging: {provider} slow to first token, also asking {hedge_provider}", flush=True)
+                        hedge_at = None
+                        deadline = max(deadline, loop.time() + LLM_PROVIDER_TIMEOUTS.get(hedge_provider, LLM_TIMEOUT_SECONDS))
+                        launch(hedge_provider)
+                        continue
+                    for pump in racers.values():
+                        self.breakers[pump.provider].record_failure()
+                    raise asyncio.TimeoutError(f"no response from {', '.join(p.provider for p in racers.values())}")
 
-        return ai_reply, memory
+                for task in done:
+                    pump = racers.pop(task)
+                    kind, value = task.result()
+                    if kind == "error":
+                        error = value
+                        if is_retryable(value):
+                            self.breakers[pump.provider].record_failure()
+                        pump.cancel()
+                        continue
+                    self.latency.record((pump.provider, tier), time.monotonic() - pump.started_at)
+                    return pump, kind, value
+            raise error  # Every stream failed before its first token: the retry loop decides what's next
+        finally:
+            for task, pump in racers.items():  # Losers and timed-out streams
+                task.cancel()
+                pump.cancel()
+
+    async def _provider_stream(self, provider, tier, mode, messages, usage):
+        """Stream non-empty text chunks from one provider's model tier; errors propagate to the caller."""
+        if provider == "gemini":
+            # Summaries carry their instructions as the first message instead of a mode prompt
+            instruction = messages[0].content if mode == SUMMARY_MODE else None
+            response = await self._gemini_model(mode, tier, instruction).generate_content_async(
+                self._gemini_contents(messages), stream=True
+            )
+            async for chunk in response:
+                text = _gemini_chunk_text(chunk)
+                if text:
+                    yield text
+            _record_gemini_usage(usage, response.usage_metadata)
+            return
+
+        llm = self.get_llm(provider, tier)
+        if not llm:
+            raise ValueError(f"Unsupported AI provider: {provider}")
+        aggregate = None  # Chunks add up to the full message, including its usage metadata
+        async for chunk in llm.astream(self._provider_messages(provider, messages)):
+            aggregate = chunk if aggregate is None else aggregate + chunk
+            text = extract_content(chunk)
+            if isinstance(text, str) and text:
+                yield text
+        if aggregate is not None:
+            _record_usage(usage, aggregate.usage_metadata)
+
+    def _provider_messages(self, provider, messages):
+        """
+        Prepare memory for the provider, with prompt caching in mind. Memory is always ordered
+        mode prompt → running summary → turns, so the request prefix is stable across turns:
+        - OpenAI caches long stable prefixes automatically; messages are sent unchanged.
+        - Anthropic caches only marked prefixes: mark the mode prompt and the last message
+          before the new user input (the history so far) with `cache_control`.
+        Each message's LangChain form is built once and reused on later turns (see chat_message.py).
+        """
+        prepared = [msg.to_langchain() for msg in messages]
+        if provider != "claude":
+            return prepared
+
+        history_end = len(prepared) - 2  # Last message before the new user input
+        for i, msg in enumerate(prepared):
+            if (i == 0 or i == history_end) and isinstance(msg.content, str) and msg.content.strip():
+                prepared[i] = msg.model_copy(update={
+                    "content": [{"type": "text", "text": msg.content, "cache_control": ANTHROPIC_CACHE_CONTROL}]
+                })
+        return prepared
+
+    def policy_stats(self):
+        """Circuit breaker state and time-to-first-token p95 (per model tier) for each provider."""
+        return {
+            provider: {
+                "circuit": self.breakers[provider].state,
+                "consecutive_failures": self.breakers[provider].failures,
+                "ttft_p95": {tier: self.latency.percentile((provider, tier), 95) for tier in ("fast", "heavy")},
+            }
+            for provider in self.providers
+        }
+
+    def cache_stats(self):
+        """Hit rate of the early-turn response cache (see response_cache.py), or None if it is disabled."""
+        return self.response_cache.stats() if self.response_cache else None
+
+    def tier_stats(self):
+        """Calls, latency, tokens and estimated cost per model tier (see model_tiers.py)."""
+        return self.tier_stats_tracker.stats()
+
+    # ------------------------------------------------------------------ #
+    # Gemini: native multi-turn chat
+    # The mode prompt goes into the model's `system_instruction` (one cached GenerativeModel per
+    # mode), and memory is passed as structured `contents` turns. Memory uses the same message
+    # format as the LangChain path, so providers can be switched without converting anything.
+    # ------------------------------------------------------------------ #
+
+    def _configure_gemini(self):
+        """Import and configure the Gemini SDK once per process (not per message); returns the module."""
+        genai = _genai()
+        if not self._gemini_configured:
+            genai.configure(api_key=GOOGLE_API_KEY)
+            self._gemini_configured = True
+        return genai
+
+    def _gemini_model(self, mode, tier="heavy", system_instruction=None):
+        name = tier_model("gemini", tier)
+        model = self._gemini_models.get((mode, name))
+        if model is None:
+            genai = self._configure_gemini()
+            model = self._gemini_models[(mode, name)] = genai.GenerativeModel(
+                name, system_instruction=system_instruction or MODE_PROMPTS[mode]
+            )
+        return model
+
+    def _gemini_contents(self, messages):
+        """
+        Convert memory into Gemini `contents`. The mode prompt is skipped (it is the system
+        instruction), the running summary is given as user-side context, and consecutive
+        messages of the same role are merged into one turn with several parts.
+        """
+        contents = []
+        started = False  # Seen the first user/AI turn
+        for msg in messages:
+            role = msg.role
+            if role == "system" and not started:
+                if not is_summary(msg):
+                    continue  # Mode prompt, already in system_instruction
+                gemini_role = "user"
+            elif role == "user":
+                gemini_role = "user"
+            else:
+                gemini_role = "model"  # 'ai' (and replies stored as system messages by older versions)
+            if role != "system":
+                started = True
+
+            text = msg.content
+            if not text:
+                continue
+            if contents and contents[-1]["role"] == gemini_role:
+                contents[-1]["parts"].append(text)
+            else:
+                contents.append({"role": gemini_role, "parts": [text]})
+        return contents
+
+
+def _gemini_chunk_text(chunk):
+    """`chunk.text` raises when a streamed chunk carries no text (e.g. only the finish reason)."""
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+
+# ======================== #
+#  Token Usage Reporting   #
+# ======================== #
+# Per-turn token counts, split into cached and uncached input tokens so we can see how much
+# of each prompt the provider served from its prompt cache.
+ANTHROPIC_CACHE_CONTROL = {"type": "ephemeral"}
+
+def _record_usage(usage, usage_metadata):
+    """Fill `usage` from LangChain's `usage_metadata` (OpenAI and Claude)."""
+    if usage is None or not usage_metadata:
+        return
+    details = usage_metadata.get("input_token_details") or {}
+    cached = details.get("cache_read") or 0
+    cache_write = details.get("cache_creation") or 0
+    input_tokens = usage_metadata.get("input_tokens") or 0
+    usage.update({
+        "input_tokens": input_tokens,
+        "cached_input_tokens": cached,
+        "uncached_input_tokens": input_tokens - cached,
+        "cache_write_tokens": cache_write,
+        "output_tokens": usage_metadata.get("output_tokens") or 0,
+    })
+
+def _record_gemini_usage(usage, usage_metadata):
+    """Fill `usage` from a Gemini response's `usage_metadata`."""
+    if usage is None or usage_metadata is None:
+        return
+    input_tokens = getattr(usage_metadata, "prompt_token_count", 0) or 0
+    cached = getattr(usage_metadata, "cached_content_token_count", 0) or 0
+    usage.update({
+        "input_tokens": input_tokens,
+        "cached_input_tokens": cached,
+        "uncached_input_tokens": input_tokens - cached,
+        "cache_write_tokens": 0,
+        "output_tokens": getattr(usage_metadata, "candidates_token_count", 0) or 0,
+    })
+
+
+# ======================== #
+#  Shared Router           #
+# ======================== #
+_router = None
+_router_lock = threading.Lock()
+
+def get_router():
+    """
+    Return the process-wide LLMRouter, creating it on first call.
+    Call it once at application startup so the first user doesn't pay for client setup.
+    """
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = LLMRouter()
+    return _router
 
 
 # ==================================================================
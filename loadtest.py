@@ -0,0 +1,509 @@
+import os
+import sys
+import copy
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import tempfile
+import contextlib
+import threading
+
+# ======================== #
+#  Load Test & Benchmark   #
+# ======================== #
+# Drives the real handlers (handlers.text_message → ConversationManager → LLMRouter → BotUser)
+# with synthetic Telegram updates, at a configurable number of concurrent chats, with local
+# stand-ins for everything outside the process:
+#   - Telegram: fake Update/Message objects; reply_text/edit_text take --telegram-latency
+#   - LLMs:     FakeChatModel, a LangChain chat model streaming a canned reply with a tunable
+#               time to first token (--llm-ttft) and delay per token (--llm-token-delay)
+#   - Firestore: InMemoryFirestore behind the production FirestoreStorage, counting document
+#               reads, writes and round-trips, each round-trip taking --storage-latency
+# It reports p50/p95/p99 turn latency, turns/sec, Firestore operations per turn and the mean
+# time per stage (from instrumentation.py). With --max-p95 / --max-ops-per-turn it exits
+# non-zero when a budget is exceeded, so it can gate a deploy:
+#
+#   python loadtest.py --users 50 --turns 10 --llm-ttft 0.4 --max-p95 3.0
+#
+# Voice messages are not simulated (Whisper would need a fake audio pipeline).
+
+# The stand-ins replace the real providers, so the harness needs no credentials. This must
+# happen before config.py is imported (it reads the environment once, at import).
+os.environ["AI_PROVIDER"] = "openai"
+os.environ["LLM_FALLBACK_PROVIDERS"] = ""
+os.environ.setdefault("OPENAI_API_KEY", "loadtest")
+os.environ.setdefault("TELEGRAM_API_TOKEN", "0:loadtest")
+os.environ.setdefault("FREE_TIER_REPLY_LIMIT", "1000000")  # Keep the quota check, never hit it
+os.environ.setdefault("METRICS_PORT", "0")
+os.environ["WRITE_BEHIND_SPILL_PATH"] = os.path.join(tempfile.mkdtemp(prefix="pm_pal_loadtest_"), "spill.jsonl")
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+import handlers
+import llm_router
+import storage
+from chat_scheduler import scheduler
+from instrumentation import stage_seconds
+from write_behind import write_behind
+
+SAMPLE_PROMPTS = [
+    "how do i write a good product requirements document",
+    "what metrics should i track for a new onboarding flow",
+    "walk me through prioritising a backlog with rice",
+    "how would you improve google maps for cyclists",
+    "i have a pm interview next week, what should i prepare",
+    "explain the difference between output and outcome",
+    "how do i say no to a stakeholder without burning the relationship",
+    "design a product for elderly people living alone",
+    "what is a north star metric and how do i pick one",
+    "how should i run a discovery interview with customers",
+]
+
+REPLY_TEXT = (
+    "Great question! Start from the user problem and the outcome you want, then work backwards: "
+    "who is affected, how often, and what would change for them. Turn that into a hypothesis, "
+    "pick one metric that tells you whether it worked, and agree on it with your team before "
+    "building anything. What would you try first?"
+)
+
+
+# ------------------------------------------------------------------ #
+# LLM stand-in
+# ------------------------------------------------------------------ #
+
+class FakeChatModel(BaseChatModel):
+    """Streams REPLY_TEXT word by word after `ttft` seconds, `token_delay` seconds apart."""
+
+    ttft: float = 0.3
+    token_delay: float = 0.01
+    reply: str = REPLY_TEXT
+
+    @property
+    def _llm_type(self):
+        return "loadtest-fake"
+
+    def _usage(self, messages):
+        input_tokens = sum(len(str(m.content)) for m in messages) // 4
+        output_tokens = len(self.reply) // 4
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.ttft)
+        message = AIMessage(content=self.reply, usage_metadata=self._usage(messages))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.ttft)
+        message = AIMessage(content=self.reply, usage_metadata=self._usage(messages))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.ttft)
+        words = self.reply.split(" ")
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.token_delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else " " + word))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages)))
+
+
+# ------------------------------------------------------------------ #
+# Firestore stand-in
+# ------------------------------------------------------------------ #
+# Implements the subset of the google-cloud-firestore client that FirestoreStorage uses.
+# Counted like Firestore bills and like the network sees it:
+#   reads        documents returned by get() and by queries
+#   writes       documents written (each write in a batch counts)
+#   round_trips  RPCs: each get/set/update, each query, each batch commit
+
+class OpCounter:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.reads = 0
+        self.writes = 0
+        self.round_trips = 0
+        self._lock = threading.Lock()
+
+    def rpc(self, reads=0, writes=0):
+        with self._lock:
+            self.reads += reads
+            self.writes += writes
+            self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)  # Storage calls run in the I/O thread pool (`run_io`)
+
+    def snapshot(self):
+        with self._lock:
+            return {"reads": self.reads, "writes": self.writes, "round_trips": self.round_trips}
+
+
+class InMemoryFirestore:
+    def __init__(self, latency=0.0):
+        self.docs = {}  # "users/1/history_logs/abc" -> dict
+        self.ops = OpCounter(latency)
+        self.lock = threading.Lock()
+
+    def collection(self, name):
+        return _Collection(self, name)
+
+    def batch(self):
+        return _Batch(self)
+
+    def apply(self, path, data, merge):
+        from google.cloud.firestore_v1 import transforms
+        with self.lock:
+            doc = copy.deepcopy(self.docs.get(path) or {}) if merge else {}
+            _merge_fields(doc, data, merge, transforms)
+            self.docs[path] = doc
+
+
+def _merge_fields(doc, data, merge, transforms):
+    for key, value in data.items():
+        if isinstance(value, transforms.Increment):
+            doc[key] = (doc.get(key) or 0) + value.value
+        elif value is transforms.DELETE_FIELD:
+            doc.pop(key, None)
+        elif merge and isinstance(value, dict) and isinstance(doc.get(key), dict):
+            _merge_fields(doc[key], value, merge, transforms)  # set(merge=True) merges nested maps
+        elif isinstance(value, dict):
+            doc[key] = {}
+            _merge_fields(doc[key], value, merge, transforms)
+        else:
+            doc[key] = copy.deepcopy(value)
+
+
+class _Snapshot:
+    def __init__(self, path, data):
+        self.id = path.rsplit("/", 1)[-1]
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class _Document:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+
+    def collection(self, name):
+        return _Collection(self.db, f"{self.path}/{name}")
+
+    def get(self):
+        self.db.ops.rpc(reads=1)
+        return _Snapshot(self.path, self.db.docs.get(self.path))
+
+    def set(self, data, merge=False):
+        self.db.ops.rpc(writes=1)
+        self.db.apply(self.path, data, merge)
+
+    def update(self, data):
+        self.db.ops.rpc(writes=1)
+        if self.path not in self.db.docs:
+            raise KeyError(f"No document to update: {self.path}")
+        self.db.apply(self.path, data, merge=True)
+
+    def create(self, data):
+        from google.api_core.exceptions import AlreadyExists
+        self.db.ops.rpc(writes=1)
+        with self.db.lock:
+            if self.path in self.db.docs:
+                raise AlreadyExists(f"Document already exists: {self.path}")
+            self.db.docs[self.path] = copy.deepcopy(data)
+
+
+class _Collection:
+    def __init__(self, db, path, filters=(), order=None):
+        self.db = db
+        self.path = path
+        self.filters = filters
+        self.order = order
+
+    def document(self, doc_id=None):
+        return _Document(self.db, f"{self.path}/{doc_id or uuid.uuid4().hex[:20]}")
+
+    def where(self, filter):
+        condition = (filter.field_path, filter.op_string, filter.value)
+        return _Collection(self.db, self.path, self.filters + (condition,), self.order)
+
+    def order_by(self, field):
+        return _Collection(self.db, self.path, self.filters, field)
+
+    def stream(self):
+        prefix = self.path + "/"
+        with self.db.lock:
+            rows = [
+                (path, copy.deepcopy(data)) for path, data in self.db.docs.items()
+                if path.startswith(prefix) and "/" not in path[len(prefix):]
+            ]
+        for field, op, value in self.filters:
+            rows = [(path, data) for path, data in rows if field in data and _COMPARE[op](data[field], value)]
+        rows.sort(key=(lambda row: row[1].get(self.order)) if self.order else (lambda row: row[0]))
+        self.db.ops.rpc(reads=max(len(rows), 1))  # Firestore bills an empty query as one read
+        return [_Snapshot(path, data) for path, data in rows]
+
+
+_COMPARE = {
+    "==": lambda a, b: a == b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+}
+
+
+class _Batch:
+    def __init__(self, db):
+        self.db = db
+        self._writes = []
+
+    def set(self, ref, data, merge=False):
+        self._writes.append((ref.path, data, merge))
+
+    def update(self, ref, data):
+        self._writes.append((ref.path, data, True))
+
+    def commit(self):
+        self.db.ops.rpc(writes=len(self._writes))
+        for path, data, merge in self._writes:
+            self.db.apply(path, data, merge)
+
+
+# ------------------------------------------------------------------ #
+# Telegram stand-in
+# ------------------------------------------------------------------ #
+
+class FakeMessage:
+    def __init__(self, chat, chat_id, text=None):
+        self.chat = chat
+        self.chat_id = chat_id
+        self.text = text
+        self.voice = None
+        self.message_id = chat.next_message_id()
+
+    async def reply_text(self, text, **kwargs):
+        await self.chat.api_call()
+        return FakeMessage(self.chat, self.chat_id, text)
+
+    async def edit_text(self, text, **kwargs):
+        await self.chat.api_call()
+        self.text = text
+        return self
+
+
+class FakeChat:
+    """One synthetic user: builds their Updates and counts the Bot API calls made for them."""
+
+    def __init__(self, chat_id, latency):
+        self.chat_id = chat_id
+        self.latency = latency
+        self.api_calls = 0
+        self._message_ids = 0
+
+    def next_message_id(self):
+        self._message_ids += 1
+        return self._message_ids
+
+    async def api_call(self):
+        self.api_calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def update(self, text):
+        message = FakeMessage(self, self.chat_id, text)
+        return _FakeUpdate(message)
+
+
+class _FakeUpdate:
+    def __init__(self, message):
+        self.message = message
+        self.effective_chat = message.chat
+        self.effective_user = message.chat
+
+
+class _FakeContext:
+    args = None
+    bot = None
+
+
+# ------------------------------------------------------------------ #
+# Benchmark
+# ------------------------------------------------------------------ #
+
+MODE_COMMANDS = [handlers.mode_mentor, handlers.mode_coach, handlers.mode_interview]
+
+
+def install_stand_ins(args):
+    """Point the router at FakeChatModel and storage at InMemoryFirestore. Returns the fake DB."""
+    def build_fake(model):
+        return FakeChatModel(ttft=args.llm_ttft, token_delay=args.llm_token_delay)
+
+    for provider in list(llm_router.LLM_BUILDERS):
+        llm_router.LLM_BUILDERS[provider] = build_fake
+    db = InMemoryFirestore(latency=args.storage_latency)
+    storage.set_storage(storage.FirestoreStorage(db))
+    return db
+
+
+async def run_user(chat, turns, think_time, rng, latencies, errors):
+    """/start, pick a mode, then send `turns` messages one after another (a user waits for each reply)."""
+    context = _FakeContext()
+    await handlers.start(chat.update("/start"), context)
+    await rng.choice(MODE_COMMANDS)(chat.update("/mode"), context)
+    for turn in range(turns):
+        if think_time:
+            await asyncio.sleep(rng.uniform(0, 2 * think_time))
+        text = rng.choice(SAMPLE_PROMPTS) + (f" (turn {turn})" if turn else "")
+        started = time.perf_counter()
+        try:
+            await handlers.text_message(chat.update(text), context)
+        except Exception as e:
+            errors.append(repr(e))
+            continue
+        latencies.append(time.perf_counter() - started)
+
+
+async def run_benchmark(args, db):
+    rng = random.Random(args.seed)
+    chats = [FakeChat(chat_id=100000 + i, latency=args.telegram_latency) for i in range(args.users)]
+    latencies, errors = [], []
+    stages_before = stage_totals()
+    ops_before = db.ops.snapshot()
+
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        run_user(chat, args.turns, args.think_time, random.Random(rng.random()), latencies, errors)
+        for chat in chats
+    ])
+    elapsed = time.perf_counter() - started
+
+    # History logs and usage rollups are written in the background: count them too
+    await asyncio.to_thread(write_behind.close)
+    ops_after = db.ops.snapshot()
+
+    turns = len(latencies)
+    ops = {key: ops_after[key] - ops_before[key] for key in ops_after}
+    stages_after = stage_totals()
+    stages = {}
+    for stage, (count, total) in stages_after.items():
+        count_before, total_before = stages_before.get(stage, (0, 0.0))
+        if count > count_before:
+            stages[stage] = {"count": count - count_before, "mean_ms": (total - total_before) / (count - count_before) * 1000}
+
+    latencies.sort()
+    return {
+        "users": args.users,
+        "turns": turns,
+        "errors": len(errors),
+        "rejected_busy": scheduler.rejected,
+        "elapsed_seconds": elapsed,
+        "turns_per_second": turns / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "p50": percentile(latencies, 50) * 1000,
+            "p95": percentile(latencies, 95) * 1000,
+            "p99": percentile(latencies, 99) * 1000,
+            "max": (latencies[-1] if latencies else 0.0) * 1000,
+        },
+        "firestore_per_turn": {key: value / turns if turns else 0.0 for key, value in ops.items()},
+        "telegram_calls_per_turn": sum(chat.api_calls for chat in chats) / turns if turns else 0.0,
+        "stages": stages,
+        "sample_errors": errors[:5],
+    }
+
+
+def stage_totals():
+    """{stage: (count, total seconds)} across all modes and providers, from the stage histogram."""
+    totals = {}
+    for labels, (count, total) in stage_seconds.totals().items():
+        stage = labels[0]
+        previous_count, previous_total = totals.get(stage, (0, 0.0))
+        totals[stage] = (previous_count + count, previous_total + total)
+    return totals
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def print_report(result):
+    latency = result["latency_ms"]
+    ops = result["firestore_per_turn"]
+    print(f"\n📊 {result['turns']} turns from {result['users']} users in {result['elapsed_seconds']:.1f} s "
+          f"→ {result['turns_per_second']:.1f} turns/s")
+    print(f"   latency  p50 {latency['p50']:.0f} ms · p95 {latency['p95']:.0f} ms · "
+          f"p99 {latency['p99']:.0f} ms · max {latency['max']:.0f} ms")
+    print(f"   firestore per turn  {ops['reads']:.2f} reads · {ops['writes']:.2f} writes · "
+          f"{ops['round_trips']:.2f} round-trips")
+    print(f"   telegram calls per turn  {result['telegram_calls_per_turn']:.2f}")
+    if result["errors"] or result["rejected_busy"]:
+        print(f"   ⚠️ {result['errors']} errors, {result['rejected_busy']} updates rejected as busy")
+        for error in result["sample_errors"]:
+            print(f"      {error}")
+    print("   mean time per stage:")
+    for stage, values in sorted(result["stages"].items(), key=lambda item: -item[1]["mean_ms"]):
+        print(f"      {stage:<14} {values['mean_ms']:8.1f} ms  (×{values['count']})")
+
+
+def check_budgets(result, args):
+    """Return the list of exceeded budgets (empty when everything is within limits)."""
+    failures = []
+    if args.max_p95 is not None and result["latency_ms"]["p95"] > args.max_p95 * 1000:
+        failures.append(f"p95 latency {result['latency_ms']['p95']:.0f} ms > {args.max_p95 * 1000:.0f} ms")
+    round_trips = result["firestore_per_turn"]["round_trips"]
+    if args.max_ops_per_turn is not None and round_trips > args.max_ops_per_turn:
+        failures.append(f"{round_trips:.2f} Firestore round-trips per turn > {args.max_ops_per_turn}")
+    if result["errors"]:
+        failures.append(f"{result['errors']} turns failed")
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test PM Pal's message handling with local stand-ins.")
+    parser.add_argument("--users", type=int, default=20, help="Concurrent chats (default: 20)")
+    parser.add_argument("--turns", type=int, default=5, help="Messages per chat (default: 5)")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean pause between a user's messages, seconds")
+    parser.add_argument("--llm-ttft", type=float, default=0.3, help="Fake LLM time to first token, seconds")
+    parser.add_argument("--llm-token-delay", type=float, default=0.01, help="Fake LLM delay between tokens, seconds")
+    parser.add_argument("--storage-latency", type=float, default=0.005, help="Firestore round-trip latency, seconds")
+    parser.add_argument("--telegram-latency", type=float, default=0.02, help="Telegram Bot API call latency, seconds")
+    parser.add_argument("--seed", type=int, default=7, help="Random seed for prompts and modes")
+    parser.add_argument("--json", action="store_true", help="Print the result as JSON (for CI)")
+    parser.add_argument("--verbose", action="store_true", help="Keep the bot's own per-turn logging")
+    parser.add_argument("--max-p95", type=float, help="Fail if p95 turn latency exceeds this many seconds")
+    parser.add_argument("--max-ops-per-turn", type=float, help="Fail if Firestore round-trips per turn exceed this")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    db = install_stand_ins(args)
+    with open(os.devnull, "w") as devnull:
+        # The bot logs every turn; keep the report (and --json output) readable
+        with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull):
+            result = asyncio.run(run_benchmark(args, db))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+    failures = check_budgets(result, args)
+    for failure in failures:
+        print(f"❌ {failure}", flush=True)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+import functools
+from chat_message import Message
+from config import MEMORY_TOKEN_BUDGET, MEMORY_SUMMARY_MAX_TOKENS, MEMORY_COMPACT_TARGET_RATIO
+
+try:
+    import tiktoken  # Installed with langchain_openai; fall back to a character heuristic without it
+except ImportError:
+    tiktoken = None
+
+# ======================== #
+#  Memory Manager          #
+# ======================== #
+# Keeps the per-mode `memory` sent to the LLM under a token budget.
+# A mode's memory is a list of `Message`s (see chat_message.py), laid out as:
+#   [system prompt, (running summary), user, ai, user, ai, ...]
+# When it grows past the budget, the oldest turns (a user message plus the replies to it)
+# are evicted and folded into the running summary, which is a system message right after
+# the mode prompt. The most recent turn is always kept. Prompt size and the stored memory
+# snapshot therefore stay bounded, however long the session runs.
+# Compaction goes down to a low-water mark (MEMORY_COMPACT_TARGET_RATIO of the budget), so
+# the next several turns fit without another summarisation call, and the summary (part of
+# the cached prompt prefix) changes only every few turns.
+
+SUMMARY_PREFIX = "Summary of the earlier conversation (older turns were condensed to save context):\n"
+MESSAGE_OVERHEAD_TOKENS = 4  # Role and separator tokens each chat message costs
+
+_encoding = None
+
+def _get_encoding():
+    """Load the tokenizer once; returns None if tiktoken (or its vocabulary download) is unavailable."""
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    return _encoding or None
+
+
+@functools.lru_cache(maxsize=4096)
+def count_text_tokens(text):
+    """Token count of a string (memoised: the same messages are counted on every turn)."""
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1  # ~4 characters per token for English text
+
+
+def count_message_tokens(msg):
+    return count_text_tokens(msg.content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def is_summary(msg):
+    return msg.role == "system" and msg.content.startswith(SUMMARY_PREFIX)
+
+
+def _truncate_tokens(text, max_tokens, keep="start"):
+    """Trim text to roughly `max_tokens`, keeping its start or its end."""
+    if count_text_tokens(text) <= max_tokens:
+        return text
+    max_chars = max_tokens * 4
+    return text[:max_chars] if keep == "start" else text[-max_chars:]
+
+
+class MemoryManager:
+    def __init__(self, summarizer=None, token_budget=MEMORY_TOKEN_BUDGET, summary_max_tokens=MEMORY_SUMMARY_MAX_TOKENS,
+                 target_ratio=MEMORY_COMPACT_TARGET_RATIO):
+        """
+        `summarizer` is an async callable `(previous_summary, evicted_messages, max_words) -> str`,
+        usually `LLMRouter.asummarize`. Without one (or if it fails), evicted turns are folded
+        into an extractive summary instead.
+        """
+        self.summarizer = summarizer
+        self.token_budget = token_budget
+        self.summary_max_tokens = summary_max_tokens
+        self.target_ratio = target_ratio
+
+    def count_tokens(self, messages):
+        return sum(count_message_tokens(msg) for msg in messages)
+
+    def needs_compaction(self, messages):
+        return self.count_tokens(messages) > self.token_budget
+
+    def split(self, messages):
+        """Split memory into (leading system messages, summary text, turns)."""
+        head, summary = [], ""
+        i = 0
+        while i < len(messages) and messages[i].role == "system":
+            if is_summary(messages[i]):
+                summary = messages[i].content[len(SUMMARY_PREFIX):]
+            else:
+                head.append(messages[i])
+            i += 1
+        return head, summary, messages[i:]
+
+    @staticmethod
+    def group_turns(messages):
+        """Group messages into turns, each starting at a user message."""
+        turns = []
+        for msg in messages:
+            if not turns or msg.role == "user":
+                turns.append([])
+            turns[-1].append(msg)
+        return turns
+
+    async def acompact(self, messages):
+        """
+        Return `(messages, evicted_turns)`: the memory brought down to the low-water mark if it
+        is over the token budget, and how many of the oldest turns were folded into the summary
+        (0 if it already fit).
+        """
+        if not self.needs_compaction(messages):
+            return messages, 0
+
+        head, summary, rest = self.split(messages)
+        turns = self.group_turns(rest)
+
+        # Reserve room for the system prompt and a full-size summary, then keep the newest turns that fit
+        target = int(self.token_budget * self.target_ratio)
+        available = target - self.count_tokens(head) - self.summary_max_tokens - MESSAGE_OVERHEAD_TOKENS
+        kept = 0
+        for turn in reversed(turns):
+            cost = self.count_tokens(turn)
+            if kept and cost > available:
+                break
+            available -= cost
+            kept += 1
+
+        evicted = turns[:len(turns) - kept]
+        if not evicted:
+            return messages, 0
+
+        evicted_messages = [msg for turn in evicted for msg in turn]
+        new_summary = await self._summarize(summary, evicted_messages)
+        compacted = head + [Message("system", SUMMARY_PREFIX + new_summary)]
+        for turn in turns[len(evicted):]:
+            compacted.extend(turn)
+        return compacted, len(evicted)
+
+    async def _summarize(self, previous_summary, evicted_messages):
+        max_words = int(self.summary_max_tokens * 0.7)  # ~0.75 words per token, with some slack
+        if self.summarizer:
+            try:
+                summary = await self.summarizer(previous_summary, evicted_messages, max_words)
+                if summary and summary.strip():
+                    return _truncate_tokens(summary.strip(), self.summary_max_tokens)
+            except Exception as e:
+                print("⚠️ Memory summarization failed, using extractive summary:", e, flush=True)
+
+        # Extractive fallback: append the first lines of each evicted message, keep the most recent part
+        lines = [previous_summary] if previous_summary else []
+        for msg in evicted_messages:
+            content = " ".join(msg.content.split())
+            lines.append(f"{msg.role.capitalize()}: {content[:200]}")
+        return _truncate_tokens("\n".join(lines), self.summary_max_tokens, keep="end")
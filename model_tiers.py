@@ -0,0 +1,97 @@
+from config import MODEL_TIERING, MODEL_TIERS, FAST_TIER_MAX_INPUT_CHARS, HEAVY_TIER_MODES, HEAVY_TIER_MIN_TURN
+from memory_manager import is_summary
+from routing_policy import LatencyTracker
+
+# ======================== #
+#  Model Tiers             #
+# ======================== #
+# Each provider has two models (see MODEL_TIERS in config.py):
+#   - "fast": a small model for short turns — greetings, menu picks ("2"), quick clarifications
+#   - "heavy": the full model for mentor gap analyses, interviewer feedback and long answers
+# `choose_tier` picks one per turn from the mode, the length of the user's message and how far
+# into the session we are. `TierStats` keeps per-tier latency, token and cost counters, so the
+# routing rules can be tuned against what they actually save.
+
+# USD per million tokens: (input, cached input, output). Unknown models count as free.
+MODEL_PRICES = {
+    "gpt-3.5-turbo": (0.50, 0.50, 1.50),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "claude-3-7-sonnet-20250219": (3.00, 0.30, 15.00),
+    "claude-3-5-haiku-20241022": (0.80, 0.08, 4.00),
+    "models/gemini-1.5-pro-latest": (1.25, 0.3125, 5.00),
+    "models/gemini-1.5-flash-latest": (0.075, 0.01875, 0.30),
+}
+
+
+def conversation_turn(messages):
+    """How many user turns the mode's memory already holds (a running summary means well past the start)."""
+    turns = sum(1 for msg in messages if msg.role == "user")
+    if any(is_summary(msg) for msg in messages):
+        turns += HEAVY_TIER_MIN_TURN
+    return turns
+
+
+def choose_tier(mode, user_input, messages=()):
+    """
+    Pick "fast" or "heavy" for one turn. `messages` is the mode's memory before this turn.
+    - tiering off → heavy
+    - heavy-tier modes (mentor, interviewer) past the opening turns → heavy: that's where
+      gap analyses and interview feedback happen
+    - short input → fast
+    - everything else → heavy
+    """
+    if not MODEL_TIERING:
+        return "heavy"
+    if mode in HEAVY_TIER_MODES and conversation_turn(messages) >= HEAVY_TIER_MIN_TURN:
+        return "heavy"
+    if len(user_input.strip()) <= FAST_TIER_MAX_INPUT_CHARS:
+        return "fast"
+    return "heavy"
+
+
+def tier_model(provider, tier):
+    return MODEL_TIERS[tier][provider]
+
+
+def estimate_cost(model, usage):
+    """Cost in USD of one call, from the token counts in `usage` (see `_record_usage` in llm_router.py)."""
+    input_price, cached_price, output_price = MODEL_PRICES.get(model, (0, 0, 0))
+    cached = usage.get("cached_input_tokens", 0)
+    uncached = usage.get("input_tokens", 0) - cached
+    return (uncached * input_price + cached * cached_price + usage.get("output_tokens", 0) * output_price) / 1_000_000
+
+
+class TierStats:
+    def __init__(self):
+        self.latency = LatencyTracker(min_samples=1)  # tier -> time to first token
+        self.totals = {}  # tier -> counters
+
+    def record(self, tier, model, ttft, total_seconds, usage):
+        totals = self.totals.setdefault(tier, {
+            "calls": 0, "seconds": 0.0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0, "models": {}
+        })
+        cost = estimate_cost(model, usage)
+        totals["calls"] += 1
+        totals["seconds"] += total_seconds
+        totals["input_tokens"] += usage.get("input_tokens", 0)
+        totals["output_tokens"] += usage.get("output_tokens", 0)
+        totals["cost_usd"] += cost
+        totals["models"][model] = totals["models"].get(model, 0) + 1
+        if ttft is not None:
+            self.latency.record(tier, ttft)
+        return cost
+
+    def stats(self):
+        """Per tier: calls, models used, p50/p95 time to first token, mean duration, tokens and cost."""
+        report = {}
+        for tier, totals in self.totals.items():
+            calls = totals["calls"]
+            report[tier] = {
+                **totals,
+                "ttft_p50": self.latency.percentile(tier, 50),
+                "ttft_p95": self.latency.percentile(tier, 95),
+                "avg_seconds": totals["seconds"] / calls if calls else 0.0,
+                "avg_cost_usd": totals["cost_usd"] / calls if calls else 0.0,
+            }
+        return report
@@ -203,4 +203,14 @@ MODE_PROMPTS = {
 }
 
 # Default AI mode
-DEFAULT_MODE = "mentor"
\ No newline at end of file
+DEFAULT_MODE = "mentor"
+# Used to fold older turns into a running summary when a conversation outgrows its memory budget
+SUMMARY_PROMPT = """
+    You maintain the running memory of a Product Management learning session between a user and an AI assistant.
+    You are given the previous summary (if any) and the conversation turns that are being dropped from the context window.
+    Write an updated summary that the assistant can rely on to continue the session. Keep:
+    - The user's background, goals, and any facts they shared about themselves
+    - The topic, case study, or interview type in progress, and which step was reached
+    - Key answers, feedback given, and open questions or next steps
+    Be factual and concise (under {max_words} words). Write plain text, no greetings.
+    """
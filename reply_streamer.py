@@ -0,0 +1,162 @@
+import time
+import asyncio
+from telegram.constants import MessageLimit, ParseMode
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from config import STREAM_EDIT_INTERVAL_SECONDS
+from instrumentation import span
+
+# ======================== #
+#  Streaming Reply         #
+# ======================== #
+# Shows an AI reply while it is being generated, instead of after the whole completion:
+#   1. send a placeholder message as soon as the turn starts
+#   2. edit it with the text received so far, at most once per `edit_interval` seconds
+#      (Telegram rate-limits edits; the first chunk is shown immediately)
+#   3. when the text outgrows one Telegram message (4096 chars), freeze the current message
+#      and continue in a follow-up message
+#   4. on `finish()`, render the final text with Markdown (falling back to plain text if
+#      the model produced Markdown that Telegram can't parse); an empty reply replaces the
+#      placeholder with EMPTY_REPLY, so it never stays on screen
+# While streaming, edits are sent as plain text: half-written Markdown is usually invalid.
+# Intermediate edits are best-effort: if one fails (timeout, network error, deleted message),
+# streaming goes on and the next edit shows the text so far. Only `finish()` may raise, after
+# the turn has been persisted (including when Telegram still rate-limits it after 3 tries).
+
+PLACEHOLDER = "🤖 PM Pal is thinking…"
+EMPTY_REPLY = "⚠️ PM Pal couldn't come up with a reply this time. Please try again."
+STREAMING_HEADER = "🤖 PM Pal: "
+FINAL_HEADER = "🤖 *PM Pal:* "
+
+# Leave room for Markdown markup and UTF-16 surrogate pairs (emoji), which Telegram counts
+# differently from Python's str length.
+MAX_CHUNK_LENGTH = MessageLimit.MAX_TEXT_LENGTH - 96
+
+
+def split_message(text, limit=MAX_CHUNK_LENGTH):
+    """Split text into Telegram-sized parts, preferring paragraph, line and word boundaries."""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n\n", 0, limit)
+        if cut < limit // 2:
+            cut = text.rfind("\n", 0, limit)
+        if cut < limit // 2:
+            cut = text.rfind(" ", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip()
+    parts.append(text)
+    return parts
+
+
+class StreamingReply:
+    def __init__(self, message, edit_interval=STREAM_EDIT_INTERVAL_SECONDS):
+        """`message` is the user's Telegram message we are replying to."""
+        self.message = message
+        self.edit_interval = edit_interval
+        self.text = ""  # Reply text received so far
+        self.sent = []  # Telegram messages showing the reply, in order
+        self.shown = []  # Text currently displayed in each of them
+        self.first_chunk_at = None  # Monotonic time the first text became visible
+        self._started_at = None
+        self._last_edit = 0.0
+        self._blocked_until = 0.0  # Set when Telegram answers RetryAfter
+
+    async def start(self):
+        """Send the placeholder message."""
+        self._started_at = time.monotonic()
+        with span("telegram_send"):
+            placeholder = await self.message.reply_text(PLACEHOLDER)
+        self.sent.append(placeholder)
+        self.shown.append(PLACEHOLDER)
+        self._last_edit = time.monotonic()
+
+    async def push(self, chunk):
+        """Add a chunk of the reply; edits the message if the throttle allows it."""
+        self.text += chunk
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return
+        if self.first_chunk_at is None or now - self._last_edit >= self.edit_interval:
+            await self._render(final=False)
+
+    async def finish(self, attempts=3):
+        """Render the complete reply with Markdown formatting (raises if Telegram keeps rate-limiting it)."""
+        for attempt in range(attempts):
+            try:
+                await self._render(final=True)
+                return
+            except RetryAfter as e:
+                if attempt + 1 == attempts:
+                    raise
+                await asyncio.sleep(_retry_seconds(e))
+
+    @property
+    def time_to_first_chunk(self):
+        """Seconds from `start()` until the first reply text was visible (the latency users feel)."""
+        if self.first_chunk_at is None or self._started_at is None:
+            return None
+        return self.first_chunk_at - self._started_at
+
+    async def _render(self, final):
+        if self.text.strip():
+            parts = split_message((FINAL_HEADER if final else STREAMING_HEADER) + self.text)
+        elif final:
+            parts = [EMPTY_REPLY]  # Nothing came back: don't leave the placeholder on screen
+        else:
+            return
+        try:
+            with span("telegram_send"):
+                for i, part in enumerate(parts):
+                    if i < len(self.sent):
+                        if final or part != self.shown[i]:
+                            await self._edit(i, part, final)
+                    else:
+                        await self._send(part, final)
+        except RetryAfter as e:
+            self._blocked_until = time.monotonic() + _retry_seconds(e)
+            if final:
+                raise
+        except TelegramError as e:
+            if final:
+                raise
+            # Skip this edit and try again after the usual interval
+            print("⚠️ Streaming edit failed, continuing:", repr(e), flush=True)
+            self._blocked_until = time.monotonic() + self.edit_interval
+            return
+        if self.first_chunk_at is None and self.text.strip():
+            self.first_chunk_at = time.monotonic()
+        self._last_edit = time.monotonic()
+
+    async def _edit(self, index, text, final):
+        try:
+            if final:
+                try:
+                    await self.sent[index].edit_text(text, parse_mode=ParseMode.MARKDOWN)
+                except BadRequest as e:
+                    if "not modified" in str(e).lower():
+                        raise
+                    await self.sent[index].edit_text(text)  # Unparseable Markdown: show it as plain text
+            else:
+                await self.sent[index].edit_text(text)
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        self.shown[index] = text
+
+    async def _send(self, text, final):
+        if final:
+            try:
+                sent = await self.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
+            except BadRequest:
+                sent = await self.message.reply_text(text)
+        else:
+            sent = await self.message.reply_text(text)
+        self.sent.append(sent)
+        self.shown.append(text)
+
+
+def _retry_seconds(error):
+    """`RetryAfter.retry_after` is an int in older python-telegram-bot releases and a timedelta in newer ones."""
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
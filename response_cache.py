@@ -0,0 +1,163 @@
+import re
+import math
+import time
+import threading
+import unicodedata
+from collections import OrderedDict, Counter
+from config import RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MAX_TURN
+from config import RESPONSE_CACHE_MODES, RESPONSE_CACHE_SEMANTIC, RESPONSE_CACHE_SIMILARITY
+
+# ======================== #
+#  Response Cache          #
+# ======================== #
+# Right after `/coach` or `/interviewer`, most users send one of a handful of messages
+# ("2", "metrics", "let's do a case study"...). The LLM then sees exactly the same context
+# for everyone: the mode prompt plus that one message. This cache answers such early turns
+# without an LLM call:
+#   - key: (mode, normalised conversation so far, normalised new message). Only turns with at
+#     most RESPONSE_CACHE_MAX_TURN earlier user turns (and no running summary) are eligible,
+#     since later context is personal
+#   - exact lookup first; then, optionally, similarity lookup among entries with the same
+#     mode and history, using a local character n-gram embedding (no API call). Messages
+#     with different numbers never match ("2" is not "3")
+#   - TTL expiry and LRU eviction; hit/miss counters in `stats()`
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_NUMBERS = re.compile(r"\d+")
+
+
+def normalise(text):
+    """Case-, whitespace- and punctuation-insensitive form of a message."""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return " ".join(_PUNCTUATION.sub(" ", text).split())
+
+
+def embed(text, n=3):
+    """Character n-gram count vector of a normalised message (a cheap local embedding)."""
+    padded = f" {text} "
+    return Counter(padded[i:i + n] for i in range(max(1, len(padded) - n + 1)))
+
+
+def cosine(a, b):
+    dot = sum(count * b.get(gram, 0) for gram, count in a.items())
+    if not dot:
+        return 0.0
+    return dot / (math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values())))
+
+
+class ResponseCache:
+    def __init__(self, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS, max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+                 max_turn=RESPONSE_CACHE_MAX_TURN, modes=RESPONSE_CACHE_MODES,
+                 semantic=RESPONSE_CACHE_SEMANTIC, similarity=RESPONSE_CACHE_SIMILARITY):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_turn = max_turn
+        self.modes = set(modes)
+        self.semantic = semantic
+        self.similarity = similarity
+        self._entries = OrderedDict()  # (mode, history, message) -> (expires_at, reply)
+        self._buckets = {}  # (mode, history) -> {message: embedding}, for similarity lookups
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.ineligible = 0
+
+    def key(self, mode, messages, user_input):
+        """
+        Cache key for a turn, or None if it isn't an early turn of a cached mode.
+        `messages` is the mode's memory before this turn.
+        """
+        if mode not in self.modes:
+            return None
+        history = []
+        for msg in messages:
+            if msg.role == "system":
+                if msg is not messages[0]:
+                    return None  # A running summary: the conversation is well past its start
+                continue
+            history.append(f"{msg.role}:{normalise(msg.content)}")
+        if sum(1 for line in history if line.startswith("user:")) > self.max_turn:
+            return None
+        message = normalise(user_input)
+        if not message:
+            return None
+        return (mode, "\n".join(history), message)
+
+    def get(self, key):
+        """Return the cached reply for a turn key (exact, then similar), or None."""
+        if key is None:
+            self.ineligible += 1
+            return None
+        with self._lock:
+            reply = self._lookup(key)
+            if reply is not None:
+                self.exact_hits += 1
+                return reply
+            if self.semantic:
+                similar_key = self._most_similar(key)
+                if similar_key is not None:
+                    reply = self._lookup(similar_key)
+                    if reply is not None:
+                        self.similar_hits += 1
+                        return reply
+            self.misses += 1
+            return None
+
+    def put(self, key, reply):
+        if key is None or not reply.strip():
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, reply)
+            self._entries.move_to_end(key)
+            self._buckets.setdefault(key[:2], {})[key[2]] = embed(key[2])
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def stats(self):
+        """Hit/miss counters for monitoring (`ineligible`: turns of other modes or too far into a conversation)."""
+        with self._lock:
+            hits = self.exact_hits + self.similar_hits
+            lookups = hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "ineligible": self.ineligible,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+            }
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def _most_similar(self, key):
+        candidates = self._buckets.get(key[:2])
+        if not candidates:
+            return None
+        message = key[2]
+        numbers = _NUMBERS.findall(message)
+        vector = embed(message)
+        best, best_score = None, self.similarity
+        for other, other_vector in candidates.items():
+            if _NUMBERS.findall(other) != numbers:
+                continue
+            score = cosine(vector, other_vector)
+            if score >= best_score:
+                best, best_score = other, score
+        return None if best is None else key[:2] + (best,)
+
+    def _drop(self, key):
+        self._entries.pop(key, None)
+        bucket = self._buckets.get(key[:2])
+        if bucket is not None:
+            bucket.pop(key[2], None)
+            if not bucket:
+                del self._buckets[key[:2]]
@@ -0,0 +1,145 @@
+import time
+import random
+import asyncio
+from collections import deque
+from config import LLM_RETRY_BASE_DELAY, LLM_RETRY_MAX_DELAY
+from config import CIRCUIT_BREAKER_FAILURES, CIRCUIT_BREAKER_COOLDOWN_SECONDS
+from config import LLM_HEDGE_DEFAULT_DELAY, LLM_HEDGE_MIN_DELAY
+
+# ======================== #
+#  LLM Routing Policy      #
+# ======================== #
+# Building blocks LLMRouter uses to stay responsive when a provider is slow or failing:
+#   - is_retryable / backoff_delay: retry rate limits (429), server errors (5xx), timeouts
+#     and connection errors with "full jitter" exponential backoff
+#   - CircuitBreaker: stop sending traffic to a provider after repeated failures, and let a
+#     single trial request through after a cooldown
+#   - LatencyTracker: rolling time-to-first-token samples per provider; their p95 is the
+#     deadline after which a hedged request goes to a second provider
+#   - StreamPump: runs a provider stream in its own task and hands chunks over through a
+#     queue, so a stream can be raced, timed out or abandoned without cancelling it mid-read
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+def status_code(error):
+    """HTTP status of an SDK error (OpenAI/Anthropic `status_code`, Google API `code`), if any."""
+    for attr in ("status_code", "code"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def is_retryable(error):
+    """Whether an LLM call failed for a transient reason worth retrying (or failing over)."""
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    code = status_code(error)
+    if code is not None:
+        return code in RETRYABLE_STATUS_CODES
+    # SDK connection/timeout errors carry no status code
+    return any(name in type(error).__name__ for name in ("Timeout", "Connection", "Transport", "Unavailable"))
+
+
+def backoff_delay(attempt, base=LLM_RETRY_BASE_DELAY, cap=LLM_RETRY_MAX_DELAY):
+    """Full-jitter exponential backoff for retry number `attempt` (1-based)."""
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=CIRCUIT_BREAKER_FAILURES, cooldown_seconds=CIRCUIT_BREAKER_COOLDOWN_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.failures = 0  # Consecutive failures
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        """Whether a request may go to this provider now (claims the single half-open trial)."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial_in_flight or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+    def release_trial(self):
+        """
+        Give back a half-open trial that ended without a verdict (a non-retryable error such as
+        a 400, or a cancelled turn), so the next request can try the provider again.
+        """
+        if self.state == "half_open":
+            self._trial_in_flight = False
+
+
+class LatencyTracker:
+    def __init__(self, window=200, min_samples=20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = {}  # provider -> deque of seconds to first token
+
+    def record(self, provider, seconds):
+        self._samples.setdefault(provider, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, provider, pct):
+        samples = sorted(self._samples.get(provider, ()))
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+    def hedge_delay(self, provider):
+        """How long to wait for the first token before hedging: p95, once there are enough samples."""
+        if len(self._samples.get(provider, ())) < self.min_samples:
+            return LLM_HEDGE_DEFAULT_DELAY
+        return max(LLM_HEDGE_MIN_DELAY, self.percentile(provider, 95))
+
+
+class StreamPump:
+    """Consume an async generator in a background task; read its items with `next()`."""
+
+    def __init__(self, stream, provider):
+        self.provider = provider
+        self.started_at = time.monotonic()
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run(stream))
+
+    async def _run(self, stream):
+        try:
+            async for chunk in stream:
+                await self._queue.put(("chunk", chunk))
+            await self._queue.put(("end", None))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._queue.put(("error", e))
+        finally:
+            await stream.aclose()
+
+    async def next(self):
+        """Return ("chunk", text), ("end", None) or ("error", exception)."""
+        return await self._queue.get()
+
+    def cancel(self):
+        self._task.cancel()
@@ -0,0 +1,99 @@
+import bisect
+import hashlib
+import threading
+from config import SHARD_VIRTUAL_NODES
+
+# ======================== #
+#  Chat Sharding           #
+# ======================== #
+# In the multi-worker webhook deployment (see ingress.py), every update of a chat must go to
+# the same worker, so that worker's per-chat scheduler keeps the chat's updates in order and
+# its caches (profile, memory counters) stay warm.
+#   - HashRing: consistent hashing of chat ids onto workers. Each worker owns
+#     SHARD_VIRTUAL_NODES points on the ring, so when a worker joins or leaves only about
+#     1/N of the chats move, and the load stays even.
+#   - chat_id_of: the chat an incoming (raw JSON) Telegram update belongs to.
+# Hashes use md5, not Python's hash(): that one is salted per process, and the ingress must
+# map a chat the same way after every restart.
+# The ring's `epoch` changes whenever a node joins or leaves, i.e. whenever chats may have
+# moved. The ingress sends it with every update (EPOCH_HEADER), and a worker that sees a new
+# epoch drops its per-chat caches: a chat coming back to it may have changed elsewhere.
+
+SECRET_HEADER = "X-Shard-Secret"  # Carries SHARD_SECRET on ingress ↔ worker requests
+EPOCH_HEADER = "X-Shard-Epoch"  # Ring version a forwarded update was routed with
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, nodes=(), virtual_nodes=SHARD_VIRTUAL_NODES):
+        self.virtual_nodes = virtual_nodes
+        self._points = []  # sorted hashes
+        self._owners = {}  # hash -> node
+        self._nodes = set()
+        self._lock = threading.Lock()
+        self.epoch = 0  # Bumped on every membership change
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        """Add a node (returns False if it was already on the ring)."""
+        with self._lock:
+            if node in self._nodes:
+                return False
+            self._nodes.add(node)
+            self.epoch += 1
+            for i in range(self.virtual_nodes):
+                point = _hash(f"{node}#{i}")
+                if point in self._owners:
+                    continue  # A (practically impossible) collision: keep the first owner
+                self._owners[point] = node
+                bisect.insort(self._points, point)
+            return True
+
+    def remove(self, node):
+        """Remove a node (returns False if it wasn't on the ring)."""
+        with self._lock:
+            if node not in self._nodes:
+                return False
+            self._nodes.discard(node)
+            self.epoch += 1
+            self._owners = {point: owner for point, owner in self._owners.items() if owner != node}
+            self._points = sorted(self._owners)
+            return True
+
+    def node_for(self, key):
+        """The node owning `key` (the first point clockwise from its hash), or None if the ring is empty."""
+        with self._lock:
+            if not self._points:
+                return None
+            index = bisect.bisect(self._points, _hash(str(key))) % len(self._points)
+            return self._owners[self._points[index]]
+
+    @property
+    def nodes(self):
+        with self._lock:
+            return sorted(self._nodes)
+
+
+# Update fields that carry a message, and those that carry a chat directly
+_MESSAGE_FIELDS = ("message", "edited_message", "channel_post", "edited_channel_post")
+_CHAT_FIELDS = ("my_chat_member", "chat_member", "chat_join_request")
+
+
+def chat_id_of(update):
+    """The chat id of a raw Telegram update (dict), or None for updates without a chat (e.g. inline queries)."""
+    for field in _MESSAGE_FIELDS:
+        if field in update:
+            return update[field].get("chat", {}).get("id")
+    callback = update.get("callback_query")
+    if callback:
+        if "message" in callback:
+            return callback["message"].get("chat", {}).get("id")
+        return callback.get("from", {}).get("id")
+    for field in _CHAT_FIELDS:
+        if field in update:
+            return update[field].get("chat", {}).get("id")
+    return None
@@ -0,0 +1,296 @@
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from storage import Storage, StorageBatch
+
+# ======================== #
+#  SQLite Storage          #
+# ======================== #
+# A local, single-file implementation of the Storage interface (see storage.py), for
+# single-node deployments, load tests and running without Firebase.
+#   - WAL journal mode: readers never block the writer and vice versa, and a commit is one
+#     sequential append to the log (synchronous=NORMAL is durable across process crashes)
+#   - one connection per thread (the I/O thread pool), each with its own statement cache,
+#     so the fixed SQL below is compiled once per connection and then reused
+#   - history and metrics are indexed by (user_id, timestamp); memory turns by (user_id, mode, seq);
+#     history also by (user_id, written_at), the export cursor
+# Documents that Firestore stores as maps (profile, history entries, metric events,
+# messages) are stored as JSON text.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    profile TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS memory_heads (
+    user_id TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    turn_count INTEGER NOT NULL,
+    window_start INTEGER NOT NULL,
+    base TEXT,
+    updated_at TEXT,
+    PRIMARY KEY (user_id, mode)
+);
+CREATE TABLE IF NOT EXISTS memory_turns (
+    user_id TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    messages TEXT NOT NULL,
+    created_at TEXT,
+    PRIMARY KEY (user_id, mode, seq)
+);
+CREATE TABLE IF NOT EXISTS history_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    mode TEXT,
+    source TEXT,
+    entry TEXT NOT NULL,
+    written_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_history_logs_user_time ON history_logs (user_id, timestamp);
+CREATE TABLE IF NOT EXISTS metrics (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    event TEXT,
+    mode TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_metrics_user_time ON metrics (user_id, timestamp);
+CREATE TABLE IF NOT EXISTS usage_counters (
+    user_id TEXT PRIMARY KEY,
+    count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS usage_rollups (
+    scope TEXT NOT NULL,
+    day TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (scope, day, field)
+);
+CREATE TABLE IF NOT EXISTS active_users (
+    day TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    PRIMARY KEY (day, user_id, mode)
+);
+"""
+
+SELECT_PROFILE = "SELECT profile FROM users WHERE user_id = ?"
+INSERT_PROFILE = "INSERT OR REPLACE INTO users (user_id, profile) VALUES (?, ?)"
+SELECT_HEAD = "SELECT mode, turn_count, window_start, base FROM memory_heads WHERE user_id = ? AND mode = ?"
+SELECT_HEADS = "SELECT mode, turn_count, window_start, base FROM memory_heads WHERE user_id = ?"
+SELECT_TURNS = (
+    "SELECT seq, messages, created_at FROM memory_turns "
+    "WHERE user_id = ? AND mode = ? AND seq >= ? ORDER BY seq"
+)
+UPSERT_TURN = "INSERT OR REPLACE INTO memory_turns (user_id, mode, seq, messages, created_at) VALUES (?, ?, ?, ?, ?)"
+UPSERT_HEAD = (
+    "INSERT INTO memory_heads (user_id, mode, turn_count, window_start, base, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (user_id, mode) DO UPDATE SET "
+    "turn_count = excluded.turn_count, window_start = excluded.window_start, "
+    "base = COALESCE(excluded.base, memory_heads.base), updated_at = excluded.updated_at"
+)
+INSERT_HISTORY = (
+    "INSERT INTO history_logs (user_id, timestamp, mode, source, entry, written_at) VALUES (?, ?, ?, ?, ?, ?)"
+)
+INSERT_METRIC = "INSERT INTO metrics (user_id, timestamp, event, mode, data) VALUES (?, ?, ?, ?, ?)"
+SELECT_USAGE = "SELECT count FROM usage_counters WHERE user_id = ?"
+INCREMENT_ROLLUP = (
+    "INSERT INTO usage_rollups (scope, day, field, value) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (scope, day, field) DO UPDATE SET value = usage_rollups.value + excluded.value"
+)
+SELECT_ROLLUPS = "SELECT day, field, value FROM usage_rollups WHERE scope = ? AND day >= ? AND day <= ?"
+INSERT_ACTIVE = "INSERT OR IGNORE INTO active_users (day, user_id, mode) VALUES (?, ?, ?)"
+GLOBAL_SCOPE = "*"  # usage_rollups.scope of the global rollups (otherwise the user id)
+SELECT_USER_IDS = "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?"
+SELECT_HISTORY_PAGE = (
+    "SELECT id, written_at, entry FROM history_logs "
+    "WHERE user_id = ? AND written_at > ? AND written_at <= ? AND (written_at > ? OR (written_at = ? AND id > ?)) "
+    "ORDER BY written_at, id LIMIT ?"
+)
+# Databases created before history_logs.written_at: add it, counting old entries as written at their timestamp
+MIGRATE_HISTORY_WRITTEN_AT = """
+ALTER TABLE history_logs ADD COLUMN written_at TEXT;
+UPDATE history_logs SET written_at = timestamp WHERE written_at IS NULL;
+"""
+HISTORY_WRITTEN_AT_INDEX = (
+    "CREATE INDEX IF NOT EXISTS idx_history_logs_user_written ON history_logs (user_id, written_at)"
+)
+INCREMENT_USAGE = (
+    "INSERT INTO usage_counters (user_id, count) VALUES (?, ?) "
+    "ON CONFLICT (user_id) DO UPDATE SET count = usage_counters.count + excluded.count"
+)
+
+
+class SqliteStorage(Storage):
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(history_logs)")]
+        if "written_at" not in columns:
+            conn.executescript(MIGRATE_HISTORY_WRITTEN_AT)
+        conn.execute(HISTORY_WRITTEN_AT_INDEX)
+
+    def _connection(self):
+        """This thread's connection (sqlite3 connections must not be shared between threads)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, cached_statements=256)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load_profile(self, user_id):
+        row = self._connection().execute(SELECT_PROFILE, (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def create_profile(self, user_id, profile):
+        self._connection().execute(INSERT_PROFILE, (user_id, json.dumps(profile)))
+
+    def update_profile(self, user_id, fields):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")  # Read-modify-write under the write lock
+        try:
+            row = conn.execute(SELECT_PROFILE, (user_id,)).fetchone()
+            if row is None:
+                raise KeyError(f"No profile for user {user_id}")
+            profile = json.loads(row[0])
+            profile.update(fields)
+            conn.execute(INSERT_PROFILE, (user_id, json.dumps(profile)))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def load_memory_head(self, user_id, mode):
+        row = self._connection().execute(SELECT_HEAD, (user_id, mode)).fetchone()
+        return _head(row) if row else None
+
+    def load_memory_heads(self, user_id):
+        rows = self._connection().execute(SELECT_HEADS, (user_id,)).fetchall()
+        return {row[0]: _head(row) for row in rows}
+
+    def load_memory_turns(self, user_id, mode, start_seq):
+        rows = self._connection().execute(SELECT_TURNS, (user_id, mode, start_seq)).fetchall()
+        return [
+            {"seq": seq, "messages": json.loads(messages), "created_at": created_at}
+            for seq, messages, created_at in rows
+        ]
+
+    def get_usage_count(self, user_id):
+        row = self._connection().execute(SELECT_USAGE, (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def iter_user_ids(self, page_size=500):
+        last = ""
+        while True:
+            rows = self._connection().execute(SELECT_USER_IDS, (last, page_size)).fetchall()
+            for (user_id,) in rows:
+                yield user_id
+            if len(rows) < page_size:
+                return
+            last = rows[-1][0]
+
+    def iter_history(self, user_id, since=None, until=None, page_size=500):
+        since = since or ""
+        until = until or "\uffff"  # Sorts after every ISO timestamp
+        cursor = (since, 0)  # Keyset pagination on (written_at, id), served by the index
+        while True:
+            rows = self._connection().execute(
+                SELECT_HISTORY_PAGE, (user_id, since, until, cursor[0], cursor[0], cursor[1], page_size)
+            ).fetchall()
+            for _, _, entry in rows:
+                yield json.loads(entry)
+            if len(rows) < page_size:
+                return
+            cursor = (rows[-1][1], rows[-1][0])
+
+    def mark_active(self, day, user_id, mode=None):
+        cursor = self._connection().execute(INSERT_ACTIVE, (day, user_id, mode or ""))
+        return cursor.rowcount == 1
+
+    def load_rollups(self, start_day, end_day, user_id=None):
+        scope = GLOBAL_SCOPE if user_id is None else user_id
+        rollups = {}
+        for day, field, value in self._connection().execute(SELECT_ROLLUPS, (scope, start_day, end_day)):
+            node = rollups.setdefault(day, {"date": day})
+            *parents, leaf = field.split(".")
+            for key in parents:
+                node = node.setdefault(key, {})
+            node[leaf] = int(value) if value.is_integer() else value
+        return rollups
+
+    def batch(self):
+        return SqliteBatch(self)
+
+
+class SqliteBatch(StorageBatch):
+    def __init__(self, storage):
+        self.storage = storage
+        self._statements = []  # (sql, params), run in one transaction on commit
+
+    def append_turn(self, user_id, mode, seq, turn):
+        self._statements.append((
+            UPSERT_TURN, (user_id, mode, seq, json.dumps(turn["messages"]), turn.get("created_at"))
+        ))
+
+    def set_memory_head(self, user_id, mode, head, drop_legacy=False):
+        # SQLite memory never has the legacy full snapshot, so `drop_legacy` has nothing to remove
+        base = json.dumps(head["base"]) if "base" in head else None
+        self._statements.append((
+            UPSERT_HEAD, (user_id, mode, head["turn_count"], head["window_start"], base, head.get("updated_at"))
+        ))
+
+    def add_history(self, user_id, entry):
+        self._statements.append((
+            INSERT_HISTORY, (user_id, entry["timestamp"], entry.get("mode"), entry.get("source"), json.dumps(entry),
+                             datetime.utcnow().isoformat())
+        ))
+
+    def add_metric(self, user_id, event):
+        self._statements.append((
+            INSERT_METRIC, (user_id, event["timestamp"], event.get("event"), event.get("mode"), json.dumps(event))
+        ))
+
+    def increment_usage(self, user_id, amount=1):
+        self._statements.append((INCREMENT_USAGE, (user_id, amount)))
+
+    def increment_rollup(self, day, counters, user_id=None):
+        scope = GLOBAL_SCOPE if user_id is None else user_id
+        for field, amount in counters.items():
+            self._statements.append((INCREMENT_ROLLUP, (scope, day, field, amount)))
+
+    def commit(self):
+        if not self._statements:
+            return
+        conn = self.storage._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, params in self._statements:
+                conn.execute(sql, params)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._statements = []
+
+
+def _head(row):
+    _, turn_count, window_start, base = row
+    return {
+        "turn_count": turn_count,
+        "window_start": window_start,
+        "base": json.loads(base) if base is not None else [],
+    }
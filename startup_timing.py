@@ -0,0 +1,53 @@
+import time
+from contextlib import contextmanager
+
+# ======================== #
+#  Startup Timing          #
+# ======================== #
+# Cold start matters on Cloud Run: a new container must answer Telegram's webhook quickly.
+# Heavy SDKs (LangChain providers, Google Generative AI, OpenAI, Firebase Admin) are therefore
+# imported on first use rather than at startup. This module times both:
+#   - `timed(label)` around the imports in telegram_bot.py, reported once the bot is ready
+#   - `timed(label, lazy=True)` around each deferred import/client, printed when it happens
+# For a per-module breakdown of a regression, run `python -X importtime telegram_bot.py`.
+
+PROCESS_START = time.perf_counter()  # Import this module first, so this is close to process start
+
+_timings = []  # (label, seconds) of startup steps, in order
+_lazy_timings = {}  # label -> seconds, for deferred loads
+
+
+@contextmanager
+def timed(label, lazy=False):
+    """Time the body. Lazy loads are only recorded the first time (later entries are cache hits)."""
+    if lazy and label in _lazy_timings:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        if lazy:
+            _lazy_timings[label] = seconds
+            print(f"⏱️ Loaded {label} on first use in {seconds * 1000:.0f} ms", flush=True)
+        else:
+            _timings.append((label, seconds))
+
+
+def report():
+    """Startup import timings, slowest first, plus the total time since process start."""
+    total = time.perf_counter() - PROCESS_START
+    lines = [f"⏱️ Startup took {total * 1000:.0f} ms"]
+    for label, seconds in sorted(_timings, key=lambda item: item[1], reverse=True):
+        lines.append(f"   {seconds * 1000:8.0f} ms  {label}")
+    return "\n".join(lines)
+
+
+def timings():
+    """Startup and lazy-load timings in seconds (for monitoring)."""
+    return {
+        "since_start": time.perf_counter() - PROCESS_START,
+        "startup": dict(_timings),
+        "lazy": dict(_lazy_timings),
+    }
@@ -0,0 +1,325 @@
+import threading
+from datetime import datetime
+from config import STORAGE_BACKEND, SQLITE_PATH, USE_WEBHOOK, BOT_ROLE
+
+# ======================== #
+#  Storage Backends        #
+# ======================== #
+# Everything BotUser persists goes through a Storage backend:
+#   - profile            users/{user_id}: mode, created_at, last_active
+#   - memory             per mode: a head (turn_count, window_start, base) plus one record per turn
+#   - history            history_logs entries (full transcript)
+#   - metrics            metric events (optional, see RAW_METRIC_EVENTS)
+#   - usage counter      LLM replies used, for the free tier
+#   - rollups            per-day usage counters, global and per user (see usage_rollups.py)
+# Writes that belong to one conversation turn go through a batch (`storage.batch()`), which
+# applies them atomically on `commit()`.
+#
+# Backends:
+#   - FirestoreStorage: the production layout in Firestore (see bot_user.py for the memory layout)
+#   - SqliteStorage (sqlite_storage.py): a local file, for single-node deployments, load tests
+#     and running without Firebase credentials
+# STORAGE_BACKEND selects one; "auto" uses Firestore when it is configured and SQLite otherwise.
+# Backends are imported and connected on first use (see `get_storage`), not at startup.
+
+
+class Storage:
+    """Interface implemented by the storage backends. All methods are blocking (use `run_io`)."""
+
+    name = "storage"
+
+    def load_profile(self, user_id):
+        """Return the user's profile dict, or None if the user is unknown."""
+        raise NotImplementedError
+
+    def create_profile(self, user_id, profile):
+        raise NotImplementedError
+
+    def update_profile(self, user_id, fields):
+        """Merge fields into an existing profile."""
+        raise NotImplementedError
+
+    def load_memory_head(self, user_id, mode):
+        """Return a mode's memory head dict, or None if the mode has no memory."""
+        raise NotImplementedError
+
+    def load_memory_heads(self, user_id):
+        """Return {mode: head} for every mode with memory."""
+        raise NotImplementedError
+
+    def load_memory_turns(self, user_id, mode, start_seq):
+        """Return the turn records ({"seq", "messages", ...}) with seq >= start_seq, in order."""
+        raise NotImplementedError
+
+    def get_usage_count(self, user_id):
+        raise NotImplementedError
+
+    def iter_user_ids(self, page_size=500):
+        """Yield the id of every user with stored data, fetched `page_size` at a time (for exports)."""
+        raise NotImplementedError
+
+    def iter_history(self, user_id, since=None, until=None, page_size=500):
+        """
+        Yield the user's history_logs entries written (`written_at`, see StorageBatch.add_history)
+        with `since` < written_at <= `until` (ISO strings, either may be None), fetched
+        `page_size` at a time with a cursor. Entries stored before `written_at` existed count
+        as written at their `timestamp`.
+        """
+        raise NotImplementedError
+
+    def mark_active(self, day, user_id, mode=None):
+        """
+        Record that the user was active on `day` (in `mode`, or at all when None).
+        Returns True only the first time, so the caller can count distinct active users.
+        """
+        raise NotImplementedError
+
+    def load_rollups(self, start_day, end_day, user_id=None):
+        """Return {day: counters} of the global rollups (or one user's) with start_day <= day <= end_day."""
+        raise NotImplementedError
+
+    def batch(self):
+        """Start a StorageBatch."""
+        raise NotImplementedError
+
+
+class StorageBatch:
+    """Writes collected and applied together by `commit()`."""
+
+    def append_turn(self, user_id, mode, seq, turn):
+        raise NotImplementedError
+
+    def set_memory_head(self, user_id, mode, head, drop_legacy=False):
+        """
+        Merge `head` into the mode's memory head (fields not in `head` are kept).
+        `drop_legacy` removes the old full-snapshot `messages` field.
+        """
+        raise NotImplementedError
+
+    def add_history(self, user_id, entry):
+        """
+        Add a history_logs entry, stamped with `written_at` (now). Entries can reach storage
+        long after their `timestamp` (replayed from the write-behind spill file), so exports
+        use `written_at` as their cursor.
+        """
+        raise NotImplementedError
+
+    def add_metric(self, user_id, event):
+        raise NotImplementedError
+
+    def increment_usage(self, user_id, amount=1):
+        raise NotImplementedError
+
+    def increment_rollup(self, day, counters, user_id=None):
+        """
+        Add `counters` (dotted field -> amount, e.g. {"turns": 3, "turns_by_mode.coach": 2}) to
+        the day's global rollup, or to the user's when `user_id` is given.
+        """
+        raise NotImplementedError
+
+    def commit(self):
+        raise NotImplementedError
+
+
+# ------------------------------------------------------------------ #
+# Firestore
+# ------------------------------------------------------------------ #
+
+class FirestoreStorage(Storage):
+    name = "firestore"
+
+    def __init__(self, db):
+        self.db = db
+
+    def _user_ref(self, user_id):
+        return self.db.collection("users").document(user_id)
+
+    def _memory_ref(self, user_id, mode):
+        return self._user_ref(user_id).collection("memory_snapshots").document(mode)
+
+    def _usage_ref(self, user_id):
+        return self._user_ref(user_id).collection("metrics").document("llm_usage")
+
+    def _rollups(self, user_id=None):
+        """usage_rollups/{day} (global), or users/{user_id}/usage_daily/{day}."""
+        if user_id is None:
+            return self.db.collection("usage_rollups")
+        return self._user_ref(user_id).collection("usage_daily")
+
+    def load_profile(self, user_id):
+        doc = self._user_ref(user_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def create_profile(self, user_id, profile):
+        self._user_ref(user_id).set(profile)
+
+    def update_profile(self, user_id, fields):
+        self._user_ref(user_id).update(fields)
+
+    def load_memory_head(self, user_id, mode):
+        doc = self._memory_ref(user_id, mode).get()
+        return (doc.to_dict() or {}) if doc.exists else None
+
+    def load_memory_heads(self, user_id):
+        docs = self._user_ref(user_id).collection("memory_snapshots").stream()
+        return {doc.id: doc.to_dict() or {} for doc in docs}
+
+    def load_memory_turns(self, user_id, mode, start_seq):
+        from firebase_admin import firestore
+        docs = (
+            self._memory_ref(user_id, mode).collection("turns")
+            .where(filter=firestore.FieldFilter("seq", ">=", start_seq))
+            .order_by("seq")
+            .stream()
+        )
+        return [doc.to_dict() for doc in docs]
+
+    def get_usage_count(self, user_id):
+        doc = self._usage_ref(user_id).get()
+        return doc.to_dict().get("count", 0) if doc.exists else 0
+
+    def iter_user_ids(self, page_size=500):
+        # list_documents also returns users that only have subcollections (no profile document)
+        for ref in self.db.collection("users").list_documents(page_size=page_size):
+            yield ref.id
+
+    def iter_history(self, user_id, since=None, until=None, page_size=500):
+        from firebase_admin import firestore
+        query = self._user_ref(user_id).collection("history_logs")
+        if since is None:
+            # Everything: queries on written_at would skip entries stored before it existed
+            query = query.order_by("timestamp")
+        else:
+            query = query.where(filter=firestore.FieldFilter("written_at", ">", since))
+            if until is not None:
+                query = query.where(filter=firestore.FieldFilter("written_at", "<=", until))
+            query = query.order_by("written_at")
+        query = query.order_by("__name__").limit(page_size)
+        cursor = None
+        while True:
+            page = list((query.start_after(cursor) if cursor is not None else query).stream())
+            for doc in page:
+                entry = doc.to_dict()
+                if until is None or (entry.get("written_at") or entry.get("timestamp") or "") <= until:
+                    yield entry
+            if len(page) < page_size:
+                return
+            cursor = page[-1]  # Resume after the last document, not by re-reading with an offset
+
+    def mark_active(self, day, user_id, mode=None):
+        from google.api_core.exceptions import AlreadyExists
+        marker = user_id if mode is None else f"{user_id}_{mode}"
+        try:
+            # create() fails if the marker exists: only one process ever counts the user for the day
+            self._rollups().document(day).collection("active_users").document(marker).create(
+                {"user_id": user_id, "mode": mode}
+            )
+            return True
+        except AlreadyExists:
+            return False
+
+    def load_rollups(self, start_day, end_day, user_id=None):
+        from firebase_admin import firestore
+        docs = (
+            self._rollups(user_id)
+            .where(filter=firestore.FieldFilter("date", ">=", start_day))
+            .where(filter=firestore.FieldFilter("date", "<=", end_day))
+            .stream()
+        )
+        return {doc.id: doc.to_dict() for doc in docs}
+
+    def batch(self):
+        return FirestoreBatch(self)
+
+
+class FirestoreBatch(StorageBatch):
+    def __init__(self, storage):
+        self.storage = storage
+        self._batch = storage.db.batch()  # One WriteBatch: a single round-trip, all-or-nothing
+
+    def append_turn(self, user_id, mode, seq, turn):
+        turns_ref = self.storage._memory_ref(user_id, mode).collection("turns")
+        self._batch.set(turns_ref.document(f"{seq:08d}"), {"seq": seq, **turn})
+
+    def set_memory_head(self, user_id, mode, head, drop_legacy=False):
+        from firebase_admin import firestore
+        if drop_legacy:
+            head = {**head, "messages": firestore.DELETE_FIELD}
+        self._batch.set(self.storage._memory_ref(user_id, mode), head, merge=True)
+
+    def add_history(self, user_id, entry):
+        # `.document()` without an id generates one client-side, exactly like `.add()`
+        entry = {**entry, "written_at": datetime.utcnow().isoformat()}
+        self._batch.set(self.storage._user_ref(user_id).collection("history_logs").document(), entry)
+
+    def add_metric(self, user_id, event):
+        self._batch.set(self.storage._user_ref(user_id).collection("metrics").document(), event)
+
+    def increment_usage(self, user_id, amount=1):
+        # Applied server-side, so concurrent turns never lose a count
+        from firebase_admin import firestore
+        self._batch.set(self.storage._usage_ref(user_id), {"count": firestore.Increment(amount)}, merge=True)
+
+    def increment_rollup(self, day, counters, user_id=None):
+        from firebase_admin import firestore
+        fields = {"date": day}
+        for path, amount in counters.items():
+            node = fields
+            *parents, leaf = path.split(".")
+            for key in parents:
+                node = node.setdefault(key, {})
+            node[leaf] = firestore.Increment(amount)  # Nested maps + merge: only these leaves change
+        self._batch.set(self.storage._rollups(user_id).document(day), fields, merge=True)
+
+    def commit(self):
+        self._batch.commit()
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """The process-wide storage backend, chosen by STORAGE_BACKEND on first use."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = _create_storage()
+    return _storage
+
+
+def _create_storage():
+    from firebase_db import get_db, firebase_configured
+
+    backend = STORAGE_BACKEND
+    if backend == "auto":
+        if firebase_configured():
+            backend = "firestore"  # Credentials were given: if they don't work, that's an error
+        elif USE_WEBHOOK or BOT_ROLE == "worker":
+            # Each instance would keep its own local file: users' data split, and lost on redeploy
+            raise RuntimeError(
+                "⚠️ No Firebase credentials (FIREBASE_CRED_PATH) in a deployment. "
+                "Set them, or opt in to local storage with STORAGE_BACKEND=sqlite."
+            )
+        else:
+            backend = "sqlite"
+            print(f"⚠️ No Firebase credentials: using local SQLite storage at {SQLITE_PATH} (development only)", flush=True)
+    if backend == "firestore":
+        db = get_db()
+        if db is None:
+            raise RuntimeError("⚠️ Firebase failed to initialize (see above); not falling back to local storage.")
+        storage = FirestoreStorage(db)
+    elif backend == "sqlite":
+        from sqlite_storage import SqliteStorage
+        storage = SqliteStorage(SQLITE_PATH)
+    else:
+        raise ValueError("⚠️ Invalid STORAGE_BACKEND. Must be 'auto', 'firestore' or 'sqlite'.")
+    print(f"🗄️ Storage backend: {storage.name}", flush=True)
+    return storage
+
+
+def set_storage(storage):
+    """Replace the process-wide backend (e.g. a SqliteStorage on a scratch file for load tests)."""
+    global _storage
+    _storage = storage
@@ -1,9 +1,27 @@
-from config import TELEGRAM_API_TOKEN  # Load Telegram API token from config
-from telegram.ext import Application, CommandHandler, MessageHandler, filters  # Telegram bot framework for handling commands and messages
-from handlers import text_message, change_mode, voice_message  # Import all handlers
-from handlers import start, help_command  # Import new start function
-from handlers import mode_mentor, mode_coach, mode_interview  # Import specific mode handlers
-from config import USE_WEBHOOK, WEBHOOK_URL, PORT  # Import webhook settings
+import startup_timing  # First import: its clock starts as close to process start as possible
+import asyncio
+from startup_timing import timed
+
+with timed("config"):
+    from config import TELEGRAM_API_TOKEN  # Load Telegram API token from config
+    from config import USE_WEBHOOK, WEBHOOK_URL, PORT  # Import webhook settings
+    from config import TELEGRAM_CONCURRENT_UPDATES  # How many updates may be handled at the same time
+    from config import BOT_ROLE, SHARD_SECRET, SHARD_INGRESS_URL, SHARD_WORKER_URL  # Multi-worker mode (ingress.py)
+with timed("telegram.ext"):
+    from telegram.ext import Application, CommandHandler, MessageHandler, filters  # Telegram bot framework for handling commands and messages
+with timed("handlers"):
+    from handlers import text_message, change_mode, voice_message  # Import all handlers
+    from handlers import start, help_command  # Import new start function
+    from handlers import mode_mentor, mode_coach, mode_interview  # Import specific mode handlers
+with timed("llm_router, storage, write_behind"):
+    from llm_router import get_router  # Shared LLM router / client registry
+    from firebase_db import run_io  # Run blocking storage calls off the event loop
+    from storage import get_storage  # Firestore or SQLite, connected on first use
+    from write_behind import write_behind  # Background writer for history logs and metrics
+    from usage_rollups import rollups  # Daily usage counters, flushed by the write-behind thread
+    from instrumentation import start_metrics_server, gauge, gauge_family  # Prometheus /metrics endpoint
+    from chat_scheduler import scheduler
+    from bot_user import profile_cache
 
 ### DEBUGGING ###
 import traceback
@@ -11,7 +29,7 @@ import os
 print("🟢 Starting PM Pal container...", flush=True)
 print("📦 PORT =", os.getenv("PORT"), flush=True)
 print("📦 WEBHOOK_URL =", os.getenv("WEBHOOK_URL"), flush=True)
-print("📦 TELEGRAM_API_TOKEN =", os.getenv("TELEGRAM_API_TOKEN"), flush=True)
+print("📦 TELEGRAM_API_TOKEN =", "set" if os.getenv("TELEGRAM_API_TOKEN") else None, flush=True)  # Never log the secret
 print("📦 FIREBASE_CRED_PATH =", os.getenv("FIREBASE_CRED_PATH"), flush=True)
 print("📦 USE_WEBHOOK =", os.getenv("USE_WEBHOOK"), flush=True)
 
@@ -19,8 +37,80 @@ print("📦 USE_WEBHOOK =", os.getenv("USE_WEBHOOK"), flush=True)
 #  Initialize Telegram Bot #
 # ======================== #
 
+async def on_startup(application):
+    """
+    Report startup timings, then warm up the LLM router (provider SDKs, HTTP connection pools)
+    and the storage connection in the background: the bot starts answering immediately, and
+    usually the first user doesn't pay for client setup either.
+    """
+    print(startup_timing.report(), flush=True)
+    register_gauges()
+    application.bot_data["metrics_runner"] = await start_metrics_server()
+    application.create_task(warm_up())
+
+def register_gauges():
+    """Export queue depths and cache hit rates alongside the stage histograms."""
+    gauge("pm_pal_pending_updates", "Updates running or queued in the chat scheduler.", lambda: scheduler.pending_total)
+    gauge("pm_pal_llm_in_flight", "LLM calls in progress.", lambda: scheduler.llm_in_flight)
+    gauge("pm_pal_whisper_in_flight", "Whisper transcriptions in progress.", lambda: scheduler.whisper_in_flight)
+    gauge("pm_pal_rejected_updates", "Updates rejected with the busy reply.", lambda: scheduler.rejected)
+    gauge("pm_pal_profile_cache_hit_ratio", "Profile cache hit rate.", lambda: profile_cache.stats()["hit_rate"])
+    gauge("pm_pal_write_behind_pending", "History/metric records waiting to be written.",
+          lambda: write_behind.stats()["pending"])
+    gauge("pm_pal_usage_rollups_pending", "Daily usage rollup documents with increments waiting to be written.",
+          lambda: rollups.stats()["pending_rollups"])
+
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+def register_router_gauges(router):
+    """Export the model tier stats (latency, tokens, cost) and the failover policy state."""
+    def per_tier(key):
+        return lambda: [({"tier": tier}, stats[key]) for tier, stats in router.tier_stats().items()]
+
+    gauge_family("pm_pal_tier_calls", "LLM calls per model tier.", per_tier("calls"))
+    gauge_family("pm_pal_tier_input_tokens", "Input tokens per model tier.", per_tier("input_tokens"))
+    gauge_family("pm_pal_tier_output_tokens", "Output tokens per model tier.", per_tier("output_tokens"))
+    gauge_family("pm_pal_tier_cost_usd", "Estimated LLM cost per model tier, in USD.", per_tier("cost_usd"))
+    gauge_family("pm_pal_tier_ttft_p95_seconds", "p95 time to first token per model tier.", per_tier("ttft_p95"))
+    gauge_family("pm_pal_tier_avg_seconds", "Mean LLM call duration per model tier.", per_tier("avg_seconds"))
+    gauge_family("pm_pal_llm_circuit_state", "Circuit breaker per provider: 0 closed, 1 half-open, 2 open.",
+                 lambda: [({"provider": p}, CIRCUIT_STATES[s["circuit"]]) for p, s in router.policy_stats().items()])
+    gauge_family("pm_pal_llm_consecutive_failures", "Consecutive failed calls per provider.",
+                 lambda: [({"provider": p}, s["consecutive_failures"]) for p, s in router.policy_stats().items()])
+    gauge_family("pm_pal_llm_ttft_p95_seconds", "p95 time to first token per provider and tier (hedging deadline).",
+                 lambda: [({"provider": p, "tier": tier}, value)
+                          for p, s in router.policy_stats().items() for tier, value in s["ttft_p95"].items()])
+
+async def warm_up():
+    try:
+        router = await run_io(get_router)
+        print("🧠 LLM router ready", flush=True)
+        # Registered once the router exists, so a scrape never builds it on the event loop
+        gauge("pm_pal_response_cache_hit_ratio", "Early-turn response cache hit rate.",
+              lambda: (router.cache_stats() or {}).get("hit_rate", 0.0))
+        register_router_gauges(router)
+        await run_io(get_storage)
+    except Exception as e:
+        print("⚠️ Warm-up failed (clients will be created on first use):", e, flush=True)
+
+async def on_shutdown(application):
+    """Write out buffered history logs and metric events before the process exits."""
+    runner = application.bot_data.get("metrics_runner")
+    if runner is not None:
+        await runner.cleanup()
+    await run_io(write_behind.close)
+    print("🗄️ Write-behind buffer drained:", write_behind.stats(), flush=True)
+
 # Initialize Telegram Bot application
-application = Application.builder().token(TELEGRAM_API_TOKEN).build()
+# Handlers are fully async, so updates from different users are processed concurrently
+application = (
+    Application.builder()
+    .token(TELEGRAM_API_TOKEN)
+    .concurrent_updates(TELEGRAM_CONCURRENT_UPDATES)
+    .post_init(on_startup)
+    .post_shutdown(on_shutdown)
+    .build()
+)
 
 # ======================= #
 #  Register Bot Handlers  #
@@ -50,6 +140,82 @@ application.add_handler(MessageHandler(filters.VOICE, voice_message))
 #  Start Telegram Bot     #
 # ======================= #
 
+async def run_worker():
+    """
+    BOT_ROLE=worker: serve updates forwarded by the ingress (see ingress.py) on PORT.
+    The ingress sends one update of a chat at a time and waits for the response, so the
+    response is only sent once the update has been fully handled.
+    On SIGTERM the worker leaves the ring, finishes the updates in flight, then stops.
+    """
+    import signal
+    import aiohttp
+    from aiohttp import web
+    from telegram import Update
+    from sharding import SECRET_HEADER, EPOCH_HEADER
+    from bot_user import usage_cache
+
+    draining = asyncio.Event()
+    ring_epoch = [None]  # Last ring epoch seen from the ingress
+
+    async def handle_update(request):
+        if SHARD_SECRET and request.headers.get(SECRET_HEADER) != SHARD_SECRET:
+            return web.Response(status=403)
+        if draining.is_set():
+            return web.Response(status=503)  # The ingress sends it to the chat's next owner
+        epoch = request.headers.get(EPOCH_HEADER)
+        if epoch is not None and epoch != ring_epoch[0]:
+            # Chats may have moved: one handled elsewhere in the meantime may have switched
+            # mode or used replies there, so cached profiles and quota counts can't be trusted
+            if ring_epoch[0] is not None:
+                print(f"🔀 Ring changed (epoch {epoch}): clearing profile and quota caches", flush=True)
+            profile_cache.clear()
+            usage_cache.clear()
+            ring_epoch[0] = epoch
+        update = Update.de_json(await request.json(), application.bot)
+        await application.process_update(update)  # Handler errors are logged by PTB, not raised
+        return web.Response()
+
+    async def healthz(request):
+        return web.Response(status=503 if draining.is_set() else 200)
+
+    async def membership(action):
+        """Join or leave the ingress's ring (only for workers the ingress didn't start itself)."""
+        if not (SHARD_INGRESS_URL and SHARD_WORKER_URL):
+            return
+        headers = {SECRET_HEADER: SHARD_SECRET} if SHARD_SECRET else {}
+        try:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+                await session.post(f"{SHARD_INGRESS_URL}/workers/{action}", json={"url": SHARD_WORKER_URL}, headers=headers)
+        except Exception as e:
+            print(f"⚠️ Could not {action} the ingress ring:", e, flush=True)
+
+    app = web.Application()
+    app.router.add_post("/update", handle_update)
+    app.router.add_get("/healthz", healthz)
+    runner = web.AppRunner(app, access_log=None)
+
+    # post_init/post_shutdown only run inside run_polling/run_webhook: call them ourselves
+    async with application:
+        await on_startup(application)
+        await application.start()
+        await runner.setup()
+        await web.TCPSite(runner, "0.0.0.0", PORT).start()
+        print(f"🧩 PM Pal worker serving forwarded updates on :{PORT}", flush=True)
+        await membership("join")
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await stop.wait()
+
+        print("🛑 Worker draining", flush=True)
+        await membership("leave")
+        draining.set()
+        await runner.cleanup()  # Waits for the updates in flight
+        await application.stop()
+        await on_shutdown(application)
+
 # import threading
 # from flask import Flask
 
@@ -64,7 +230,9 @@ application.add_handler(MessageHandler(filters.VOICE, voice_message))
 
 if __name__ == "__main__":
     try:
-        if USE_WEBHOOK and WEBHOOK_URL:
+        if BOT_ROLE == "worker":
+            asyncio.run(run_worker())
+        elif USE_WEBHOOK and WEBHOOK_URL:
             print("🌐 PM Pal running in webhook mode", flush=True)
 
             # # Start Flask in a background thread
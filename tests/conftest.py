@@ -0,0 +1,30 @@
+import os
+import sys
+import pytest
+
+# config.py refuses to load without these; tests never reach the real services
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("TELEGRAM_API_TOKEN", "1:test")
+os.environ.setdefault("METRICS_PORT", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def sqlite_storage(tmp_path, monkeypatch):
+    """A SqliteStorage on a scratch file, installed as the process-wide backend."""
+    import storage
+    from sqlite_storage import SqliteStorage
+    backend = SqliteStorage(str(tmp_path / "pm_pal.sqlite3"))
+    monkeypatch.setattr(storage, "_storage", backend)
+    return backend
+
+
+@pytest.fixture
+def unbuffered(monkeypatch):
+    """Turns written inline with their batch (WRITE_BEHIND off), with a fresh rollup aggregator."""
+    import bot_user
+    from usage_rollups import RollupAggregator
+    aggregator = RollupAggregator()
+    monkeypatch.setattr(bot_user, "WRITE_BEHIND", False)
+    monkeypatch.setattr(bot_user, "rollups", aggregator)
+    return aggregator
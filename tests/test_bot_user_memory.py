@@ -0,0 +1,65 @@
+from bot_user import BotUser
+from chat_message import Message
+from prompts import MODE_PROMPTS
+
+PROMPT = Message("system", MODE_PROMPTS["mentor"])
+
+
+def turn(n):
+    return [Message("user", f"question {n}"), Message("ai", f"answer {n}")]
+
+
+def converse(user, count, memory=None, first=0):
+    """Commit turns `first` to `first + count - 1`, one at a time, as the handler does."""
+    memory = memory or {"mentor": [PROMPT]}
+    for n in range(first, first + count):
+        memory["mentor"].extend(turn(n))
+        user.commit_turn("mentor", memory, f"question {n}", f"answer {n}")
+    return memory
+
+
+def test_each_turn_appends_one_turn_record(sqlite_storage, unbuffered):
+    memory = converse(BotUser("42"), 3)
+
+    head = sqlite_storage.load_memory_head("42", "mentor")
+    assert (head["turn_count"], head["window_start"]) == (3, 0)
+    turns = sqlite_storage.load_memory_turns("42", "mentor", 0)
+    assert [t["seq"] for t in turns] == [0, 1, 2]
+    assert BotUser("42").get_memory("mentor") == memory  # A fresh read rebuilds the same window
+
+
+def test_evicted_turns_leave_the_window_but_stay_stored(sqlite_storage, unbuffered):
+    user = BotUser("42")
+    memory = converse(user, 3)
+    summary = Message("system", "Summary: questions 0 and 1")
+    memory["mentor"] = [PROMPT, summary] + turn(2)
+    user.commit_compaction("mentor", memory, evicted_turns=2)
+    converse(user, 1, memory, first=3)
+
+    head = sqlite_storage.load_memory_head("42", "mentor")
+    assert (head["turn_count"], head["window_start"]) == (4, 2)
+    assert len(sqlite_storage.load_memory_turns("42", "mentor", 0)) == 4  # Append-only
+    assert BotUser("42").get_memory("mentor") == {"mentor": [PROMPT, summary] + turn(2) + turn(3)}
+
+
+def test_window_that_does_not_line_up_is_rebased(sqlite_storage, unbuffered):
+    user = BotUser("42")
+    converse(user, 2)
+    edited = {"mentor": [PROMPT] + turn(8) + turn(9) + turn(10) + turn(11)}  # Not the stored window plus one turn
+    user.commit_turn("mentor", edited, "question 11", "answer 11")
+
+    head = sqlite_storage.load_memory_head("42", "mentor")
+    assert (head["turn_count"], head["window_start"]) == (6, 2)  # The whole window re-appended
+    assert BotUser("42").get_memory("mentor") == edited
+
+
+def test_reset_memory_clears_only_that_mode(sqlite_storage, unbuffered):
+    user = BotUser("42")
+    converse(user, 2)
+    coach = {"coach": [Message("system", MODE_PROMPTS["coach"])] + turn(0)}
+    user.commit_turn("coach", coach, "question 0", "answer 0")
+
+    BotUser("42").reset_memory("mentor")
+
+    assert BotUser("42").get_memory("mentor") == {"mentor": [PROMPT]}
+    assert BotUser("42").get_memory("coach") == coach
@@ -0,0 +1,72 @@
+import asyncio
+import pytest
+from telegram.error import RetryAfter, TimedOut
+from reply_streamer import StreamingReply, EMPTY_REPLY, PLACEHOLDER
+
+
+class FakeMessage:
+    """A Telegram message: `edit_errors` are raised by the next edits, in order (None: the edit succeeds)."""
+
+    def __init__(self, chat, text):
+        self.chat = chat
+        self.text = text
+
+    async def reply_text(self, text, parse_mode=None):
+        message = FakeMessage(self.chat, text)
+        self.chat.append(message)
+        return message
+
+    async def edit_text(self, text, parse_mode=None):
+        error = self.edit_errors.pop(0) if self.edit_errors else None
+        if error is not None:
+            raise error
+        self.text = text
+
+    edit_errors = []
+
+
+def streaming(edit_errors=()):
+    chat = []
+    reply = StreamingReply(FakeMessage(chat, "hello"), edit_interval=0)
+    FakeMessage.edit_errors = list(edit_errors)
+    return reply, chat
+
+
+def test_empty_reply_replaces_the_placeholder():
+    reply, chat = streaming()
+
+    async def scenario():
+        await reply.start()
+        await reply.push("   ")
+        await reply.finish()
+
+    asyncio.run(scenario())
+    assert [message.text for message in chat] == [EMPTY_REPLY]
+    assert reply.time_to_first_chunk is None
+
+
+def test_failed_intermediate_edit_does_not_stop_the_stream():
+    reply, chat = streaming([TimedOut()])
+
+    async def scenario():
+        await reply.start()
+        await reply.push("Hello")  # This edit times out
+        reply._blocked_until = 0
+        await reply.push(" there")
+        await reply.finish()
+
+    asyncio.run(scenario())
+    assert [message.text for message in chat] == ["🤖 *PM Pal:* Hello there"]
+
+
+def test_finish_raises_when_still_rate_limited_after_retries():
+    reply, chat = streaming([RetryAfter(0)] * 3)
+
+    async def scenario():
+        await reply.start()
+        reply.text = "Hello"
+        await reply.finish()
+
+    with pytest.raises(RetryAfter):
+        asyncio.run(scenario())
+    assert chat[0].text == PLACEHOLDER
@@ -0,0 +1,112 @@
+import time
+import asyncio
+import llm_router
+from llm_router import LLMRouter
+from routing_policy import CircuitBreaker
+
+
+class APIError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def make_router(monkeypatch, outcomes, fallback_providers=("claude",), retries=0):
+    """
+    A router over openai → claude whose openai stream fails with the next status in `outcomes`
+    (None: succeeds; an asyncio.Event: waits for it, then succeeds).
+    """
+    monkeypatch.setattr(llm_router, "LLM_BUILDERS", {"openai": lambda model: object(), "claude": lambda model: object()})
+    monkeypatch.setattr(llm_router, "PROVIDER_API_KEYS", {"openai": "test", "claude": "test"})
+    monkeypatch.setattr(llm_router, "LLM_MAX_RETRIES", retries)
+    monkeypatch.setattr(llm_router, "backoff_delay", lambda attempt: 0)
+    monkeypatch.setattr(llm_router, "LLM_HEDGE", False)
+    router = LLMRouter(provider="openai", fallback_providers=list(fallback_providers))
+    router.response_cache = None
+    router.breakers = {p: CircuitBreaker(failure_threshold=1, cooldown_seconds=0.05) for p in router.providers}
+
+    async def provider_stream(provider, tier, mode, messages, usage):
+        if provider == "openai":
+            status = outcomes.pop(0)
+            if isinstance(status, asyncio.Event):
+                await status.wait()
+            elif status is not None:
+                raise APIError(status)
+        yield f"{provider} says hi"
+        yield " and more"
+
+    router._provider_stream = provider_stream
+    return router
+
+
+async def turn(router):
+    usage = {}
+    reply, _ = await router.aget_response("1", "hello", "mentor", {}, usage)
+    return reply, usage.get("provider")  # No provider: the error was turned into the reply
+
+
+def test_non_retryable_error_on_half_open_trial_releases_it(monkeypatch):
+    router = make_router(monkeypatch, [503, 400, None])
+    breaker = router.breakers["openai"]
+
+    async def scenario():
+        assert (await turn(router))[1] == "claude"  # 503 opens the circuit
+        assert breaker.state == "open"
+        time.sleep(0.06)
+        assert (await turn(router))[1] == "claude"  # The half-open trial gets a 400
+        assert breaker.state == "half_open"
+        assert breaker.allow()  # The trial was given back...
+        breaker.release_trial()
+        assert (await turn(router))[1] == "openai"  # ...so the primary is tried again and recovers
+        assert breaker.state == "closed"
+
+    asyncio.run(scenario())
+
+
+def test_abandoned_half_open_trial_is_released(monkeypatch):
+    router = make_router(monkeypatch, [503, None])
+    breaker = router.breakers["openai"]
+
+    async def scenario():
+        await turn(router)
+        time.sleep(0.06)
+        stream = router.astream_response("1", "hello", "mentor", {})
+        assert await stream.__anext__() == "openai says hi"
+        await stream.aclose()  # e.g. the turn was cancelled mid-reply
+        assert breaker.state == "half_open"
+        assert breaker.allow()
+
+    asyncio.run(scenario())
+
+
+def test_forced_request_does_not_release_a_trial_held_by_another(monkeypatch):
+    trial_can_finish = asyncio.Event()
+    router = make_router(monkeypatch, [503, trial_can_finish, 400], fallback_providers=())
+    breaker = router.breakers["openai"]
+
+    async def scenario():
+        assert (await turn(router))[1] is None  # 503 opens the only provider's circuit
+        time.sleep(0.06)
+        trial = asyncio.ensure_future(turn(router))  # Claims the half-open trial and waits
+        await asyncio.sleep(0)
+        assert breaker._trial_in_flight
+        reply, provider = await turn(router)  # No trial left, but the last provider is still tried: a 400
+        assert provider is None and "HTTP 400" in reply
+        assert not breaker.allow()  # The first request's trial is still claimed
+        trial_can_finish.set()
+        assert (await trial)[1] == "openai"
+        assert breaker.state == "closed"
+
+    asyncio.run(scenario())
+
+
+def test_no_retries_once_the_circuit_opens(monkeypatch):
+    outcomes = [503, 503, 503]
+    router = make_router(monkeypatch, outcomes, retries=2)
+
+    async def scenario():
+        assert (await turn(router))[1] == "claude"
+        assert len(outcomes) == 2  # The first 503 opened the circuit: no retries on openai
+        assert router.breakers["openai"].state == "open"
+
+    asyncio.run(scenario())
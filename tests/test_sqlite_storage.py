@@ -0,0 +1,66 @@
+import sqlite3
+import pytest
+from bot_user import BotUser
+from chat_message import Message
+from prompts import MODE_PROMPTS
+from usage_rollups import daily_rollups, today
+
+
+class FailingLastStatement:
+    """Delegates to `storage`; the next batch gets a statement that fails after all of the turn's writes ran."""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.armed = True
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def batch(self):
+        batch = self.storage.batch()
+        if self.armed:
+            self.armed = False
+            batch._statements.append(("INSERT INTO no_such_table VALUES (1)", ()))
+        return batch
+
+
+def memory(n):
+    return {"mentor": [Message("system", MODE_PROMPTS["mentor"]), Message("user", f"question {n}"), Message("ai", "answer")]}
+
+
+def test_commit_turn_writes_everything_or_nothing(sqlite_storage, unbuffered):
+    user = BotUser("42")
+    user.storage = FailingLastStatement(sqlite_storage)
+    with pytest.raises(sqlite3.OperationalError):
+        user.commit_turn("mentor", memory(0), "question 0", "answer")
+
+    day = today()
+    assert sqlite_storage.load_memory_head("42", "mentor") is None
+    assert sqlite_storage.load_memory_turns("42", "mentor", 0) == []
+    assert sqlite_storage.get_usage_count("42") == 0
+    assert list(sqlite_storage.iter_history("42")) == []
+    assert daily_rollups(day, day, storage=sqlite_storage)[day] == {}
+
+    user.commit_turn("mentor", memory(0), "question 0", "answer")
+    assert sqlite_storage.load_memory_head("42", "mentor")["turn_count"] == 1
+    assert sqlite_storage.get_usage_count("42") == 1
+    assert [entry["mode"] for entry in sqlite_storage.iter_history("42")] == ["mentor"]
+    assert daily_rollups(day, day, storage=sqlite_storage)[day]["turns"] == 1
+
+
+def test_rollups_and_active_markers(sqlite_storage):
+    batch = sqlite_storage.batch()
+    batch.increment_rollup("2026-01-01", {"turns": 1, "turns_by_mode.mentor": 1, "cost_usd": 0.25})
+    batch.increment_rollup("2026-01-01", {"turns": 2, "turns_by_mode.mentor": 2}, user_id="42")
+    batch.commit()
+    batch = sqlite_storage.batch()
+    batch.increment_rollup("2026-01-01", {"turns": 1, "turns_by_mode.coach": 1, "cost_usd": 0.5})
+    batch.commit()
+
+    assert sqlite_storage.load_rollups("2026-01-01", "2026-01-01") == {"2026-01-01": {
+        "date": "2026-01-01", "turns": 2, "turns_by_mode": {"mentor": 1, "coach": 1}, "cost_usd": 0.75
+    }}
+    assert sqlite_storage.load_rollups("2026-01-01", "2026-01-01", user_id="42")["2026-01-01"]["turns"] == 2
+    assert sqlite_storage.mark_active("2026-01-01", "42", "mentor")
+    assert not sqlite_storage.mark_active("2026-01-01", "42", "mentor")
+    assert sqlite_storage.mark_active("2026-01-01", "42")  # The all-modes marker is separate
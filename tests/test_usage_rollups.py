@@ -0,0 +1,69 @@
+import pytest
+from bot_user import BotUser
+from chat_message import Message
+from prompts import MODE_PROMPTS
+from usage_rollups import RollupAggregator, active_users, daily_rollups, today
+
+
+class FlakyStorage:
+    """Delegates to `storage`; after `after` successful batch commits, the next `fail_commits` raise."""
+
+    def __init__(self, storage, fail_commits=0, after=0):
+        self.storage = storage
+        self.fail_commits = fail_commits
+        self.after = after
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def batch(self):
+        batch = self.storage.batch()
+        commit = batch.commit
+
+        def flaky_commit():
+            if self.after:
+                self.after -= 1
+            elif self.fail_commits:
+                self.fail_commits -= 1
+                raise RuntimeError("storage unavailable")
+            commit()
+
+        batch.commit = flaky_commit
+        return batch
+
+
+def turn_memory(text):
+    return {"mentor": [Message("system", MODE_PROMPTS["mentor"]), Message("user", text), Message("ai", "reply")]}
+
+
+def test_failed_turn_does_not_leave_the_user_marked_active(sqlite_storage, unbuffered):
+    user = BotUser("42")
+    user.storage = FlakyStorage(sqlite_storage, fail_commits=1)
+    with pytest.raises(RuntimeError):
+        user.commit_turn("mentor", turn_memory("hi"), "hi", "reply")
+    user.commit_turn("mentor", turn_memory("hi"), "hi", "reply")  # The retried turn
+
+    day = today()
+    assert active_users(day, day, storage=sqlite_storage)[day] == {"total": 1, "by_mode": {"mentor": 1}}
+    assert daily_rollups(day, day, storage=sqlite_storage)[day]["turns"] == 1
+
+
+def test_failed_flush_keeps_counters_for_the_next_without_double_counting(sqlite_storage, monkeypatch):
+    import usage_rollups
+    monkeypatch.setattr(usage_rollups, "MAX_ROLLUPS_PER_BATCH", 1)  # One document per commit
+    aggregator = RollupAggregator()
+    for user_id, mode in (("1", "mentor"), ("2", "coach"), ("1", "mentor")):
+        aggregator.record_turn(user_id, mode, usage={"input_tokens": 10, "cached_input_tokens": 4}, day="2026-01-01")
+
+    with pytest.raises(RuntimeError):  # The first rollup document is written, the second commit fails
+        aggregator.flush(FlakyStorage(sqlite_storage, fail_commits=1, after=1))
+    assert aggregator.stats()["pending_rollups"] == 2
+    assert aggregator.flush(sqlite_storage) == 2
+
+    day = "2026-01-01"
+    totals = daily_rollups(day, day, storage=sqlite_storage)[day]
+    assert (totals["turns"], totals["input_tokens"], totals["cached_input_tokens"]) == (3, 30, 12)
+    assert active_users(day, day, storage=sqlite_storage)[day] == {"total": 2, "by_mode": {"mentor": 1, "coach": 1}}
+    user = daily_rollups(day, day, user_id="1", storage=sqlite_storage)[day]
+    assert (user["turns"], user["turns_by_mode"]) == (2, {"mentor": 2})
+    assert aggregator.flush(sqlite_storage) == 0
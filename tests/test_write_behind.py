@@ -0,0 +1,125 @@
+import os
+import time
+import threading
+import pytest
+import write_behind as write_behind_module
+from write_behind import WriteBehindBuffer
+from sqlite_storage import SqliteStorage
+
+
+class BlockingStorage:
+    """Delegates to `storage`, but its `block_at`-th batch commit hangs (a crash mid-write) until released."""
+
+    def __init__(self, storage, block_at):
+        self.storage = storage
+        self.block_at = block_at
+        self.commits = 0
+        self.blocked = threading.Event()
+        self.release = threading.Event()
+
+    def batch(self):
+        batch = self.storage.batch()
+        commit = batch.commit
+
+        def blocking_commit():
+            self.commits += 1
+            if self.commits == self.block_at:
+                self.blocked.set()
+                self.release.wait()
+                raise RuntimeError("process died")
+            commit()
+
+        batch.commit = blocking_commit
+        return batch
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    storage = SqliteStorage(str(tmp_path / "pm_pal.sqlite3"))
+    current = {"storage": storage}
+    monkeypatch.setattr(write_behind_module, "get_storage", lambda: current["storage"])
+    storage.current = current
+    return storage
+
+
+def spill(path, count):
+    """Leave `count` history records in the spill file, as a run that couldn't write them would."""
+    buffer = WriteBehindBuffer(spill_path=path)
+    buffer.close()
+    for i in range(count):
+        buffer.add_history("42", {"timestamp": f"2026-01-01T00:00:{i:02d}", "n": i})
+
+
+def replayed(storage):
+    return sorted(entry["n"] for entry in storage.iter_history("42") if "n" in entry)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_spill_is_replayed_on_restart_in_bounded_chunks(storage, tmp_path):
+    path = str(tmp_path / "spill.jsonl")
+    spill(path, 25)
+    buffer = WriteBehindBuffer(batch_size=10, flush_seconds=0.05, max_pending=20, spill_path=path)
+    buffer.add_history("42", {"timestamp": "2026-01-02T00:00:00", "live": True})
+    wait_for(lambda: not os.path.exists(path + ".replay"))
+    buffer.close()
+    assert replayed(storage) == list(range(25))
+    assert len(list(storage.iter_history("42"))) == 26
+    assert not os.path.exists(path) and not os.path.exists(path + ".replay.offset")
+
+
+@pytest.mark.parametrize("block_at", [2, 3])  # Mid-replay, and on the last chunk (after EOF was read)
+def test_replay_interrupted_by_a_crash_resumes_without_loss_or_duplicates(storage, tmp_path, block_at):
+    path = str(tmp_path / "spill.jsonl")
+    spill(path, 25)
+    blocking = BlockingStorage(storage, block_at)
+    storage.current["storage"] = blocking
+    crashed = WriteBehindBuffer(batch_size=10, flush_seconds=0.05, max_pending=20, max_retries=0, spill_path=path)
+    crashed._start()
+    assert blocking.blocked.wait(5)
+    assert replayed(storage) == list(range(10 * (block_at - 1)))
+    assert os.path.exists(path + ".replay")  # Not deleted while records read from it are unwritten
+
+    # The process is gone: a new one starts on the same files
+    storage.current["storage"] = storage
+    restarted = WriteBehindBuffer(batch_size=10, flush_seconds=0.05, max_pending=20, spill_path=path)
+    restarted._start()
+    wait_for(lambda: not os.path.exists(path + ".replay"))
+    restarted.close()
+    assert replayed(storage) == list(range(25))
+
+    crashed._closed = True  # Let the stuck thread exit without touching the files again
+    crashed._replay_file = None
+    blocking.release.set()
+
+
+def test_close_mid_replay_keeps_the_rest_on_disk(storage, tmp_path):
+    path = str(tmp_path / "spill.jsonl")
+    spill(path, 25)
+    blocking = BlockingStorage(storage, 2)
+    storage.current["storage"] = blocking
+    buffer = WriteBehindBuffer(batch_size=10, flush_seconds=0.05, max_pending=20, max_retries=0, spill_path=path)
+    buffer._start()
+    assert blocking.blocked.wait(5)
+    closing = threading.Thread(target=buffer.close)
+    closing.start()
+    wait_for(lambda: buffer._closed)
+    blocking.release.set()  # The second batch fails and is spilled again...
+    closing.join()  # ...and the third is left in the replay file
+
+    storage.current["storage"] = storage
+    restarted = WriteBehindBuffer(batch_size=10, flush_seconds=0.05, max_pending=20, spill_path=path)
+    restarted._start()
+    wait_for(lambda: not os.path.exists(path + ".replay"))
+    restarted.close()
+    assert replayed(storage) == list(range(10)) + list(range(20, 25))
+    restarted = WriteBehindBuffer(batch_size=10, flush_seconds=0.05, max_pending=20, spill_path=path)
+    restarted._start()  # The re-spilled batch is replayed by the next start
+    wait_for(lambda: not os.path.exists(path + ".replay"))
+    restarted.close()
+    assert replayed(storage) == list(range(25))
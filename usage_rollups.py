@@ -0,0 +1,232 @@
+import sys
+import argparse
+import threading
+from collections import Counter
+from datetime import datetime, date, timedelta
+from storage import get_storage
+from write_behind import write_behind
+
+# ======================== #
+#  Usage Rollups           #
+# ======================== #
+# Pre-aggregated usage counters, so dashboards don't have to scan one metric event per reply
+# across every user. For each day there is one global rollup document and one per active user:
+#
+#   usage_rollups/{day}                  global counters
+#   usage_rollups/{day}/active_users/*   one marker per (user) and (user, mode) active that day
+#   users/{user_id}/usage_daily/{day}    the user's own counters
+#
+#   turns, turns_by_mode.{mode}, turns_by_source.{text|voice}, turns_by_mode_source.{mode}_{source},
+#   input_tokens, cached_input_tokens, output_tokens, cost_usd, and (global only) active_users, active_users_by_mode.{mode}
+#
+#   - Writes: BotUser.commit_turn records each turn in the process-wide `rollups` aggregator.
+#     The write-behind thread flushes it every WRITE_BEHIND_FLUSH_SECONDS, as one atomic
+#     increment per (day, rollup document), however many turns it covers. Without WRITE_BEHIND
+#     the increments are added to the turn's own batch instead, and the active-user marker is
+#     created (and counted) only once that batch is committed.
+#   - Active users are counted once per day across all processes: a marker document is
+#     created (Storage.mark_active), and only the process whose create succeeds increments
+#     the counter. Each process remembers the users it already marked, so that check costs
+#     one write per user, mode and day.
+#   - Reads: `daily_rollups`, `turns_per_mode` and `active_users` read one document per day
+#     with activity, whatever the number of users or turns.
+# Turns still waiting in the aggregator (a few seconds at most) are not visible to queries yet.
+#
+#   python usage_rollups.py --days 7                 # global turns and active users per mode
+#   python usage_rollups.py --days 30 --user 12345   # one user's turns per mode
+
+MAX_ROLLUPS_PER_BATCH = 400  # Firestore allows 500 writes per batch
+
+
+def today():
+    return datetime.utcnow().date().isoformat()
+
+
+def turn_counters(mode, source, usage=None):
+    """The counters one conversation turn adds to its day's rollups."""
+    counters = {
+        "turns": 1,
+        f"turns_by_mode.{mode}": 1,
+        f"turns_by_source.{source}": 1,
+        f"turns_by_mode_source.{mode}_{source}": 1,
+    }
+    for key in ("input_tokens", "cached_input_tokens", "output_tokens", "cost_usd"):
+        if usage and usage.get(key):
+            counters[key] = usage[key]
+    return counters
+
+
+def _active_field(mode):
+    return "active_users" if mode is None else f"active_users_by_mode.{mode}"
+
+
+class RollupAggregator:
+    def __init__(self):
+        self._counters = {}  # (day, user_id or None for global) -> Counter
+        self._active = set()  # (day, user_id, mode or None) to mark active on the next flush
+        self._marked = set()  # (day, user_id, mode or None) this process already marked
+        self._lock = threading.Lock()
+        self.turns = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+
+    def record_turn(self, user_id, mode, source="text", usage=None, day=None):
+        """Add a turn to the pending counters (written by the next `flush`)."""
+        day = day or today()
+        counters = turn_counters(mode, source, usage)
+        with self._lock:
+            for scope in (None, user_id):
+                self._counters.setdefault((day, scope), Counter()).update(counters)
+            for active_mode in (None, mode):
+                if (day, user_id, active_mode) not in self._marked:
+                    self._active.add((day, user_id, active_mode))
+            self.turns += 1
+
+    def apply_turn(self, batch, user_id, mode, source="text", usage=None, day=None):
+        """
+        Unbuffered variant (WRITE_BEHIND off): add the turn's increments to its own `batch`.
+        Returns the day; once the batch is committed, pass it to `record_active`.
+        """
+        day = day or today()
+        counters = turn_counters(mode, source, usage)
+        batch.increment_rollup(day, counters)
+        batch.increment_rollup(day, counters, user_id=user_id)
+        return day
+
+    def record_active(self, storage, user_id, mode, day):
+        """
+        After `apply_turn`'s batch is committed: mark the user active and write the count now.
+        Marking before the commit would count nobody if the batch then failed (the marker
+        would exist without its increment). A failed flush keeps the count for the next one.
+        """
+        with self._lock:
+            for active_mode in (None, mode):
+                if (day, user_id, active_mode) not in self._marked:
+                    self._active.add((day, user_id, active_mode))
+        try:
+            self.flush(storage)
+        except Exception as e:
+            print("⚠️ Usage rollup flush failed (retried on the next flush):", e, flush=True)
+
+    def _mark(self, storage, day, user_id, mode):
+        """Mark the user active; True if this call is the one that counts them."""
+        key = (day, user_id, mode)
+        with self._lock:
+            if key in self._marked:
+                return False
+        first = storage.mark_active(day, user_id, mode)
+        with self._lock:
+            self._marked.add(key)
+        return first
+
+    def flush(self, storage=None):
+        """Write the pending counters; on failure they are kept for the next flush. Returns the documents written."""
+        with self._lock:
+            counters, self._counters = self._counters, {}
+            active, self._active = self._active, set()
+        if not counters and not active:
+            return 0
+        storage = storage or get_storage()
+        active = sorted(active, key=str)
+        unwritten = None  # Set once the counters are complete (all active users marked)
+        try:
+            while active:
+                day, user_id, mode = active[-1]
+                if self._mark(storage, day, user_id, mode):
+                    counters.setdefault((day, None), Counter())[_active_field(mode)] += 1
+                active.pop()
+            unwritten = list(counters.items())
+            while unwritten:
+                chunk = unwritten[:MAX_ROLLUPS_PER_BATCH]
+                batch = storage.batch()
+                for (day, user_id), values in chunk:
+                    batch.increment_rollup(day, dict(values), user_id=user_id)
+                batch.commit()
+                del unwritten[:len(chunk)]
+        except Exception:
+            self.failed_flushes += 1
+            with self._lock:
+                for key, values in (counters.items() if unwritten is None else unwritten):
+                    self._counters.setdefault(key, Counter()).update(values)
+                self._active.update(active)
+            raise
+        finally:
+            self._forget_old_days()
+        self.flushes += 1
+        return len(counters)
+
+    def _forget_old_days(self):
+        cutoff = (datetime.utcnow().date() - timedelta(days=1)).isoformat()
+        with self._lock:
+            self._marked = {key for key in self._marked if key[0] >= cutoff}
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._counters)
+        return {"turns": self.turns, "pending_rollups": pending, "flushes": self.flushes,
+                "failed_flushes": self.failed_flushes}
+
+
+rollups = RollupAggregator()  # Shared by every BotUser in this process
+write_behind.add_aggregator(rollups)
+
+
+# ------------------------------------------------------------------ #
+# Queries
+# ------------------------------------------------------------------ #
+
+def _day(value):
+    return value.isoformat() if isinstance(value, date) else str(value)
+
+
+def _days(start_day, end_day):
+    day, end = date.fromisoformat(_day(start_day)), date.fromisoformat(_day(end_day))
+    while day <= end:
+        yield day.isoformat()
+        day += timedelta(days=1)
+
+
+def daily_rollups(start_day, end_day, user_id=None, storage=None):
+    """{day: counters} for every day from `start_day` to `end_day` (global, or one user's); days without activity are {}."""
+    storage = storage or get_storage()
+    found = storage.load_rollups(_day(start_day), _day(end_day), user_id=user_id)
+    return {day: found.get(day, {}) for day in _days(start_day, end_day)}
+
+
+def turns_per_mode(start_day, end_day, user_id=None, storage=None):
+    """{day: {mode: turns}} (global, or one user's)."""
+    rollups_by_day = daily_rollups(start_day, end_day, user_id=user_id, storage=storage)
+    return {day: dict(counters.get("turns_by_mode", {})) for day, counters in rollups_by_day.items()}
+
+
+def active_users(start_day, end_day, storage=None):
+    """{day: {"total": distinct active users, "by_mode": {mode: distinct active users}}}."""
+    rollups_by_day = daily_rollups(start_day, end_day, storage=storage)
+    return {
+        day: {"total": counters.get("active_users", 0), "by_mode": dict(counters.get("active_users_by_mode", {}))}
+        for day, counters in rollups_by_day.items()
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show daily turns and active users per mode from the usage rollups.")
+    parser.add_argument("--days", type=int, default=7, help="Number of days up to today (default: 7)")
+    parser.add_argument("--user", help="Show one user's turns instead of the global rollups")
+    args = parser.parse_args(argv)
+
+    end = datetime.utcnow().date()
+    start = end - timedelta(days=args.days - 1)
+    turns = turns_per_mode(start, end, user_id=args.user)
+    active = {} if args.user else active_users(start, end)
+    for day, by_mode in turns.items():
+        line = f"{day}  turns {sum(by_mode.values()):>6}  " + ", ".join(f"{mode}: {n}" for mode, n in sorted(by_mode.items()))
+        if day in active:
+            users = active[day]
+            line += f"  | active users {users['total']} (" + ", ".join(
+                f"{mode}: {n}" for mode, n in sorted(users["by_mode"].items())) + ")"
+        print(line, flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
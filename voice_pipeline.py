@@ -0,0 +1,83 @@
+import asyncio
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from config import OPENAI_API_KEY, VOICE_TRANSCODE_WORKERS
+from startup_timing import timed
+
+# ======================== #
+#  Voice Pipeline          #
+# ======================== #
+# Turns a Telegram voice note into text, entirely in memory:
+#   1. download the voice note into a bytes buffer (no shared file on disk, so concurrent
+#      voice messages can't overwrite each other)
+#   2. send the OGG/Opus audio straight to Whisper, which accepts it as-is
+#   3. only if Whisper rejects the audio, transcode it to a small mono MP3 by piping it
+#      through ffmpeg (stdin → stdout) on a bounded worker pool, and retry once
+# The OpenAI SDK and the Whisper client are loaded on the first voice note, not at startup.
+
+_whisper_client = None
+transcode_executor = ThreadPoolExecutor(max_workers=VOICE_TRANSCODE_WORKERS, thread_name_prefix="voice-transcode")
+
+
+def get_whisper_client():
+    """The OpenAI client for the Whisper API, created on first use."""
+    global _whisper_client
+    if _whisper_client is None:
+        with timed("openai (Whisper client)", lazy=True):
+            from openai import AsyncOpenAI
+            _whisper_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+    return _whisper_client
+
+
+def _ffmpeg_path():
+    try:
+        import imageio_ffmpeg  # Ships a static ffmpeg binary, so the container needs no system ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except ImportError:
+        return shutil.which("ffmpeg") or "ffmpeg"
+
+
+def transcode_to_mp3(audio_bytes):
+    """Transcode any audio ffmpeg understands into 16 kHz mono MP3 (speech quality), via pipes."""
+    result = subprocess.run(
+        [
+            _ffmpeg_path(), "-hide_banner", "-loglevel", "error",
+            "-i", "pipe:0",
+            "-vn", "-ac", "1", "-ar", "16000", "-b:a", "32k",
+            "-f", "mp3", "pipe:1",
+        ],
+        input=audio_bytes,
+        capture_output=True,
+        check=True,
+        timeout=60
+    )
+    return result.stdout
+
+
+async def download_voice(bot, file_id):
+    """Download a Telegram voice note into memory."""
+    voice_file = await bot.get_file(file_id)
+    return bytes(await voice_file.download_as_bytearray())
+
+
+async def transcribe(audio_bytes, filename="voice.ogg"):
+    """Transcribe audio with Whisper, transcoding to MP3 only if the original format is rejected."""
+    from openai import BadRequestError
+    whisper_client = get_whisper_client()
+    try:
+        response = await whisper_client.audio.transcriptions.create(
+            model="whisper-1",
+            file=(filename, audio_bytes)
+        )
+        return response.text
+    except BadRequestError as e:
+        print("🎙️ Whisper rejected the original audio, transcoding to MP3:", e, flush=True)
+
+    loop = asyncio.get_running_loop()
+    mp3_bytes = await loop.run_in_executor(transcode_executor, transcode_to_mp3, audio_bytes)
+    response = await whisper_client.audio.transcriptions.create(
+        model="whisper-1",
+        file=("voice.mp3", mp3_bytes)
+    )
+    return response.text
@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import atexit
+import threading
+from config import WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_FLUSH_SECONDS, WRITE_BEHIND_MAX_RETRIES
+from config import WRITE_BEHIND_MAX_PENDING, WRITE_BEHIND_SPILL_PATH
+from storage import get_storage
+
+# ======================== #
+#  Write-Behind Buffer     #
+# ======================== #
+# history_logs entries and metric events are only read by analytics, so the user shouldn't
+# wait for them. BotUser hands them to this buffer, and a background thread writes them:
+#   - records are written in batches: when WRITE_BEHIND_BATCH_SIZE are waiting, or every
+#     WRITE_BEHIND_FLUSH_SECONDS
+#   - a failed batch is retried with exponential backoff (WRITE_BEHIND_MAX_RETRIES times)
+#   - records that still can't be written, or that arrive while too many are already waiting,
+#     are appended to a local JSONL spill file; it is replayed the next time the buffer starts,
+#     a chunk at a time (never more than half of WRITE_BEHIND_MAX_PENDING in memory; the rest
+#     stays on disk), so a large spill left by a long outage doesn't flood memory or storage.
+#     After each replayed batch is written (or spilled again), the offset replayed so far is
+#     saved next to the file; the file is only deleted once every record in it is written. A
+#     replay cut short by a crash or shutdown resumes from that offset: nothing is lost, and at
+#     most the batch in flight is written twice
+#   - `close()` (called on shutdown, and at interpreter exit) writes out everything pending
+#   - aggregators registered with `add_aggregator` (the usage rollups, see usage_rollups.py)
+#     are flushed by the same thread after each cycle, and once more on close
+# Memory and the usage counter are NOT buffered: the next turn and the free-tier check need them.
+
+
+class WriteBehindBuffer:
+    def __init__(self, batch_size=WRITE_BEHIND_BATCH_SIZE, flush_seconds=WRITE_BEHIND_FLUSH_SECONDS,
+                 max_retries=WRITE_BEHIND_MAX_RETRIES, max_pending=WRITE_BEHIND_MAX_PENDING,
+                 spill_path=WRITE_BEHIND_SPILL_PATH):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+        self.spill_path = spill_path
+        self._pending = []  # (kind, user_id, record), kind is "history" or "metric"
+        self._cond = threading.Condition()
+        self._spill_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._aggregators = []
+        self._replay_file = None  # Spill file being replayed (binary, for exact offsets), read a chunk at a time
+        self._replay_eof = False
+        self._replaying = []  # (record, offset just past it in the replay file), read but not written yet
+        self.enqueued = 0
+        self.written = 0
+        self.failed_flushes = 0
+        self.spilled = 0
+
+    def add_history(self, user_id, entry):
+        self._enqueue("history", user_id, entry)
+
+    def add_metric(self, user_id, event):
+        self._enqueue("metric", user_id, event)
+
+    def add_aggregator(self, aggregator):
+        """Flush `aggregator` (an object with a `flush()` method) from the write-behind thread."""
+        self._aggregators.append(aggregator)
+
+    def _enqueue(self, kind, user_id, record):
+        with self._cond:
+            if self._closed:
+                self._spill([(kind, user_id, record)])
+                return
+            self._start()
+            if len(self._pending) >= self.max_pending:
+                self._spill([(kind, user_id, record)])  # Storage is far behind: don't grow without bound
+                return
+            self._pending.append((kind, user_id, record))
+            self.enqueued += 1
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def _start(self):
+        """Start the flusher thread on first use (and replay records spilled by an earlier run)."""
+        if self._thread is not None:
+            return
+        self._open_replay()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._refill_from_replay()
+            with self._cond:
+                if not self._closed and len(self._pending) < self.batch_size and not self._replaying:
+                    self._cond.wait(self.flush_seconds)
+                records, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+                closed = self._closed
+            if records:
+                self._write(records)
+            if self._replaying and not closed:  # On close, the rest of the replay stays on disk
+                self._write_replayed()
+            self._flush_aggregators()
+            if not records and closed:
+                return
+
+    def _flush_aggregators(self):
+        for aggregator in self._aggregators:
+            try:
+                aggregator.flush()
+            except Exception as e:
+                # The aggregator keeps what it couldn't write and retries on the next cycle
+                self.failed_flushes += 1
+                print(f"⚠️ Write-behind flush of {type(aggregator).__name__} failed:", e, flush=True)
+
+    def _write(self, records):
+        for attempt in range(self.max_retries + 1):
+            try:
+                batch = get_storage().batch()
+                for kind, user_id, record in records:
+                    if kind == "history":
+                        batch.add_history(user_id, record)
+                    else:
+                        batch.add_metric(user_id, record)
+                batch.commit()
+                self.written += len(records)
+                return
+            except Exception as e:
+                self.failed_flushes += 1
+                print(f"⚠️ Write-behind flush of {len(records)} records failed (attempt {attempt + 1}):", e, flush=True)
+                if attempt < self.max_retries and not self._closed:
+                    time.sleep(min(30, 0.5 * 2 ** attempt))
+        self._spill(records)
+
+    def _spill(self, records):
+        """Append records to the local spill file (JSONL); they are retried on the next start."""
+        with self._spill_lock:
+            directory = os.path.dirname(self.spill_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for kind, user_id, record in records:
+                    f.write(json.dumps({"kind": kind, "user_id": user_id, "record": record}, default=str) + "\n")
+            self.spilled += len(records)
+        print(f"💾 Spilled {len(records)} history/metric records to {self.spill_path}", flush=True)
+
+    def _replay_path(self):
+        return self.spill_path + ".replay"
+
+    def _offset_path(self):
+        return self._replay_path() + ".offset"
+
+    def _open_replay(self):
+        """Move the spill file aside and start replaying it (new spills go to a fresh file)."""
+        with self._spill_lock:
+            replay_path = self._replay_path()
+            offset = 0
+            if os.path.exists(replay_path):  # Left by a run that stopped mid-replay: resume it
+                if os.path.exists(self._offset_path()):
+                    with open(self._offset_path(), encoding="utf-8") as f:
+                        offset = int(f.read().strip() or 0)
+            elif os.path.exists(self.spill_path):
+                os.replace(self.spill_path, replay_path)
+            else:
+                return
+            self._replay_file = open(replay_path, "rb")
+            self._replay_file.seek(offset)
+            self._replay_eof = False
+        print(f"♻️ Replaying spilled history/metric records from {replay_path} (offset {offset})", flush=True)
+
+    def _refill_from_replay(self):
+        """Read the next chunk of the spill being replayed, if fewer than half of max_pending are waiting."""
+        if self._replay_file is None or self._replay_eof or self._closed:
+            return
+        room = self.max_pending // 2 - len(self._replaying)
+        if room <= 0:
+            return
+        with self._spill_lock:
+            if self._replay_file is None:
+                return
+            while room > 0:
+                line = self._replay_file.readline()
+                if not line:
+                    self._replay_eof = True
+                    break
+                if line.strip():
+                    item = json.loads(line)
+                    self._replaying.append(((item["kind"], item["user_id"], item["record"]), self._replay_file.tell()))
+                    room -= 1
+            if self._replay_eof and not self._replaying:
+                self._finish_replay()
+
+    def _write_replayed(self):
+        """Write a batch of replayed records, then save how far into the replay file we are."""
+        chunk = self._replaying[:self.batch_size]
+        self._write([record for record, _ in chunk])  # Written, or spilled again: done with either way
+        del self._replaying[:len(chunk)]
+        with self._spill_lock:
+            if self._replay_file is None:
+                return
+            if self._replay_eof and not self._replaying:
+                self._finish_replay()
+                return
+            temp_path = self._offset_path() + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(str(chunk[-1][1]))
+            os.replace(temp_path, self._offset_path())
+
+    def _finish_replay(self):
+        """Every record of the replay file is written: delete it."""
+        self._replay_file.close()
+        self._replay_file = None
+        os.remove(self._replay_path())
+        if os.path.exists(self._offset_path()):
+            os.remove(self._offset_path())
+
+    def close(self, timeout=30):
+        """Write out everything pending and stop the flusher (records it can't write are spilled)."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        else:
+            self._flush_aggregators()
+        with self._cond:
+            leftover, self._pending = self._pending, []
+        if leftover:
+            self._spill(leftover)
+        with self._spill_lock:
+            if self._replay_file is not None:
+                # Records not written yet stay in the replay file, resumed from the saved offset
+                self._replay_file.close()
+                self._replay_file = None
+                self._replaying = []
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "failed_flushes": self.failed_flushes,
+            "spilled": self.spilled,
+        }
+
+
+write_behind = WriteBehindBuffer()  # Shared by every BotUser in this process
+atexit.register(write_behind.close)